@@ -3,6 +3,8 @@ Android屏幕截图模块
 使用MediaProjection API实现屏幕截图功能
 """
 
+import struct
+import subprocess
 from kivy.logger import Logger
 from kivy.utils import platform
 
@@ -14,16 +16,54 @@ except ImportError:
     NUMPY_AVAILABLE = False
     Logger.warning("NumPy不可用，Android截图功能可能受限")
 
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+if NUMPY_AVAILABLE:
+    from frame_pool import FramePool
+    from shell_capture_worker import (
+        ShellCaptureWorker, SCREENCAP_HEADER_SIZE, SCREENCAP_MAX_HEADER_SIZE, SCREENCAP_RGBA_FORMATS
+    )
+
 class AndroidScreenCapture:
     """Android屏幕截图类"""
     
-    def __init__(self):
+    # shell截图模式：'raw' 直接从screencap标准输出读取原始像素；'png' 旧的PNG文件方式
+    SHELL_MODES = ('raw', 'png')
+    # 原始截图进程的超时时间（秒）
+    RAW_CAPTURE_TIMEOUT = 5
+    
+    def __init__(self, shell_mode='raw', persistent_shell=True, screencap_command='screencap',
+                 analysis_scale=1.0, frame_pool=None):
         self.is_android = platform == 'android'
         self.media_projection = None
         self.virtual_display = None
         self.image_reader = None
         self.permission_granted = False
         
+        self.shell_mode = shell_mode if shell_mode in self.SHELL_MODES else 'raw'
+        # 分析分辨率比例：截图在源头缩小到该比例（VirtualDisplay直接按缩小尺寸创建），
+        # 匹配坐标由ImageProcessor映射回设备坐标
+        self.analysis_scale = analysis_scale
+        self.screencap_command = screencap_command
+        # 原始截图读取缓冲区，按帧大小分配一次后重复使用
+        self._raw_buffer = None
+        # MediaProjection平面缓冲区，同样按帧大小分配一次
+        self._plane_buffer = None
+        # 输出的BGR帧从缓冲池取出，使用方用完后归还（frame_pool.release）即可复用
+        self.frame_pool = frame_pool or (FramePool() if NUMPY_AVAILABLE else None)
+        
+        # capture_screen使用的粘性后端选择器，首次截图时创建
+        self.backend_selector = None
+        
+        # 常驻shell：所有原始截图请求复用同一个sh进程，首次截图时启动
+        self.shell_worker = None
+        if persistent_shell and NUMPY_AVAILABLE:
+            self.shell_worker = ShellCaptureWorker(command=screencap_command)
+        
         if self.is_android:
             self.init_media_projection()
         
@@ -128,10 +168,15 @@ class AndroidScreenCapture:
                 Logger.error("创建MediaProjection失败")
                 return False
             
+            # 按分析比例缩小的截图尺寸，由系统合成时直接缩放
+            capture_width = max(1, int(round(self.screen_width * self.analysis_scale)))
+            capture_height = max(1, int(round(self.screen_height * self.analysis_scale)))
+            capture_density = max(1, int(round(self.screen_density * self.analysis_scale)))
+            
             # 创建ImageReader
             self.image_reader = self.ImageReader.newInstance(
-                self.screen_width,
-                self.screen_height,
+                capture_width,
+                capture_height,
                 self.PixelFormat.RGBA_8888,
                 2  # maxImages
             )
@@ -139,9 +184,9 @@ class AndroidScreenCapture:
             # 创建VirtualDisplay
             self.virtual_display = self.media_projection.createVirtualDisplay(
                 "ScreenCapture",
-                self.screen_width,
-                self.screen_height,
-                self.screen_density,
+                capture_width,
+                capture_height,
+                capture_density,
                 0,  # flags
                 self.image_reader.getSurface(),
                 None,  # callback
@@ -156,6 +201,130 @@ class AndroidScreenCapture:
             Logger.error(f"开始截图失败: {e}")
             return False
     
+    def capture_screen_raw(self):
+        """
+        读取screencap原始输出截图（不编码PNG、不落盘、无固定等待）
+        
+        screencap不带-p参数时输出 头部 + RGBA像素，直接从进程标准输出
+        readinto到预分配的缓冲区，再转换为BGR数组。
+        启用常驻shell时由同一个sh进程执行screencap，否则每帧启动一个screencap进程
+        
+        返回:
+            numpy array: BGR格式的图像数据，与OpenCV兼容；失败时返回None
+        """
+        if not self.is_android or not NUMPY_AVAILABLE:
+            return None
+        
+        if self.shell_worker:
+            rgba = self.shell_worker.capture()
+            return self._rgba_to_bgr(rgba, self.analysis_scale) if rgba is not None else None
+        
+        try:
+            process = subprocess.Popen(self.screencap_command.split(),
+                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            try:
+                frame = self._read_raw_frame(process.stdout)
+            finally:
+                process.stdout.close()
+                exit_code = process.wait(timeout=self.RAW_CAPTURE_TIMEOUT)
+            
+            if exit_code != 0:
+                Logger.warning(f"screencap命令执行失败，退出码: {exit_code}")
+                return None
+            return frame
+            
+        except Exception as e:
+            Logger.error(f"原始截图失败: {e}")
+            return None
+    
+    def _read_raw_frame(self, stream):
+        """
+        从流中读取一帧screencap原始输出
+        
+        头部长度随系统版本不同（12或16字节），由 读取总长度 - 宽*高*4 得出
+        """
+        header = bytearray(SCREENCAP_HEADER_SIZE)
+        if self._read_into(stream, memoryview(header)) != SCREENCAP_HEADER_SIZE:
+            Logger.warning("screencap输出不完整：缺少头部")
+            return None
+        
+        width, height, pixel_format = struct.unpack('<III', header)
+        if pixel_format not in SCREENCAP_RGBA_FORMATS:
+            Logger.warning(f"不支持的screencap像素格式: {pixel_format}")
+            return None
+        
+        # 头部剩余部分 + 像素数据，缓冲区按最大头部长度预留
+        pixel_bytes = width * height * 4
+        capacity = SCREENCAP_MAX_HEADER_SIZE - SCREENCAP_HEADER_SIZE + pixel_bytes
+        if self._raw_buffer is None or len(self._raw_buffer) != capacity:
+            self._raw_buffer = bytearray(capacity)
+            Logger.info(f"原始截图缓冲区: {width}x{height}, {capacity} 字节")
+        
+        view = memoryview(self._raw_buffer)
+        total = self._read_into(stream, view)
+        extra_header = total - pixel_bytes
+        if extra_header < 0:
+            Logger.warning(f"screencap输出不完整: {total}/{pixel_bytes} 字节")
+            return None
+        
+        rgba = np.frombuffer(self._raw_buffer, dtype=np.uint8, count=pixel_bytes,
+                             offset=extra_header).reshape(height, width, 4)
+        return self._rgba_to_bgr(rgba, self.analysis_scale)
+    
+    @property
+    def raw_scale(self):
+        """
+        capture_screen_raw输出相对设备分辨率的实际比例
+        
+        无OpenCV时按整数步长抽取像素，实际比例为1/步长（如analysis_scale为0.4时步长2，比例0.5），
+        由ImageProcessor再缩放到分析比例
+        """
+        if self.analysis_scale == 1 or CV2_AVAILABLE:
+            return self.analysis_scale
+        return 1.0 / self._decimation_step(self.analysis_scale)
+    
+    @staticmethod
+    def _decimation_step(scale):
+        return max(1, int(round(1.0 / scale)))
+    
+    def _rgba_to_bgr(self, rgba, scale=1.0):
+        """
+        RGBA缓冲区视图转换为BGR数组（缓冲区下一帧会被覆盖）
+        
+        结果写入从帧缓冲池取出的数组；scale小于1时先缩小再转换：
+        OpenCV区域平均（与模板缩放方式一致），否则按步长抽取像素
+        """
+        scaled = None
+        if scale != 1:
+            height, width = rgba.shape[:2]
+            if CV2_AVAILABLE:
+                size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+                scaled = self.frame_pool.acquire((size[1], size[0], 4))
+                rgba = cv2.resize(rgba, size, dst=scaled, interpolation=cv2.INTER_AREA)
+            else:
+                step = self._decimation_step(scale)
+                rgba = rgba[::step, ::step]
+        
+        bgr = self.frame_pool.acquire(rgba.shape[:2] + (3,))
+        if CV2_AVAILABLE:
+            cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGR, dst=bgr)
+        else:
+            np.copyto(bgr, rgba[:, :, 2::-1])
+        
+        if scaled is not None:
+            self.frame_pool.release(scaled)
+        return bgr
+    
+    def _read_into(self, stream, view):
+        """循环readinto直到填满view或流结束，返回读取的字节数"""
+        total = 0
+        while total < len(view):
+            count = stream.readinto(view[total:])
+            if not count:
+                break
+            total += count
+        return total
+    
     def capture_screen_shell(self):
         """
         使用shell命令截图（无需MediaProjection权限）
@@ -232,6 +401,12 @@ class AndroidScreenCapture:
                 if image.mode != 'RGB':
                     image = image.convert('RGB')
                 
+                # 缩小到分析分辨率
+                if self.analysis_scale != 1:
+                    size = (max(1, int(round(image.width * self.analysis_scale))),
+                            max(1, int(round(image.height * self.analysis_scale))))
+                    image = image.resize(size, Image.BOX)
+                
                 # 返回PIL Image对象
                 # image_processor会处理PIL Image
                 return image
@@ -262,14 +437,20 @@ class AndroidScreenCapture:
             Logger.warning("非Android环境，无法截图")
             return None
         
-        # 优先使用shell命令截图（无需权限）
-        screenshot = self.capture_screen_shell()
-        if screenshot is not None:
-            return screenshot
-        
-        # 如果shell方法失败，尝试MediaProjection方法
-        Logger.info("Shell截图失败，尝试MediaProjection方法...")
+        # 原始screencap / MediaProjection / PNG screencap 三种方式：
+        # 固定使用上次成功的方式，失败的方式冷却一段时间后才会再次尝试
+        if self.backend_selector is None:
+            from capture_backends import BackendSelector, android_backends
+            self.backend_selector = BackendSelector(android_backends(self))
+        return self.backend_selector.capture()
+    
+    def capture_screen_projection(self):
+        """
+        使用MediaProjection截图（需要屏幕录制权限）
         
+        返回:
+            numpy array: BGR格式的图像数据，与OpenCV兼容；失败时返回None
+        """
         if not self.permission_granted:
             Logger.warning("屏幕录制权限未授予")
             return None
@@ -282,52 +463,19 @@ class AndroidScreenCapture:
                 Logger.warning("未能获取屏幕图像")
                 return None
             
-            # 获取Image的Plane
-            planes = image.getPlanes()
-            if not planes or len(planes) == 0:
+            try:
+                # 获取Image的Plane
+                planes = image.getPlanes()
+                if not planes or len(planes) == 0:
+                    return None
+                
+                rgba = self._read_plane(planes[0], image.getWidth(), image.getHeight())
+            finally:
+                # 像素已复制到Python缓冲区，立即归还Image
                 image.close()
-                return None
-            
-            plane = planes[0]
-            buffer = plane.getBuffer()
             
-            # 获取图像数据
-            pixel_stride = plane.getPixelStride()
-            row_stride = plane.getRowStride()
-            row_padding = row_stride - pixel_stride * self.screen_width
-            
-            # 将Buffer转换为numpy array
-            # 注意：这里需要使用pyjnius的buffer转换功能
-            from jnius import cast
-            import array
-            
-            # 读取buffer数据
-            buffer_size = buffer.remaining()
-            byte_array = array.array('b', [0] * buffer_size)
-            
-            # 复制数据
-            for i in range(buffer_size):
-                byte_array[i] = buffer.get(i)
-            
-            # 转换为numpy array
-            img_array = np.frombuffer(byte_array, dtype=np.uint8)
-            
-            # 重塑为图像格式 (height, width, channels)
-            # RGBA格式，4个通道
-            img_height = self.screen_height
-            img_width = self.screen_width + row_padding // pixel_stride
-            
-            img_array = img_array.reshape((img_height, img_width, 4))
-            
-            # 裁剪到实际宽度
-            img_array = img_array[:, :self.screen_width, :]
-            
-            # 转换RGBA到BGR（OpenCV格式）
-            # RGBA -> BGR
-            bgr_image = img_array[:, :, [2, 1, 0]]  # 只取RGB，转为BGR
-            
-            # 关闭Image
-            image.close()
+            # RGBA -> BGR（OpenCV格式），一次转换直接跳过行尾填充
+            bgr_image = self._rgba_to_bgr(rgba)
             
             Logger.info(f"成功截取屏幕: {bgr_image.shape}")
             return bgr_image
@@ -336,9 +484,41 @@ class AndroidScreenCapture:
             Logger.error(f"截取屏幕失败: {e}")
             return None
     
+    def _read_plane(self, plane, width, height):
+        """
+        把ImageReader的RGBA平面整体复制到复用的缓冲区
+        
+        buffer.get(byte[])一次JNI调用完成批量复制（pyjnius会把结果写回传入的bytearray），
+        再用按row_stride/pixel_stride构造的跨步视图去掉行尾填充，不额外复制
+        
+        返回:
+            numpy array: (高, 宽, 4) 的RGBA视图，指向复用缓冲区，下一帧会被覆盖
+        """
+        buffer = plane.getBuffer()
+        pixel_stride = plane.getPixelStride()
+        row_stride = plane.getRowStride()
+        
+        size = buffer.remaining()
+        if self._plane_buffer is None or len(self._plane_buffer) != size:
+            self._plane_buffer = bytearray(size)
+            Logger.info(f"MediaProjection缓冲区: {width}x{height}, 行跨度{row_stride}, {size} 字节")
+        
+        buffer.get(self._plane_buffer)
+        
+        pixels = np.frombuffer(self._plane_buffer, dtype=np.uint8)
+        return np.lib.stride_tricks.as_strided(
+            pixels,
+            shape=(height, width, 4),
+            strides=(row_stride, pixel_stride, 1),
+            writeable=False
+        )
+    
     def stop_capture(self):
         """停止截图"""
         try:
+            if self.shell_worker:
+                self.shell_worker.stop()
+            
             if self.virtual_display:
                 self.virtual_display.release()
                 self.virtual_display = None
@@ -0,0 +1,463 @@
+"""
+asyncio自动化引擎 - AutomationEngine的协程版本
+截图、匹配和点击在线程池中执行，以awaitable的形式提供；登录和委托流程由AsyncFlowMachine
+按flows/*.yaml执行，与AutomationEngine使用同一份流程定义。相互独立的等待可以用first_of组合
+
+运行方式：
+    无界面：python async_automation_engine.py [回放目录或视频]，或在线程中调用run()
+    模板诊断：python async_automation_engine.py 回放目录或视频 模板1,模板2,...
+              各模板分别等待（first_of竞争），输出最先出现的模板
+    主程序：main.py中勾选“asyncio引擎”后由该引擎执行
+    Kivy：App.async_run(async_lib='asyncio')启动界面后，在界面回调中调用start()，
+          流程与界面共用同一个事件循环，stop()可从任意线程调用
+"""
+
+import sys
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from kivy.logger import Logger
+
+from automation_engine import AutomationEngine
+from flow_engine import AsyncFlowMachine
+from capture_service import CaptureService
+from settle_detector import SettleDetector
+from cancellation import CancellationToken, OperationCancelled
+
+
+class AsyncAutomationEngine:
+    """
+    协程版自动化引擎
+
+    复用AutomationEngine的截图后端、图像处理器、点击控制和任务列表（不启动它的截图服务和流水线），
+    由事件循环中的截图任务按帧率截图，所有等待共享最新帧
+    """
+
+    CAPTURE_FPS = AutomationEngine.CAPTURE_FPS
+    DEFAULT_POLL = AutomationEngine.DEFAULT_POLL
+    STEP_TIMEOUT = AutomationEngine.STEP_TIMEOUT
+    # 同时进行匹配的线程数（竞争等待的各个分支并行匹配同一帧）
+    MATCH_WORKERS = 2
+
+    def __init__(self, analysis_scale=1.0, replay_source=None, replay_hold=None):
+        self.engine = AutomationEngine(use_capture_service=False, analysis_scale=analysis_scale,
+                                       replay_source=replay_source, replay_hold=replay_hold)
+        self.image_processor = self.engine.image_processor
+        self.game_controller = self.engine.game_controller
+        self.task_manager = self.engine.task_manager
+
+        self.is_running = False
+        self.current_task = None
+        self.last_stop_latency = None
+
+        # 截图和点击各用一个线程（保持顺序），匹配可并行
+        self._capture_executor = ThreadPoolExecutor(1, thread_name_prefix='async-capture')
+        self._match_executor = ThreadPoolExecutor(self.MATCH_WORKERS, thread_name_prefix='async-match')
+        self._action_executor = ThreadPoolExecutor(1, thread_name_prefix='async-action')
+
+        # 运行期间由run_async()设置
+        self._loop = None
+        self._task = None
+        self._frame_ready = None
+        # 最新帧 (帧序号, 截图开始时间, PreparedFrame)
+        self._frame = None
+        # 实测截图耗时（秒，指数平滑）
+        self._capture_latency = None
+
+    @property
+    def cancel_token(self):
+        return self.engine.cancel_token
+
+    def set_daily_commission_enabled(self, enabled):
+        self.engine.set_daily_commission_enabled(enabled)
+
+    # ---------- 运行控制 ----------
+
+    def run(self):
+        """无界面运行：在新的事件循环中执行完整流程（阻塞），返回是否成功"""
+        return asyncio.run(self.run_async())
+
+    def start(self, callback=None):
+        """
+        在当前线程正在运行的事件循环中启动流程（Kivy的async_run或其他asyncio程序）
+
+        参数:
+            callback: 流程结束后以是否成功为参数调用，在事件循环线程中执行
+
+        返回:
+            asyncio.Task
+        """
+        task = asyncio.get_running_loop().create_task(self.run_async())
+        if callback is not None:
+            task.add_done_callback(lambda done: callback(not done.cancelled() and done.result()))
+        return task
+
+    async def run_async(self):
+        """运行自动化流程，返回是否成功"""
+        engine = self.engine
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        self._frame_ready = asyncio.Condition()
+        self._frame = None
+
+        engine.cancel_token = CancellationToken()
+        engine.image_processor.cancel_token = engine.cancel_token
+        engine.is_running = self.is_running = True
+        pump = asyncio.create_task(self._pump_frames())
+
+        try:
+            Logger.info("开始执行自动化流程（asyncio）")
+            for task in self.task_manager.get_tasks():
+                Logger.info(f"执行任务: {task['name']}")
+                self.current_task = task
+
+                success = await self.execute_task(task)
+                if not success and task.get('required', True):
+                    Logger.error(f"必需任务失败: {task['name']}")
+                    return False
+
+                # 任务间延迟：画面静止即可开始下一个任务
+                await self.wait_settled(2)
+
+            Logger.info("✅ 自动化流程完成")
+            return True
+
+        except (asyncio.CancelledError, OperationCancelled):
+            Logger.info("自动化被中断")
+            return False
+        except Exception as e:
+            Logger.error(f"自动化执行异常: {e}")
+            return False
+
+        finally:
+            pump.cancel()
+            await asyncio.gather(pump, return_exceptions=True)
+            if engine.cancel_token.is_cancelled:
+                engine._report_stop_latency()
+                self.last_stop_latency = engine.last_stop_latency
+            engine.is_running = self.is_running = False
+            self.current_task = None
+            self._task = None
+            self.image_processor.flush_search_index()
+            Logger.info(f"📊 截图后端统计:\n{engine.get_capture_status()}")
+            if engine.wait_stats:
+                Logger.info(f"📊 画面等待统计:\n{engine.get_wait_stats()}")
+
+    def probe(self, names, timeout=10.0):
+        """
+        无界面诊断：启动截图任务，各模板分别等待、并行匹配（first_of），返回最先出现的模板名
+
+        超时或都没有出现时返回None（阻塞，不能在事件循环中调用）
+        """
+        return asyncio.run(self._probe(names, timeout))
+
+    async def _probe(self, names, timeout):
+        self._frame_ready = asyncio.Condition()
+        self._frame = None
+        self.engine.cancel_token = CancellationToken()
+        self.engine.image_processor.cancel_token = self.engine.cancel_token
+        self.engine.is_running = self.is_running = True
+        pump = asyncio.create_task(self._pump_frames())
+        try:
+            name, hit = await self.first_of({name: self.wait_for(name) for name in names}, timeout)
+            if name is not None:
+                Logger.info(f"🏁 最先出现: {name}（置信度{hit['result']['confidence']:.3f}，等待{hit['elapsed']:.2f}s）")
+            return name
+        finally:
+            pump.cancel()
+            await asyncio.gather(pump, return_exceptions=True)
+            self.engine.is_running = self.is_running = False
+
+    def stop(self):
+        """停止自动化（可从任意线程调用）：取消令牌和流程任务"""
+        Logger.info("停止自动化引擎")
+        self.is_running = self.engine.is_running = False
+        self.engine.cancel_token.cancel(time.time())
+        loop, task = self._loop, self._task
+        if loop is not None and task is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(task.cancel)
+
+    def shutdown(self):
+        """关闭线程池（不再使用引擎时调用）"""
+        for executor in (self._capture_executor, self._match_executor, self._action_executor):
+            executor.shutdown(wait=False)
+
+    def get_status(self):
+        if not self.is_running:
+            return "就绪"
+        if self.current_task:
+            return f"执行中: {self.current_task['name']}"
+        return "运行中"
+
+    # ---------- 截图、匹配、点击 ----------
+
+    async def _pump_frames(self):
+        """按帧率截图并发布最新帧，唤醒所有等待新帧的协程"""
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.CAPTURE_FPS
+        index = 0
+        while True:
+            started = time.time()
+            try:
+                frame = await loop.run_in_executor(self._capture_executor, self._capture_prepared)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                Logger.error(f"截图失败: {e}")
+                frame = None
+
+            if frame is not None:
+                index += 1
+                elapsed = time.time() - started
+                if self._capture_latency is None:
+                    self._capture_latency = elapsed
+                else:
+                    self._capture_latency += CaptureService.LATENCY_SMOOTHING * (elapsed - self._capture_latency)
+                async with self._frame_ready:
+                    self._frame = (index, started, frame)
+                    self._frame_ready.notify_all()
+
+            await asyncio.sleep(max(0.0, interval - (time.time() - started)))
+
+    def _capture_prepared(self):
+        image = self.engine.capture_frame()
+        return self.engine._prepare_capture(image) if image is not None else None
+
+    async def capture(self):
+        """截取一帧（PreparedFrame），不经过截图任务，失败时返回None"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._capture_executor, self._capture_prepared)
+
+    async def next_frame(self, after=0, since=None):
+        """
+        等待截图任务发布的新帧
+
+        参数:
+            after: 只接受帧序号大于该值的帧
+            since: 只接受在该时刻之后开始截取的帧
+
+        返回:
+            (帧序号, PreparedFrame)
+        """
+        def fresh():
+            return (self._frame is not None and self._frame[0] > after
+                    and (since is None or self._frame[1] >= since))
+
+        async with self._frame_ready:
+            await self._frame_ready.wait_for(fresh)
+            index, _, frame = self._frame
+        return index, frame
+
+    async def find_images(self, frame, names, confidence=None):
+        """在线程池中批量匹配模板，返回find_images的结果"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._match_executor, self.image_processor.find_images,
+                                          frame, names, confidence)
+
+    async def find_image(self, frame, name, confidence=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._match_executor, self.image_processor.find_image,
+                                          frame, name, confidence)
+
+    async def find_all(self, frame, name, confidence=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._match_executor, self.image_processor.find_all,
+                                          frame, name, confidence)
+
+    async def classify_screen(self, frame, expected=None):
+        """在线程池中用屏幕分类器判断frame是哪个界面，返回ScreenClassifier.classify的结果"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._match_executor, self.engine.screen_classifier.classify,
+                                          frame, expected)
+
+    async def click(self, position):
+        """在点击线程中点击设备坐标，返回是否成功"""
+        self.cancel_token.check()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._action_executor, self.game_controller.click_position,
+                                          position)
+
+    async def sleep(self, seconds):
+        self.cancel_token.check()
+        await asyncio.sleep(seconds)
+
+    # ---------- 等待 ----------
+
+    async def wait_for(self, any_of, timeout=None, poll_policy=None, confidence=None, since=None):
+        """
+        等待画面中出现any_of中的任一模板，参数和返回值与AutomationEngine.wait_for相同
+
+        每来一帧新画面匹配一次，命中即返回；超时返回None，停止时抛出CancelledError
+        """
+        names = [any_of] if isinstance(any_of, str) else list(any_of)
+        policy = poll_policy or self.DEFAULT_POLL
+        label = '/'.join(names)
+        started = time.time()
+        if since is None:
+            # 接受调用时正在截取的帧：截图周期加上实测截图耗时
+            since = started - 1.0 / self.CAPTURE_FPS - (self._capture_latency or 0.0)
+        progress = {'frames': 0}
+
+        try:
+            return await asyncio.wait_for(
+                self._watch(names, policy, confidence, since, started, label, progress), timeout
+            )
+        except asyncio.TimeoutError:
+            elapsed = time.time() - started
+            self.engine._record_wait(label, elapsed, False)
+            Logger.info(f"⏱️ 等待{label}超时（{elapsed:.1f}s，检查{progress['frames']}帧）")
+            return None
+
+    async def _watch(self, names, policy, confidence, since, started, label, progress):
+        index = 0
+        interval = policy.interval
+        next_log = started + policy.log_every if policy.log_every else None
+        while True:
+            index, frame = await self.next_frame(index, since)
+            batch = await self.find_images(frame, names, confidence)
+            progress['frames'] += 1
+
+            for name in names:
+                result = batch['results'][name]
+                if result:
+                    elapsed = time.time() - started
+                    self.engine._record_wait(label, elapsed, True)
+                    Logger.info(f"⏱️ 检测到{name}，等待{elapsed:.2f}s（检查{progress['frames']}帧）")
+                    batch.update(name=name, result=result, frame=frame,
+                                 elapsed=elapsed, frames=progress['frames'])
+                    return batch
+
+            now = time.time()
+            if next_log is not None and now >= next_log:
+                Logger.info(f"🔍 等待{label}中... (已等待 {int(now - started)}s)")
+                next_log += policy.log_every
+            if interval > 0:
+                await asyncio.sleep(interval)
+            interval = policy.next_interval(interval)
+
+    async def wait_settled(self, max_wait, roi=None, label=None):
+        """等待画面静止，参数和返回值与AutomationEngine.wait_settled相同"""
+        started = time.time()
+        label = label or ('按钮区域' if roi is not None else '画面')
+        try:
+            await asyncio.wait_for(self._settle(SettleDetector(roi=roi), started), max_wait)
+        except asyncio.TimeoutError:
+            self.engine._record_wait(f"静止:{label}", time.time() - started, False)
+            Logger.info(f"⏱️ {label}在{max_wait}s内未静止，继续执行")
+            return False
+
+        elapsed = time.time() - started
+        self.engine._record_wait(f"静止:{label}", elapsed, True)
+        Logger.info(f"⏱️ {label}已静止，等待{elapsed:.2f}s（上限{max_wait}s）")
+        return True
+
+    async def _settle(self, detector, started):
+        index = 0
+        while True:
+            index, frame = await self.next_frame(index, started)
+            if detector.update(frame):
+                return
+
+    async def first_of(self, waits, timeout=None):
+        """
+        同时进行多个等待，返回最先得到结果（非None）的一个，其余的取消
+
+        参数:
+            waits: {键: 等待协程}，同时完成时按字典顺序优先
+            timeout: 最长等待秒数
+
+        返回:
+            (键, 结果)；全部没有结果或超时时返回(None, None)
+        """
+        tasks = {asyncio.ensure_future(wait): key for key, wait in waits.items()}
+        order = list(tasks)
+        deadline = None if timeout is None else time.time() + timeout
+        pending = set(tasks)
+        try:
+            while pending:
+                remaining = None if deadline is None else max(0.0, deadline - time.time())
+                done, pending = await asyncio.wait(pending, timeout=remaining,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in sorted(done, key=order.index):
+                    result = task.result()
+                    if result:
+                        return tasks[task], result
+            return None, None
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def click_when(self, any_of, timeout=None, settle=None, poll_policy=None, confidence=None):
+        """
+        等待模板出现后点击
+
+        参数:
+            settle: 点击前等待按钮区域静止的上限秒数，None为不等待
+
+        返回:
+            wait_for的结果，未出现或点击失败时返回None
+        """
+        hit = await self.wait_for(any_of, timeout, poll_policy, confidence)
+        if hit is None:
+            return None
+        if settle:
+            await self.wait_settled(settle, roi=hit['result'])
+        if not await self.click(hit['result']['center']):
+            Logger.error(f"❌ {hit['name']}按钮点击失败")
+            return None
+        Logger.info(f"✅ 成功点击{hit['name']}")
+        return hit
+
+    # ---------- 流程 ----------
+
+    async def execute_task(self, task):
+        """执行单个任务"""
+        task_type = task.get('type')
+        try:
+            if task_type == 'login':
+                return await self.run_flow(task)
+            elif task_type == 'click_task':
+                return await self.click_when(task.get('target_image', 'task'),
+                                             timeout=task.get('timeout', 15)) is not None
+            elif task_type == 'weituo_task':
+                if self.engine.daily_commission_enabled:
+                    Logger.info("🎯 开始执行每日委托任务")
+                    return await self.run_flow(task)
+                Logger.info("⏩ 每日委托已禁用，跳过委托任务")
+                return True
+            elif task_type == 'daily_tasks':
+                Logger.info("开始执行每日任务")
+                await self.sleep(5)
+                Logger.info("✅ 每日任务完成")
+                return True
+            else:
+                Logger.warning(f"未知任务类型: {task_type}")
+                return False
+
+        except (asyncio.CancelledError, OperationCancelled):
+            raise
+        except Exception as e:
+            Logger.error(f"任务执行异常: {e}")
+            return False
+
+    async def run_flow(self, task):
+        """按任务声明的流程（flows/*.yaml，与AutomationEngine相同）执行，没有对应的流程时任务失败"""
+        flow = self.engine.flows.get(task.get('flow'))
+        if flow is None:
+            Logger.error(f"任务{task['name']}的流程不存在: {task.get('flow')}")
+            return False
+        return await AsyncFlowMachine(self, flow).run()
+
+
+if __name__ == '__main__':
+    # 无界面运行，可传入回放目录或视频文件；再传入逗号分隔的模板名时只做模板诊断
+    engine = AsyncAutomationEngine(replay_source=sys.argv[1] if len(sys.argv) > 1 else None)
+    try:
+        if len(sys.argv) > 2:
+            sys.exit(0 if engine.probe(sys.argv[2].split(',')) else 1)
+        sys.exit(0 if engine.run() else 1)
+    finally:
+        engine.shutdown()
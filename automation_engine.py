@@ -9,34 +9,104 @@ from kivy.logger import Logger
 from kivy.utils import platform
 
 # 导入图像处理和控制模块
-from image_processor import ImageProcessor
+from image_processor import ImageProcessor, PreparedFrame
 from game_controller import GameController
 from task_manager import TaskManager
 from android_screen_capture import AndroidScreenCapture
+from capture_service import CaptureService
+from capture_backends import create_backends, BackendSelector
+from frame_pool import FramePool
+from poll_policy import EVERY_FRAME
+from settle_detector import SettleDetector
+from cancellation import CancellationToken, OperationCancelled
+from pipeline import MatchPipeline
+from flow_engine import FlowMachine, FlowError, load_flows
+from screen_classifier import ScreenClassifier
 
 class AutomationEngine:
     """自动化引擎主类"""
     
     VERSION = "1.0.5-enable-pillow-matching"  # 版本标记
     
-    def __init__(self):
+    # 后台截图帧率，以及等待新帧的最长时间（秒）
+    CAPTURE_FPS = 5.0
+    CAPTURE_TIMEOUT = 5.0
+    
+    # wait_for的默认轮询策略；查找预期马上出现的按钮的超时（秒）
+    DEFAULT_POLL = EVERY_FRAME
+    STEP_TIMEOUT = 3.0
+    
+    # 停止请求到流程实际退出的目标耗时（秒），超过时输出警告
+    STOP_LATENCY_BUDGET = 0.1
+    
+    def __init__(self, use_capture_service=True, analysis_scale=1.0, replay_source=None, replay_hold=None,
+                 pipeline=False, pipeline_workers=MatchPipeline.DEFAULT_WORKERS):
         self.is_running = False
         self.current_task = None
         self.platform = platform
         self.daily_commission_enabled = True  # Default enabled
         
         # 初始化子模块
-        self.image_processor = ImageProcessor()
+        # analysis_scale < 1 时截图在源头缩小后再匹配，点击坐标自动映射回设备坐标
+        self.image_processor = ImageProcessor(analysis_scale=analysis_scale)
         self.game_controller = GameController()
         self.task_manager = TaskManager()
         
+        # 截图层共用的帧缓冲池：截图直接写入复用的数组，复制进截图服务的环形缓冲区后归还
+        self.frame_pool = FramePool()
+        
         # 初始化截图模块（Android专用）
         if platform == 'android':
-            self.screen_capture = AndroidScreenCapture()
+            self.screen_capture = AndroidScreenCapture(analysis_scale=analysis_scale, frame_pool=self.frame_pool)
             Logger.info(f"✅ AndroidScreenCapture 已初始化")
         else:
             self.screen_capture = None
         
+        # 截图后端：shell screencap / MediaProjection / 桌面截图；
+        # 指定replay_source（图片目录或视频文件）时从文件回放，可在无设备的环境下跑完整流程
+        # 首次截图时探测并选用最快的可用后端，之后固定使用；失败的后端熔断冷却，定期试探其他后端
+        self.capture_selector = BackendSelector(
+            create_backends(self.screen_capture, replay_source, replay_hold, self.frame_pool)
+        )
+        
+        # 后台截图服务：运行期间持续截图，流程中直接取最新帧，不再等待截图完成
+        # 流水线模式下每个匹配线程各持有一帧，环形缓冲区相应加大
+        ring_size = CaptureService.DEFAULT_RING_SIZE + (pipeline_workers if pipeline else 0)
+        self.capture_service = (
+            CaptureService(self.capture_frame, fps=self.CAPTURE_FPS, ring_size=ring_size,
+                           frame_pool=self.frame_pool)
+            if use_capture_service else None
+        )
+        
+        # 流水线模式：截图和匹配分别在独立线程中进行（需要后台截图服务）
+        self.match_pipeline = None
+        if pipeline and self.capture_service:
+            self.match_pipeline = MatchPipeline(self.capture_service, self.image_processor,
+                                                self._prepare_capture, workers=pipeline_workers)
+        elif pipeline:
+            Logger.warning("流水线模式需要后台截图服务，已禁用")
+        
+        # 取消令牌：stop()时取消，所有等待、截图和匹配都会及时响应；每次run()使用新的令牌
+        self.cancel_token = CancellationToken()
+        self.image_processor.cancel_token = self.cancel_token
+        # 最近一次停止请求到流程退出的耗时（秒）
+        self.last_stop_latency = None
+        
+        # wait_for的等待耗时统计：{等待目标: {'waits', 'hits', 'total', 'max'}}
+        self.wait_stats = {}
+        self._wait_lock = threading.Lock()
+        
+        # 屏幕分类器：流程等待失败时判断当前界面，从对应的状态恢复
+        self.screen_classifier = ScreenClassifier(self.image_processor)
+        
+        # 声明式流程（flows/*.yaml）：登录和委托任务按任务声明的流程由状态机执行
+        try:
+            self.flows = load_flows(templates=self.image_processor.templates)
+            Logger.info(f"已加载流程: {sorted(self.flows)}")
+        except FlowError as e:
+            Logger.error(f"流程加载失败: {e}")
+            self.flows = {}
+        
         Logger.info(f"🚀 自动化引擎初始化完成 [版本: {self.VERSION}]，平台: {self.platform}")
     
     def set_daily_commission_enabled(self, enabled):
@@ -48,7 +118,15 @@ class AutomationEngine:
         """运行自动化流程"""
         try:
             Logger.info("开始执行自动化流程")
+            self.cancel_token = CancellationToken()
+            self.image_processor.cancel_token = self.cancel_token
             self.is_running = True
+            self.frame_pool.log_stats("（开始）")
+            
+            if self.capture_service:
+                self.capture_service.start()
+            if self.match_pipeline:
+                self.match_pipeline.start(self.cancel_token)
             
             # 获取任务列表
             tasks = self.task_manager.get_tasks()
@@ -67,19 +145,283 @@ class AutomationEngine:
                     Logger.error(f"必需任务失败: {task['name']}")
                     return False
                 
-                # 任务间延迟
-                time.sleep(2)
+                # 任务间延迟：画面静止即可开始下一个任务
+                self.wait_settled(2)
             
             Logger.info("✅ 自动化流程完成")
             return True
-            
+        
+        except OperationCancelled:
+            Logger.info("自动化被中断")
+            return False
         except Exception as e:
             Logger.error(f"自动化执行异常: {e}")
             return False
         
         finally:
+            if self.cancel_token.is_cancelled:
+                self._report_stop_latency()
             self.is_running = False
             self.current_task = None
+            
+            if self.match_pipeline:
+                self.match_pipeline.stop()
+            if self.capture_service:
+                self.capture_service.release()
+                self.capture_service.stop()
+            Logger.info(f"📊 截图后端统计:\n{self.get_capture_status()}")
+            self.frame_pool.log_stats("（结束）")
+            if self.wait_stats:
+                Logger.info(f"📊 画面等待统计:\n{self.get_wait_stats()}")
+            classifier_stats = self.screen_classifier.stats()
+            if classifier_stats['classified']:
+                Logger.info(f"📊 屏幕分类: {classifier_stats['classified']}次 "
+                            f"缩略图命中{classifier_stats['signature_hits']}次 "
+                            f"平均{classifier_stats['mean_ms']:.1f}ms")
+            
+            self.image_processor.flush_search_index()
+            cache_stats = self.image_processor.get_cache_stats()
+            Logger.info(f"📊 匹配缓存命中率: {cache_stats['hit_rate']:.1%} "
+                        f"(命中{cache_stats['hits']}次 / 未命中{cache_stats['misses']}次)")
+    
+    def capture_screen(self, max_age=None):
+        """
+        获取当前屏幕画面（分析分辨率的PreparedFrame，可直接传给ImageProcessor的各个查找方法）
+        
+        后台截图服务运行时直接返回最新帧（截图开始时间不早于max_age秒前，
+        默认一个截图周期加实测截图耗时，即调用时正在截取的帧也算足够新），
+        没有足够新的帧时等待下一帧；服务未运行时同步截图
+        """
+        service = self.capture_service
+        if not service or not service.is_running():
+            image = self.capture_frame()
+        else:
+            if max_age is None:
+                max_age = service.max_frame_age()
+            min_timestamp = time.time() - max_age
+            
+            frame = service.latest_frame(min_timestamp)
+            if frame is None:
+                frame = service.wait_for_new_frame(self.CAPTURE_TIMEOUT, min_timestamp, self.cancel_token)
+                self.cancel_token.check()
+            image = frame.image if frame else None
+        
+        return self._prepare_capture(image)
+    
+    def _prepare_capture(self, image):
+        """截图转换为分析分辨率的PreparedFrame"""
+        # 截图后端输出相对设备分辨率的比例（桌面截图和回放为原始分辨率，由ImageProcessor缩放）
+        backend = self.capture_selector.current
+        source_scale = backend.source_scale if backend else 1.0
+        return self.image_processor.prepare_frame(image, source_scale=source_scale)
+    
+    def _next_frame(self, since, deadline):
+        """
+        wait_for取下一帧：截图服务运行时等待当前线程还没取过的新帧，否则同步截图
+        
+        返回PreparedFrame，超时或截图失败时返回None
+        """
+        service = self.capture_service
+        if not service or not service.is_running():
+            return self._prepare_capture(self.capture_frame())
+        
+        timeout = self.CAPTURE_TIMEOUT
+        if deadline is not None:
+            timeout = max(0.0, min(timeout, deadline - time.time()))
+        frame = service.wait_for_new_frame(timeout, since, self.cancel_token)
+        self.cancel_token.check()
+        return self._prepare_capture(frame.image) if frame else None
+    
+    def wait_for(self, any_of, timeout=None, poll_policy=None, confidence=None, since=None):
+        """
+        等待画面中出现any_of中的任一模板
+        
+        后台截图服务运行时每来一帧新画面立即匹配（只匹配any_of中的模板），命中即返回；
+        服务未运行时按截图帧率同步截图。每次等待的耗时计入等待统计（get_wait_stats）；
+        引擎停止时抛出OperationCancelled
+        
+        参数:
+            any_of: 模板名或模板名列表，同一帧命中多个时按列表顺序取第一个
+            timeout: 最长等待秒数，None为一直等待直到命中或引擎停止
+            poll_policy: 轮询策略（PollPolicy），默认每帧检查
+            confidence: 匹配阈值，可以是{模板名: 阈值}，None使用模板默认阈值
+            since: 只接受在该时刻之后开始截取的帧，默认接受调用时正在截取的帧（见CaptureService.max_frame_age）
+        
+        返回:
+            dict: find_images的批量结果，另含 'name'/'result'（命中的模板及结果）、
+                  'frame'（命中的PreparedFrame，可继续查找其他模板）、
+                  'elapsed'（等待秒数）、'frames'（检查的帧数）；
+            超时或引擎停止时返回None
+        """
+        names = [any_of] if isinstance(any_of, str) else list(any_of)
+        policy = poll_policy or self.DEFAULT_POLL
+        label = '/'.join(names)
+        
+        started = time.time()
+        deadline = None if timeout is None else started + timeout
+        service = self.capture_service
+        service_running = service is not None and service.is_running()
+        if since is None:
+            since = started - (service.max_frame_age() if service_running else 1.0 / self.CAPTURE_FPS)
+        # 同步截图时按截图帧率限速
+        min_interval = 0.0 if service_running else 1.0 / self.CAPTURE_FPS
+        
+        interval = policy.interval
+        frames = 0
+        next_log = started + policy.log_every if policy.log_every else None
+        
+        # 流水线模式：匹配线程持续匹配新帧，这里只取结果
+        pipeline = self.match_pipeline if self._pipeline_running() else None
+        if pipeline:
+            pipeline.watch(names, confidence, since)
+        
+        try:
+            while self.is_running:
+                self.cancel_token.check()
+                if pipeline:
+                    pipeline.set_interval(interval)
+                    evaluated = self._next_pipeline_result(pipeline, deadline)
+                else:
+                    evaluated = self._evaluate_next_frame(names, confidence, since, deadline)
+                
+                if evaluated is not None:
+                    screenshot, batch = evaluated
+                    frames += 1
+                    for name in names:
+                        result = batch['results'][name]
+                        if result:
+                            elapsed = time.time() - started
+                            self._record_wait(label, elapsed, True)
+                            Logger.info(f"⏱️ 检测到{name}，等待{elapsed:.2f}s（检查{frames}帧）")
+                            batch.update(name=name, result=result, frame=screenshot,
+                                         elapsed=elapsed, frames=frames)
+                            return batch
+                
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    break
+                if next_log is not None and now >= next_log:
+                    Logger.info(f"🔍 等待{label}中... (已等待 {int(now - started)}s)")
+                    next_log += policy.log_every
+                
+                pause = 0.0 if pipeline else max(interval, min_interval)
+                if deadline is not None:
+                    pause = min(pause, deadline - now)
+                if pause > 0:
+                    self.cancel_token.sleep(pause)
+                interval = policy.next_interval(interval)
+        finally:
+            if pipeline:
+                pipeline.unwatch()
+        
+        elapsed = time.time() - started
+        self._record_wait(label, elapsed, False)
+        if self.is_running:
+            Logger.info(f"⏱️ 等待{label}超时（{elapsed:.1f}s，检查{frames}帧）")
+        return None
+    
+    def _evaluate_next_frame(self, names, confidence, since, deadline):
+        """在当前线程取下一帧并匹配，返回(PreparedFrame, 批量结果)，没有新帧时返回None"""
+        screenshot = self._next_frame(since, deadline)
+        if screenshot is None:
+            return None
+        batch = self.image_processor.find_images(screenshot, names, confidence)
+        service = self.capture_service
+        if any(batch['results'].values()) and service is not None and service.owns(screenshot.bgr):
+            # 命中的帧会交给流程查找点击目标，期间本线程等待静止时会取新帧、释放该槽位，复制一份
+            screenshot = PreparedFrame(screenshot.bgr.copy(), scale=screenshot.scale)
+        return screenshot, batch
+    
+    def _next_pipeline_result(self, pipeline, deadline):
+        """从匹配流水线取下一个结果，返回(PreparedFrame, 批量结果)，超时返回None"""
+        timeout = self.CAPTURE_TIMEOUT
+        if deadline is not None:
+            timeout = max(0.0, min(timeout, deadline - time.time()))
+        evaluated = pipeline.next_result(timeout)
+        if evaluated is None:
+            return None
+        return evaluated['frame'], evaluated['batch']
+    
+    def _pipeline_running(self):
+        return self.match_pipeline is not None and self.match_pipeline.is_running()
+    
+    def click(self, position):
+        """
+        点击设备坐标（在流程线程中同步执行）
+        
+        引擎已停止时不再点击，抛出OperationCancelled
+        """
+        self.cancel_token.check()
+        return self.game_controller.click_position(position)
+    
+    def wait_settled(self, max_wait, roi=None, label=None):
+        """
+        等待画面静止（界面动画结束），原来的固定等待时间作为上限
+        
+        只使用调用之后截取的帧，连续几帧差异低于阈值即返回；
+        roi为设备坐标区域或匹配结果字典时只检测该区域（如待点击的按钮）
+        
+        返回:
+            bool: 是否在上限前静止；引擎停止时抛出OperationCancelled
+        """
+        started = time.time()
+        deadline = started + max_wait
+        service = self.capture_service
+        min_interval = 0.0 if service and service.is_running() else 1.0 / self.CAPTURE_FPS
+        detector = SettleDetector(roi=roi)
+        label = label or ('按钮区域' if roi is not None else '画面')
+        
+        while self.is_running and time.time() < deadline:
+            self.cancel_token.check()
+            screenshot = self._next_frame(started, deadline)
+            if screenshot is not None and detector.update(screenshot):
+                elapsed = time.time() - started
+                self._record_wait(f"静止:{label}", elapsed, True)
+                Logger.info(f"⏱️ {label}已静止，等待{elapsed:.2f}s（上限{max_wait}s）")
+                return True
+            if min_interval:
+                self.cancel_token.sleep(max(0.0, min(min_interval, deadline - time.time())))
+        
+        if self.is_running:
+            self._record_wait(f"静止:{label}", time.time() - started, False)
+            Logger.info(f"⏱️ {label}在{max_wait}s内未静止，继续执行")
+        return False
+    
+    def _record_wait(self, label, elapsed, hit):
+        with self._wait_lock:
+            stats = self.wait_stats.setdefault(
+                label, {'waits': 0, 'hits': 0, 'total': 0.0, 'max': 0.0}
+            )
+            stats['waits'] += 1
+            stats['hits'] += 1 if hit else 0
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+    
+    def get_wait_stats(self):
+        """各等待目标的次数、命中次数、平均和最长等待时间"""
+        lines = []
+        with self._wait_lock:
+            for label, stats in self.wait_stats.items():
+                mean = stats['total'] / stats['waits']
+                lines.append(f"  {label}: {stats['hits']}/{stats['waits']}次命中 "
+                             f"平均{mean:.2f}s 最长{stats['max']:.2f}s")
+        return "\n".join(lines)
+    
+    def capture_frame(self):
+        """通过当前截图后端截取一帧原始画面（BGR数组），失败时返回None"""
+        return self.capture_selector.capture()
+    
+    def get_capture_status(self):
+        """各截图后端的成功次数、失败次数、平均延迟和冷却状态"""
+        lines = []
+        for stats in self.capture_selector.stats():
+            line = f"{'*' if stats['active'] else ' '} {stats['name']}: 成功{stats['captures']} 失败{stats['failures']}"
+            if 'mean_ms' in stats:
+                line += f" 平均{stats['mean_ms']:.1f}ms"
+            if 'cooldown_s' in stats:
+                line += f" 冷却中({stats['cooldown_s']:.0f}s)"
+            lines.append(line)
+        return "\n".join(lines)
     
     def execute_task(self, task):
         """执行单个任务"""
@@ -87,13 +429,13 @@ class AutomationEngine:
             task_type = task.get('type')
             
             if task_type == 'login':
-                return self.execute_login_task(task)
+                return self.run_flow(task)
             elif task_type == 'click_task':
                 return self.execute_click_task(task)
             elif task_type == 'weituo_task':
                 if self.daily_commission_enabled:
                     Logger.info("🎯 开始执行每日委托任务")
-                    return self.execute_weituo_task(task)
+                    return self.run_flow(task)
                 else:
                     Logger.info("⏩ 每日委托已禁用，跳过委托任务")
                     return True  # 跳过但不视为失败
@@ -102,174 +444,20 @@ class AutomationEngine:
             else:
                 Logger.warning(f"未知任务类型: {task_type}")
                 return False
-                
+        
+        except OperationCancelled:
+            raise
         except Exception as e:
             Logger.error(f"任务执行异常: {e}")
             return False
     
-    def execute_login_task(self, task):
-        """执行登录任务 - 智能持续检测模式"""
-        Logger.info("开始执行登录流程 - 智能等待游戏加载")
-        
-        # 第一阶段：持续检测 first OR screen/button（无时间限制）
-        # 因为游戏刚启动，可能需要较长时间加载
-        Logger.info("🔍 第一阶段：检测登录界面...")
-        
-        check_count = 0
-        first_button_clicked = False
-        
-        while True:
-            if not self.is_running:
-                return False
-            
-            check_count += 1
-            if check_count % 5 == 0:  # 每5秒打印一次
-                Logger.info(f"持续检测中... ({check_count}秒)")
-            
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                Logger.warning("⚠️ 无法截图，1秒后重试")
-                time.sleep(1)
-                continue
-            
-            # 优先检测 login_button_first
-            result = self.image_processor.find_image(screenshot, 'login_button_first')
-            if result:
-                Logger.info("✅ 找到首次登录按钮！")
-                center_x, center_y = result['center']
-                Logger.info(f"坐标: ({center_x}, {center_y})")
-                
-                if self.game_controller.click_position((center_x, center_y)):
-                    Logger.info("✅ 首次登录按钮点击成功")
-                    time.sleep(2)
-                    first_button_clicked = True
-                    break
-                else:
-                    Logger.error("❌ 点击失败")
-            
-            # 如果没有first，检测screen或button（可能直接出现）
-            for image_name in ['game_start_screen', 'login_button']:
-                result = self.image_processor.find_image(screenshot, image_name)
-                if result:
-                    Logger.info(f"✅ 直接检测到: {image_name}")
-                    # 直接进入第二阶段处理
-                    break
-            else:
-                # 如果都没检测到，继续循环
-                time.sleep(1)
-                continue
-            
-            # 检测到screen或button，跳出循环
-            break
-        
-        # 第二阶段：持续检测 game_start_screen 和 login_button（无时间限制）
-        Logger.info("🔍 第二阶段：持续检测游戏开始界面和登录按钮（每秒检查一次，无时间限制）")
-        second_stage_images = ['game_start_screen', 'login_button']
-        second_stage_start = time.time()
-        
-        while True:  # 无时间限制，持续检测
-            if not self.is_running:
-                return False
-            
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                Logger.warning("无法获取屏幕截图，1秒后重试")
-                time.sleep(1)
-                continue
-            
-            # 检测第二阶段图像
-            detected = False
-            for image_name in second_stage_images:
-                result = self.image_processor.find_image(screenshot, image_name)
-                if result:
-                    Logger.info(f"✅ 检测到: {image_name}")
-                    center_x, center_y = result['center']
-                    
-                    # 等待2秒后再点击
-                    Logger.info("等待2秒后点击...")
-                    time.sleep(2)
-                    
-                    # 执行点击
-                    if self.game_controller.click_position((center_x, center_y)):
-                        Logger.info(f"点击成功: {image_name}")
-                        detected = True
-                        
-                        # 等待进入游戏并检测登录奖励或task按钮
-                        Logger.info("等待游戏加载...")
-                        time.sleep(20)  # 等待20秒让游戏充分加载
-                        
-                        # 第三阶段：智能检测 yueka（登录奖励）或 task（主界面）
-                        Logger.info("🔍 第三阶段：智能检测登录奖励(yueka)或主界面(task)...")
-                        
-                        yueka_handled = False
-                        check_screenshot = self.screen_capture.capture_screen()
-                        
-                        if check_screenshot is not None:
-                            # 同时检测 yueka 和 task，比较置信度
-                            yueka_result = self.image_processor.find_image(check_screenshot, 'yueka')
-                            task_result = self.image_processor.find_image(check_screenshot, 'task')
-                            
-                            yueka_confidence = yueka_result['confidence'] if yueka_result else 0
-                            task_confidence = task_result['confidence'] if task_result else 0
-                            
-                            Logger.info(f"检测结果 - yueka置信度: {yueka_confidence:.2f}, task置信度: {task_confidence:.2f}")
-                            
-                            # 如果检测到 yueka 且置信度更高
-                            if yueka_result and yueka_confidence > task_confidence:
-                                Logger.info("✅ 检测到登录奖励弹窗(yueka)，准备关闭...")
-                                center_x, center_y = yueka_result['center']
-                                
-                                # 第一次点击（领取奖励）
-                                if self.game_controller.click_position((center_x, center_y)):
-                                    Logger.info("✅ 第一次点击成功（领取奖励）")
-                                    time.sleep(1)
-                                    
-                                    # 第二次点击（关闭弹窗）
-                                    if self.game_controller.click_position((center_x, center_y)):
-                                        Logger.info("✅ 第二次点击成功（关闭弹窗）")
-                                        time.sleep(1)
-                                        yueka_handled = True
-                                    else:
-                                        Logger.warning("⚠️ 第二次点击失败")
-                                else:
-                                    Logger.warning("⚠️ 第一次点击失败")
-                            
-                            # 如果检测到 task 且置信度更高（或没有yueka）
-                            elif task_result and task_confidence >= yueka_confidence:
-                                Logger.info("✅ 直接检测到task按钮，登录成功！")
-                                return True
-                        
-                        # 第四阶段：持续检测task按钮（无时间限制）
-                        task_check_start = time.time()
-                        
-                        Logger.info("🔍 第四阶段：持续检测task按钮（进入游戏成功标识，无时间限制）...")
-                        while True:  # 无时间限制，持续检测
-                            if not self.is_running:
-                                return False
-                            
-                            check_screenshot = self.screen_capture.capture_screen()
-                            if check_screenshot is not None:
-                                task_result = self.image_processor.find_image(check_screenshot, 'task')
-                                if task_result:
-                                    Logger.info("✅ 检测到task按钮，登录成功！")
-                                    return True
-                            
-                            task_elapsed = int(time.time() - task_check_start)
-                            if task_elapsed % 10 == 0 and task_elapsed > 0:  # 每10秒显示一次进度
-                                Logger.info(f"🔍 检测task按钮中... (已等待 {task_elapsed}s)")
-                            
-                            time.sleep(1)  # 每秒检查一次
-                        
-                        break  # 跳出当前循环，继续监控
-                    else:
-                        Logger.error(f"点击失败: {image_name}")
-            
-            if not detected:
-                elapsed = int(time.time() - second_stage_start)
-                if elapsed % 10 == 0 and elapsed > 0:  # 每10秒显示一次进度
-                    Logger.info(f"🔍 第二阶段监控中... (已等待 {elapsed}s)")
-            
-            time.sleep(1)  # 每秒检查一次
+    def run_flow(self, task):
+        """按任务声明的流程（flows/*.yaml）执行，没有对应的流程时任务失败"""
+        flow = self.flows.get(task.get('flow'))
+        if flow is None:
+            Logger.error(f"任务{task['name']}的流程不存在: {task.get('flow')}")
+            return False
+        return FlowMachine(self, flow).run()
     
     def execute_click_task(self, task):
         """执行点击任务按钮任务"""
@@ -278,800 +466,25 @@ class AutomationEngine:
         target_image = task.get('target_image', 'task')
         timeout = task.get('timeout', 15)
         
-        start_time = time.time()
+        deadline = time.time() + timeout
         
-        while time.time() - start_time < timeout:
-            if not self.is_running:
-                return False
-            
-            # 截取屏幕
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                time.sleep(1)
-                continue
-            
+        while time.time() < deadline:
             # 查找目标按钮
-            result = self.image_processor.find_image(screenshot, target_image)
-            if result:
-                Logger.info(f"找到目标按钮: {target_image}")
-                
-                # 点击按钮
-                if self.game_controller.click_position(result['center']):
-                    Logger.info("✅ 任务按钮点击成功")
-                    return True
-            
-            time.sleep(1)
-        
-        Logger.error("❌ 未找到任务按钮")
-        return False
-    
-    def execute_weituo_task(self, task):
-        """执行委托任务流程：点击task -> 等待 -> 检索weituo -> 检索qianwang -> 点击qianwang"""
-        Logger.info("🎯 开始执行委托任务流程")
-        
-        # 第一步：点击task按钮
-        Logger.info("📋 第一步：点击task按钮")
-        task_timeout = 15
-        task_start = time.time()
-        
-        while time.time() - task_start < task_timeout:
-            if not self.is_running:
-                return False
-            
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                Logger.warning("无法获取屏幕截图，1秒后重试")
-                time.sleep(1)
-                continue
-            
-            task_result = self.image_processor.find_image(screenshot, 'task')
-            if task_result:
-                Logger.info("✅ 检测到task按钮")
-                center_x, center_y = task_result['center']
-                
-                # 等待7秒后再点击
-                Logger.info("⏰ 等待7秒后点击task按钮...")
-                time.sleep(7)
-                
-                if self.game_controller.click_position((center_x, center_y)):
-                    Logger.info("✅ 成功点击task按钮")
-                    break
-                else:
-                    Logger.error("❌ task按钮点击失败")
-            
-            time.sleep(1)
-        else:
-            Logger.error("❌ 未找到task按钮，委托任务失败")
-            return False
-        
-        # 第二步：检索weituo.png
-        Logger.info("🔍 第二步：检索weituo界面")
-        weituo_timeout = 10
-        weituo_start = time.time()
-        
-        while time.time() - weituo_start < weituo_timeout:
-            if not self.is_running:
-                return False
-            
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                Logger.warning("无法获取屏幕截图，1秒后重试")
-                time.sleep(1)
-                continue
-            
-            weituo_result = self.image_processor.find_image(screenshot, 'weituo')
-            if weituo_result:
-                Logger.info("✅ 找到weituo界面")
-                
-                # 第三步：在weituo区域内检索qianwang.png
-                Logger.info("🔍 第三步：在weituo界面中检索qianwang按钮")
-                qianwang_result = self.image_processor.find_image(screenshot, 'qianwang')
-                if qianwang_result:
-                    # 第四步：点击qianwang
-                    Logger.info("🎯 第四步：点击qianwang按钮")
-                    qw_x, qw_y = qianwang_result['center']
-                    if self.game_controller.click_position((qw_x, qw_y)):
-                        Logger.info("✅ 成功点击qianwang")
-                        
-                        # 第五步：等待2秒后处理后续逻辑
-                        Logger.info("⏰ 第五步：等待2秒...")
-                        time.sleep(2)
-                        
-                        # 第六步：检查paiqianzhong或lingqu
-                        return self.handle_post_qianwang_logic()
-                    else:
-                        Logger.error("❌ qianwang按钮点击失败")
-                        return False
-                else:
-                    Logger.info("⚠️ 在weituo界面中未找到qianwang按钮，继续搜索...")
-            
-            time.sleep(1)
-        
-        Logger.error("❌ 委托任务失败：未找到weituo界面或qianwang按钮")
-        return False
-    
-    def handle_post_qianwang_logic(self):
-        """处理点击qianwang后的逻辑：检查paiqianzhong或lingqu"""
-        Logger.info("🔍 第六步：检查paiqianzhong或lingqu状态")
-        
-        # 获取当前屏幕截图
-        screenshot = self.screen_capture.capture_screen()
-        if screenshot is None:
-            Logger.error("❌ 无法获取屏幕截图")
-            return False
-        
-        # 优先检查paiqianzhong（排签中）
-        paiqian_result = self.image_processor.find_image(screenshot, 'paiqianzhong')
-        if paiqian_result:
-            Logger.info("✅ 检测到paiqianzhong（排签中状态）")
-            
-            # 查找并点击close按钮
-            close_result = self.image_processor.find_image(screenshot, 'close')
-            if close_result:
-                Logger.info("🎯 点击close按钮")
-                close_x, close_y = close_result['center']
-                if self.game_controller.click_position((close_x, close_y)):
-                    Logger.info("✅ 成功点击close")
-                    
-                    # 等待3秒后继续120kaituoli流程
-                    Logger.info("⏰ 等待3秒...")
-                    time.sleep(3)
-                    
-                    # 执行120kaituoli流程
-                    return self.execute_120kaituoli_flow()
-                else:
-                    Logger.error("❌ close按钮点击失败")
-                    return False
-            else:
-                Logger.warning("⚠️ 检测到paiqianzhong但未找到close按钮")
-                return False
-        
-        # 如果没有paiqianzhong，执行领取流程：yijianlingqu → zaicipaiqian → close
-        Logger.info("🔍 未检测到paiqianzhong，开始执行领取流程")
-        
-        # 第二步：点击yijianlingqu
-        Logger.info("🎯 第二步：点击yijianlingqu按钮")
-        yijianlingqu_result = self.image_processor.find_image(screenshot, 'yijianlingqu', confidence=0.7)  # 提高置信度
-        if yijianlingqu_result:
-            Logger.info("✅ 检测到yijianlingqu按钮")
-            yijianlingqu_x, yijianlingqu_y = yijianlingqu_result['center']
-            if self.game_controller.click_position((yijianlingqu_x, yijianlingqu_y)):
-                Logger.info("✅ 成功点击yijianlingqu")
-                
-                # 等待2秒
-                Logger.info("⏰ 等待2秒...")
-                time.sleep(2)
-                
-                # 第三步：点击zaicipaiqian
-                Logger.info("🎯 第三步：点击zaicipaiqian按钮")
-                screenshot2 = self.screen_capture.capture_screen()
-                if screenshot2 is not None:
-                    zaici_result = self.image_processor.find_image(screenshot2, 'zaicipaiqian')
-                    if zaici_result:
-                        Logger.info("✅ 检测到zaicipaiqian按钮")
-                        zaici_x, zaici_y = zaici_result['center']
-                        if self.game_controller.click_position((zaici_x, zaici_y)):
-                            Logger.info("✅ 成功点击zaicipaiqian")
-                            
-                            # 等待3秒
-                            Logger.info("⏰ 等待3秒...")
-                            time.sleep(3)
-                            
-                            # 第四步：点击close
-                            Logger.info("🎯 第四步：点击close按钮")
-                            screenshot3 = self.screen_capture.capture_screen()
-                            if screenshot3 is not None:
-                                close_result = self.image_processor.find_image(screenshot3, 'close')
-                                if close_result:
-                                    Logger.info("✅ 检测到close按钮")
-                                    close_x, close_y = close_result['center']
-                                    if self.game_controller.click_position((close_x, close_y)):
-                                        Logger.info("✅ 成功点击close")
-                                        
-                                        # 等待3秒后继续120kaituoli流程
-                                        Logger.info("⏰ 等待3秒...")
-                                        time.sleep(3)
-                                        
-                                        # 执行120kaituoli流程
-                                        return self.execute_120kaituoli_flow()
-                                    else:
-                                        Logger.error("❌ close按钮点击失败")
-                                        return False
-                                else:
-                                    Logger.warning("⚠️ 未找到close按钮")
-                                    return False
-                            else:
-                                Logger.error("❌ 无法获取第三次屏幕截图")
-                                return False
-                        else:
-                            Logger.error("❌ zaicipaiqian按钮点击失败")
-                            return False
-                    else:
-                        Logger.warning("⚠️ 未找到zaicipaiqian按钮")
-                        return False
-                else:
-                    Logger.error("❌ 无法获取第二次屏幕截图")
-                    return False
-            else:
-                Logger.error("❌ yijianlingqu按钮点击失败")
-                return False
-        else:
-            Logger.warning("⚠️ 未找到yijianlingqu按钮")
-            return False
-    
-    def execute_120kaituoli_flow(self):
-        """执行120kaituoli流程：搜索120kaituoli.png，然后在其区域内找到qianwang并点击"""
-        Logger.info("🔍 开始120kaituoli流程")
-        
-        # 获取当前屏幕截图
-        screenshot = self.screen_capture.capture_screen()
-        if screenshot is None:
-            Logger.error("❌ 无法获取屏幕截图")
-            return False
-        
-        # 搜索120kaituoli.png
-        Logger.info("🔍 搜索120kaituoli.png")
-        kaituoli_result = self.image_processor.find_image(screenshot, '120kaituoli')
-        if kaituoli_result:
-            Logger.info("✅ 找到120kaituoli区域")
-            
-            # 在同一屏幕截图中搜索qianwang按钮
-            Logger.info("🔍 在120kaituoli区域内搜索qianwang按钮")
-            qianwang_result = self.image_processor.find_image(screenshot, 'qianwang')
-            if qianwang_result:
-                Logger.info("✅ 在120kaituoli区域内找到qianwang按钮")
-                qianwang_x, qianwang_y = qianwang_result['center']
-                
-                # 点击qianwang按钮
-                Logger.info("🎯 点击120kaituoli区域内的qianwang按钮")
-                if self.game_controller.click_position((qianwang_x, qianwang_y)):
-                    Logger.info("✅ 成功点击120kaituoli区域内的qianwang")
-                    
-                    # 执行后续的详细操作流程
-                    return self.execute_detailed_challenge_flow()
-                else:
-                    Logger.error("❌ qianwang按钮点击失败")
-                    return False
-            else:
-                Logger.warning("⚠️ 在120kaituoli区域内未找到qianwang按钮")
-                return False
-        else:
-            Logger.warning("⚠️ 未找到120kaituoli区域")
-            return False
-    
-    def execute_detailed_challenge_flow(self):
-        """执行详细的挑战流程：等待5s → 点击jinru → 等待3s → 点击jiahao六次 → 等待1s → 点击tiaozhan → 等待3s → 点击kaishitiaozhan"""
-        Logger.info("🚀 开始详细挑战流程")
-        
-        # 第一步：等待5秒
-        Logger.info("⏰ 第一步：等待5秒...")
-        time.sleep(5)
-        
-        # 第二步：点击jinru
-        Logger.info("🔍 第二步：搜索并点击jinru按钮")
-        screenshot = self.screen_capture.capture_screen()
-        if screenshot is None:
-            Logger.error("❌ 无法获取屏幕截图")
-            return False
-            
-        jinru_result = self.image_processor.find_image(screenshot, 'jinru')
-        if jinru_result:
-            Logger.info("✅ 找到jinru按钮")
-            jinru_x, jinru_y = jinru_result['center']
-            if self.game_controller.click_position((jinru_x, jinru_y)):
-                Logger.info("✅ 成功点击jinru按钮")
-            else:
-                Logger.error("❌ jinru按钮点击失败")
-                return False
-        else:
-            Logger.warning("⚠️ 未找到jinru按钮")
-            return False
-        
-        # 第三步：等待3秒
-        Logger.info("⏰ 第三步：等待3秒...")
-        time.sleep(3)
-        
-        # 第四步：点击jiahao五次
-        Logger.info("🔍 第四步：搜索并点击jiahao按钮5次")
-        for i in range(5):
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                Logger.error(f"❌ 第{i+1}次无法获取屏幕截图")
-                return False
-                
-            jiahao_result = self.image_processor.find_image(screenshot, 'jiahao')
-            if jiahao_result:
-                Logger.info(f"✅ 第{i+1}次找到jiahao按钮")
-                jiahao_x, jiahao_y = jiahao_result['center']
-                if self.game_controller.click_position((jiahao_x, jiahao_y)):
-                    Logger.info(f"✅ 第{i+1}次成功点击jiahao按钮")
-                    time.sleep(0.5)  # 每次点击间隔0.5秒
-                else:
-                    Logger.error(f"❌ 第{i+1}次jiahao按钮点击失败")
-                    return False
-            else:
-                Logger.warning(f"⚠️ 第{i+1}次未找到jiahao按钮")
-                return False
-        
-        # 第五步：等待1秒
-        Logger.info("⏰ 第五步：等待1秒...")
-        time.sleep(1)
-        
-        # 第六步：点击tiaozhan
-        Logger.info("🔍 第六步：搜索并点击tiaozhan按钮")
-        screenshot = self.screen_capture.capture_screen()
-        if screenshot is None:
-            Logger.error("❌ 无法获取屏幕截图")
-            return False
-            
-        tiaozhan_result = self.image_processor.find_image(screenshot, 'tiaozhan')
-        if tiaozhan_result:
-            Logger.info("✅ 找到tiaozhan按钮")
-            tiaozhan_x, tiaozhan_y = tiaozhan_result['center']
-            if self.game_controller.click_position((tiaozhan_x, tiaozhan_y)):
-                Logger.info("✅ 成功点击tiaozhan按钮")
-            else:
-                Logger.error("❌ tiaozhan按钮点击失败")
-                return False
-        else:
-            Logger.warning("⚠️ 未找到tiaozhan按钮")
-            return False
-        
-        # 第七步：等待3秒
-        Logger.info("⏰ 第七步：等待3秒...")
-        time.sleep(3)
-        
-        # 第八步：点击kaishitiaozhan
-        Logger.info("🔍 第八步：搜索并点击kaishitiaozhan按钮")
-        screenshot = self.screen_capture.capture_screen()
-        if screenshot is None:
-            Logger.error("❌ 无法获取屏幕截图")
-            return False
-            
-        kaishitiaozhan_result = self.image_processor.find_image(screenshot, 'kaishitiaozhan')
-        if kaishitiaozhan_result:
-            Logger.info("✅ 找到kaishitiaozhan按钮")
-            kaishitiaozhan_x, kaishitiaozhan_y = kaishitiaozhan_result['center']
-            if self.game_controller.click_position((kaishitiaozhan_x, kaishitiaozhan_y)):
-                Logger.info("✅ 成功点击kaishitiaozhan按钮")
-                
-                # 执行倍速控制逻辑
-                return self.execute_beisu_control()
-            else:
-                Logger.error("❌ kaishitiaozhan按钮点击失败")
-                return False
-        else:
-            Logger.warning("⚠️ 未找到kaishitiaozhan按钮")
-            return False
-    
-    def execute_beisu_control(self):
-        """执行智能倍速控制：等待10s → 检测beisukai和beisuguan → 自动切换到开启状态"""
-        Logger.info("🚀 开始智能倍速控制")
-        
-        # 第一步：等待10秒
-        Logger.info("⏰ 等待10秒...")
-        time.sleep(10)
-        
-        # 最大尝试次数，防止无限循环
-        max_attempts = 5
-        attempt = 0
-        
-        while attempt < max_attempts:
-            attempt += 1
-            Logger.info(f"🔍 第{attempt}次检测倍速状态")
-            
-            # 获取当前屏幕截图
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                Logger.error("❌ 无法获取屏幕截图")
-                return False
-            
-            # 同时检测两种倍速状态
-            beisukai_result = self.image_processor.find_image(screenshot, 'beisukai')
-            beisuguan_result = self.image_processor.find_image(screenshot, 'beisuguan')
-            
-            # 获取置信度
-            beisukai_confidence = beisukai_result['confidence'] if beisukai_result else 0.0
-            beisuguan_confidence = beisuguan_result['confidence'] if beisuguan_result else 0.0
-            
-            Logger.info(f"📊 倍速状态检测结果：")
-            Logger.info(f"   beisukai（亮/开启）置信度: {beisukai_confidence:.3f}")
-            Logger.info(f"   beisuguan（暗/关闭）置信度: {beisuguan_confidence:.3f}")
-            
-            # 判断当前状态
-            if beisukai_confidence > beisuguan_confidence:
-                Logger.info("✅ 倍速已开启（beisukai置信度更高），无需操作")
-                Logger.info("✅ 倍速控制成功，开始检测自动功能")
-                # 继续执行自动功能控制
-                return self.execute_zidong_control()
-            elif beisuguan_confidence > beisukai_confidence:
-                Logger.info("🔄 倍速未开启（beisuguan置信度更高），尝试点击开启")
-                
-                if beisuguan_result:
-                    beisuguan_x, beisuguan_y = beisuguan_result['center']
-                    if self.game_controller.click_position((beisuguan_x, beisuguan_y)):
-                        Logger.info("✅ 成功点击beisuguan，尝试开启倍速")
-                        time.sleep(1)  # 等待界面响应
-                        
-                        # 检查是否成功切换
-                        check_screenshot = self.screen_capture.capture_screen()
-                        if check_screenshot is not None:
-                            check_beisukai = self.image_processor.find_image(check_screenshot, 'beisukai')
-                            check_beisuguan = self.image_processor.find_image(check_screenshot, 'beisuguan')
-                            
-                            check_beisukai_conf = check_beisukai['confidence'] if check_beisukai else 0.0
-                            check_beisuguan_conf = check_beisuguan['confidence'] if check_beisuguan else 0.0
-                            
-                            if check_beisukai_conf > check_beisuguan_conf:
-                                Logger.info("✅ 倍速控制成功，开始检测自动功能")
-                                return self.execute_zidong_control()
-                        
-                        continue  # 继续下一次检测
-                    else:
-                        Logger.error("❌ beisuguan点击失败")
-                        return False
-                else:
-                    Logger.warning("⚠️ 检测到beisuguan置信度更高，但未找到具体位置")
-                    return False
-            else:
-                Logger.warning("⚠️ 两种倍速状态置信度相同，可能检测异常")
-                time.sleep(1)  # 等待后重试
-                continue
-        
-        Logger.warning(f"⚠️ 达到最大尝试次数({max_attempts})，倍速控制可能未完全成功")
-        Logger.info("🔄 倍速控制达到最大尝试次数，继续检测自动功能")
-        # 即使倍速控制未完全成功，也继续执行自动功能控制
-        return self.execute_zidong_control()
-    
-    def execute_zidong_control(self):
-        """执行智能自动功能控制：检测zidongkai和zidongguan → 自动切换到开启状态"""
-        Logger.info("🚀 开始智能自动功能控制")
-        
-        # 最大尝试次数，防止无限循环
-        max_attempts = 5
-        attempt = 0
-        
-        while attempt < max_attempts:
-            attempt += 1
-            Logger.info(f"🔍 第{attempt}次检测自动功能状态")
-            
-            # 获取当前屏幕截图
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                Logger.error("❌ 无法获取屏幕截图")
-                return False
-            
-            # 同时检测两种自动功能状态
-            zidongkai_result = self.image_processor.find_image(screenshot, 'zidongkai')
-            zidongguan_result = self.image_processor.find_image(screenshot, 'zidongguan')
-            
-            # 获取置信度
-            zidongkai_confidence = zidongkai_result['confidence'] if zidongkai_result else 0.0
-            zidongguan_confidence = zidongguan_result['confidence'] if zidongguan_result else 0.0
-            
-            Logger.info(f"📊 自动功能状态检测结果：")
-            Logger.info(f"   zidongkai（金色/开启）置信度: {zidongkai_confidence:.3f}")
-            Logger.info(f"   zidongguan（灰色/关闭）置信度: {zidongguan_confidence:.3f}")
-            
-            # 判断当前状态
-            if zidongkai_confidence > zidongguan_confidence:
-                Logger.info("✅ 自动功能已开启（zidongkai置信度更高），无需操作")
-                Logger.info("✅ 自动功能控制成功，开始持续检测循环")
-                # 继续执行持续检测循环
-                return self.execute_continuous_cycle_detection()
-            elif zidongguan_confidence > zidongkai_confidence:
-                Logger.info("🔄 自动功能未开启（zidongguan置信度更高），尝试点击开启")
-                
-                if zidongguan_result:
-                    zidongguan_x, zidongguan_y = zidongguan_result['center']
-                    if self.game_controller.click_position((zidongguan_x, zidongguan_y)):
-                        Logger.info("✅ 成功点击zidongguan，尝试开启自动功能")
-                        time.sleep(1)  # 等待界面响应
-                        
-                        # 检查是否成功切换
-                        check_screenshot = self.screen_capture.capture_screen()
-                        if check_screenshot is not None:
-                            check_zidongkai = self.image_processor.find_image(check_screenshot, 'zidongkai')
-                            check_zidongguan = self.image_processor.find_image(check_screenshot, 'zidongguan')
-                            
-                            check_zidongkai_conf = check_zidongkai['confidence'] if check_zidongkai else 0.0
-                            check_zidongguan_conf = check_zidongguan['confidence'] if check_zidongguan else 0.0
-                            
-                            if check_zidongkai_conf > check_zidongguan_conf:
-                                Logger.info("✅ 自动功能控制成功，开始持续检测循环")
-                                return self.execute_continuous_cycle_detection()
-                        
-                        continue  # 继续下一次检测
-                    else:
-                        Logger.error("❌ zidongguan按钮点击失败")
-                        return False
-                else:
-                    Logger.warning("⚠️ 检测到zidongguan置信度更高，但未找到具体位置")
-                    return False
-            else:
-                Logger.warning("⚠️ 两种自动功能状态置信度相同，可能检测异常")
-                time.sleep(1)  # 等待后重试
-                continue
-        
-        Logger.warning(f"⚠️ 达到最大尝试次数({max_attempts})，自动功能控制可能未完全成功")
-        Logger.info("🔄 自动功能控制达到最大尝试次数，继续持续检测循环")
-        # 即使自动功能控制未完全成功，也继续执行持续检测循环
-        return self.execute_continuous_cycle_detection()
-    
-    def execute_continuous_cycle_detection(self):
-        """执行持续检测循环：无限循环检测zailaiyici和tuichuguanqia，检测到后等待2s并点击"""
-        Logger.info("🔄 开始持续检测循环（无时间限制）")
-        
-        # 阶段1：持续检测"再来一次"
-        Logger.info("🔍 阶段1：持续检测zailaiyici（再来一次）...")
-        zailaiyici_detected = False
-        check_count = 0
-        
-        while not zailaiyici_detected:
-            check_count += 1
-            if check_count % 10 == 0:  # 每10次检测输出一次日志，避免日志过多
-                Logger.info(f"🔍 已检测zailaiyici {check_count}次，继续等待...")
-            
-            # 获取屏幕截图
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                Logger.warning("⚠️ 无法获取屏幕截图，等待1秒后重试")
-                time.sleep(1)
-                continue
-            
-            # 检测zailaiyici
-            zailaiyici_result = self.image_processor.find_image(screenshot, 'zailaiyici')
-            if zailaiyici_result:
-                Logger.info("✅ 检测到zailaiyici（再来一次）按钮")
-                zailaiyici_detected = True
-                
-                # 等待2秒
-                Logger.info("⏰ 等待2秒...")
-                time.sleep(2)
-                
-                # 点击zailaiyici
-                zailaiyici_x, zailaiyici_y = zailaiyici_result['center']
-                if self.game_controller.click_position((zailaiyici_x, zailaiyici_y)):
-                    Logger.info("✅ 成功点击zailaiyici按钮")
-                    
-                    # 点击后等待10秒再进入下一阶段
-                    Logger.info("⏰ 等待10秒后开始检测退出关卡...")
-                    time.sleep(10)
-                else:
-                    Logger.error("❌ zailaiyici按钮点击失败")
-                    return False
-            else:
-                # 未检测到，等待1秒后继续
-                time.sleep(1)
-        
-        # 阶段2：持续检测"退出关卡"
-        Logger.info("🔍 阶段2：持续检测tuichuguanqia（退出关卡）...")
-        tuichuguanqia_detected = False
-        check_count = 0
-        
-        while not tuichuguanqia_detected:
-            check_count += 1
-            if check_count % 10 == 0:  # 每10次检测输出一次日志，避免日志过多
-                Logger.info(f"🔍 已检测tuichuguanqia {check_count}次，继续等待...")
-            
-            # 获取屏幕截图
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                Logger.warning("⚠️ 无法获取屏幕截图，等待1秒后重试")
-                time.sleep(1)
-                continue
+            hit = self.wait_for([target_image], timeout=deadline - time.time())
+            if hit is None:
+                break
             
-            # 检测tuichuguanqia
-            tuichuguanqia_result = self.image_processor.find_image(screenshot, 'tuichuguanqia')
-            if tuichuguanqia_result:
-                Logger.info("✅ 检测到tuichuguanqia（退出关卡）按钮")
-                tuichuguanqia_detected = True
-                
-                # 等待2秒
-                Logger.info("⏰ 等待2秒...")
-                time.sleep(2)
-                
-                # 点击tuichuguanqia
-                tuichuguanqia_x, tuichuguanqia_y = tuichuguanqia_result['center']
-                if self.game_controller.click_position((tuichuguanqia_x, tuichuguanqia_y)):
-                    Logger.info("✅ 成功点击tuichuguanqia按钮")
-                    # 继续执行退出后的流程
-                    return self.execute_post_exit_flow()
-                else:
-                    Logger.error("❌ tuichuguanqia按钮点击失败")
-                    return False
-            else:
-                # 未检测到，等待1秒后继续
-                time.sleep(1)
-        
-        return True
-    
-    def execute_post_exit_flow(self):
-        """执行退出后的流程：检测close → 点击task → 持续点击所有lingqu"""
-        Logger.info("🚀 开始执行退出后流程")
-        
-        # 阶段1：检测并点击close
-        Logger.info("🔍 阶段1：检测close按钮...")
-        close_detected = False
-        check_count = 0
-        
-        while not close_detected:
-            check_count += 1
-            if check_count % 10 == 0:
-                Logger.info(f"🔍 已检测close {check_count}次，继续等待...")
-            
-            # 获取屏幕截图
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                Logger.warning("⚠️ 无法获取屏幕截图，等待1秒后重试")
-                time.sleep(1)
-                continue
-            
-            # 检测close
-            close_result = self.image_processor.find_image(screenshot, 'close')
-            if close_result:
-                Logger.info("✅ 检测到close按钮")
-                close_detected = True
-                
-                # 等待2秒
-                Logger.info("⏰ 等待2秒...")
-                time.sleep(2)
-                
-                # 点击close
-                close_x, close_y = close_result['center']
-                if self.game_controller.click_position((close_x, close_y)):
-                    Logger.info("✅ 成功点击close按钮")
-                else:
-                    Logger.error("❌ close按钮点击失败")
-                    return False
-            else:
-                # 未检测到，等待1秒后继续
-                time.sleep(1)
-        
-        # 阶段2：等待1秒后点击task
-        Logger.info("⏰ 阶段2：等待1秒...")
-        time.sleep(1)
-        
-        Logger.info("🔍 阶段2：搜索并点击task按钮")
-        screenshot = self.screen_capture.capture_screen()
-        if screenshot is None:
-            Logger.error("❌ 无法获取屏幕截图")
-            return False
-        
-        task_result = self.image_processor.find_image(screenshot, 'task')
-        if task_result:
-            Logger.info("✅ 找到task按钮")
-            task_x, task_y = task_result['center']
-            if self.game_controller.click_position((task_x, task_y)):
-                Logger.info("✅ 成功点击task按钮")
-            else:
-                Logger.error("❌ task按钮点击失败")
-                return False
-        else:
-            Logger.warning("⚠️ 未找到task按钮")
-            return False
-        
-        # 阶段3：等待3秒后持续检测并点击所有lingqu
-        Logger.info("⏰ 阶段3：等待3秒...")
-        time.sleep(3)
-        
-        Logger.info("🔍 阶段3：开始持续检测并点击所有lingqu...")
-        lingqu_count = 0
-        
-        while True:
-            # 获取屏幕截图
-            screenshot = self.screen_capture.capture_screen()
-            if screenshot is None:
-                Logger.warning("⚠️ 无法获取屏幕截图，等待1秒后重试")
-                time.sleep(1)
-                continue
+            Logger.info(f"找到目标按钮: {target_image}")
             
-            # 检测lingqu
-            lingqu_result = self.image_processor.find_image(screenshot, 'lingqu')
-            if lingqu_result:
-                lingqu_count += 1
-                Logger.info(f"✅ 检测到第{lingqu_count}个lingqu按钮")
-                
-                # 点击lingqu
-                lingqu_x, lingqu_y = lingqu_result['center']
-                if self.game_controller.click_position((lingqu_x, lingqu_y)):
-                    Logger.info(f"✅ 成功点击第{lingqu_count}个lingqu按钮")
-                    
-                    # 每次点击后等待1秒
-                    Logger.info("⏰ 等待1秒...")
-                    time.sleep(1)
-                else:
-                    Logger.error(f"❌ 第{lingqu_count}个lingqu按钮点击失败")
-                    return False
-            else:
-                # 未检测到lingqu，说明已经全部领取完毕
-                Logger.info(f"✅ 已完成所有lingqu点击，共点击了{lingqu_count}个")
-                # 继续执行400/500判断流程
-                return self.execute_gift_check_flow()
-    
-    def execute_gift_check_flow(self):
-        """执行礼物检查流程：比较400和500的置信度，如果500更高则点击gift"""
-        Logger.info("🎁 开始执行礼物检查流程")
+            # 点击按钮
+            if self.click(hit['result']['center']):
+                Logger.info("✅ 任务按钮点击成功")
+                return True
         
-        # 获取屏幕截图
-        screenshot = self.screen_capture.capture_screen()
-        if screenshot is None:
-            Logger.error("❌ 无法获取屏幕截图")
+        if not self.is_running:
             return False
-        
-        # 检测400和500
-        Logger.info("🔍 检测400和500的置信度...")
-        result_400 = self.image_processor.find_image(screenshot, '400')
-        result_500 = self.image_processor.find_image(screenshot, '500')
-        
-        # 获取置信度（如果没有检测到，置信度为0）
-        confidence_400 = result_400['confidence'] if result_400 else 0.0
-        confidence_500 = result_500['confidence'] if result_500 else 0.0
-        
-        Logger.info("📊 礼物检测结果：")
-        Logger.info(f"   400置信度: {confidence_400:.3f}")
-        Logger.info(f"   500置信度: {confidence_500:.3f}")
-        
-        # 比较置信度
-        if confidence_500 > confidence_400:
-            Logger.info("✅ 500置信度更高，执行gift点击流程")
-            
-            # 检测gift位置
-            gift_result = self.image_processor.find_image(screenshot, 'gift')
-            if not gift_result:
-                Logger.error("❌ 未找到gift按钮")
-                return False
-            
-            gift_x, gift_y = gift_result['center']
-            Logger.info(f"🎁 找到gift按钮位置: ({gift_x}, {gift_y})")
-            
-            # 第一次点击gift
-            Logger.info("🎯 第一次点击gift...")
-            if not self.game_controller.click_position((gift_x, gift_y)):
-                Logger.error("❌ gift按钮第一次点击失败")
-                return False
-            Logger.info("✅ gift第一次点击成功")
-            
-            # 等待1秒
-            Logger.info("⏰ 等待1秒...")
-            time.sleep(1)
-            
-            # 第二次点击gift
-            Logger.info("🎯 第二次点击gift...")
-            if not self.game_controller.click_position((gift_x, gift_y)):
-                Logger.error("❌ gift按钮第二次点击失败")
-                return False
-            Logger.info("✅ gift第二次点击成功")
-            
-            # 等待2秒
-            Logger.info("⏰ 等待2秒...")
-            time.sleep(2)
-            
-            # 点击close
-            Logger.info("🔍 搜索并点击close按钮...")
-            close_screenshot = self.screen_capture.capture_screen()
-            if close_screenshot is None:
-                Logger.error("❌ 无法获取屏幕截图")
-                return False
-            
-            close_result = self.image_processor.find_image(close_screenshot, 'close')
-            if not close_result:
-                Logger.error("❌ 未找到close按钮")
-                return False
-            
-            close_x, close_y = close_result['center']
-            if self.game_controller.click_position((close_x, close_y)):
-                Logger.info("✅ 成功点击close按钮")
-                Logger.info("🎉 礼物检查流程完成！")
-                Logger.info("🎉 委托任务完成！所有流程执行成功")
-                return True
-            else:
-                Logger.error("❌ close按钮点击失败")
-                return False
-        else:
-            Logger.info("ℹ️ 400置信度更高或相等，跳过gift点击流程")
-            Logger.info("🎉 委托任务完成！所有流程执行成功")
-            return True
+        Logger.error("❌ 未找到任务按钮")
+        return False
     
     def execute_daily_tasks(self, task):
         """执行每日任务"""
@@ -1081,21 +494,44 @@ class AutomationEngine:
         # 比如：领取奖励、完成副本等
         
         # 模拟任务执行
-        time.sleep(5)
+        self.cancel_token.sleep(5)
         
         Logger.info("✅ 每日任务完成")
         return True
     
     def stop(self):
-        """停止自动化"""
+        """停止自动化：取消令牌，正在进行的等待、截图和匹配立即退出"""
         Logger.info("停止自动化引擎")
         self.is_running = False
+        self.cancel_token.cancel(time.time())
+        if self.capture_service:
+            self.capture_service.wake()
+        if self.match_pipeline:
+            self.match_pipeline.wake()
+    
+    def _report_stop_latency(self):
+        """记录停止请求到流程退出的耗时"""
+        requested = self.cancel_token.cancelled_at
+        if requested is None:
+            return
+        self.last_stop_latency = time.time() - requested
+        message = f"⏹️ 停止耗时: {self.last_stop_latency * 1000:.0f}ms"
+        if self.last_stop_latency > self.STOP_LATENCY_BUDGET:
+            Logger.warning(f"{message}（超过{self.STOP_LATENCY_BUDGET * 1000:.0f}ms）")
+        else:
+            Logger.info(message)
     
     def get_status(self):
         """获取当前状态"""
         if not self.is_running:
             return "就绪"
-        elif self.current_task:
-            return f"执行中: {self.current_task['name']}"
+        
+        backend = self.capture_selector.current
+        capture = ""
+        if backend and backend.mean_latency is not None:
+            capture = f" | 截图: {backend.name} {backend.mean_latency * 1000:.0f}ms"
+        
+        if self.current_task:
+            return f"执行中: {self.current_task['name']}{capture}"
         else:
-            return "运行中"
+            return f"运行中{capture}"
@@ -0,0 +1,91 @@
+"""
+并行匹配基准测试 - 测量模板匹配在不同线程数下的耗时
+把所有模板贴到一张合成截图上，依次用1~N个线程：
+  1. 批量匹配全部模板（模板间并行）
+  2. 单独匹配最大的模板（单模板分带并行）
+
+用法: python benchmark_matching.py [最大线程数] [重复次数]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from image_processor import ImageProcessor
+
+# 合成截图尺寸（与常见手机竖屏分辨率一致）
+FRAME_WIDTH = 1080
+FRAME_HEIGHT = 2400
+
+
+def build_frame(templates, seed=0):
+    """生成随机背景并按网格贴上所有模板"""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, (FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+
+    x, y, row_h = 0, 0, 0
+    for template in templates.values():
+        h, w = template.shape[:2]
+        if h > FRAME_HEIGHT or w > FRAME_WIDTH:
+            continue
+        if x + w > FRAME_WIDTH:
+            x, y, row_h = 0, y + row_h, 0
+        if y + h > FRAME_HEIGHT:
+            break
+        frame[y:y + h, x:x + w] = template[:, :, :3]
+        x += w
+        row_h = max(row_h, h)
+    return frame
+
+
+def run(func, repeats):
+    """返回多轮执行的最短耗时（秒）"""
+    # 预热：创建线程池、模板预处理
+    func()
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(title, processor, func, max_workers, repeats):
+    """依次设置1~max_workers个线程执行func，打印耗时和加速比"""
+    print(title)
+    print(f"{'线程数':>6} {'耗时(ms)':>10} {'加速比':>8}")
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        processor.set_max_workers(workers)
+        elapsed = run(func, repeats)
+        baseline = baseline or elapsed
+        print(f"{workers:>6} {elapsed * 1000:>10.1f} {baseline / elapsed:>8.2f}")
+
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    # 关闭搜索区域索引和结果缓存，每轮都做完整的全屏匹配；
+    # 分带数固定，保证不同线程数下的匹配结果一致
+    processor = ImageProcessor(use_search_index=False, match_cache_size=0, max_workers=1,
+                               tile_bands=ImageProcessor.DEFAULT_TILE_BANDS)
+    names = sorted(processor.templates)
+    frame = build_frame(processor.templates)
+    largest = max(names, key=lambda name: processor.templates[name].size)
+
+    print(f"CPU核数: {os.cpu_count()}，模板数: {len(names)}，截图: {FRAME_WIDTH}x{FRAME_HEIGHT}")
+    report("\n[模板间并行] find_images 全部模板", processor,
+           lambda: processor.find_images(frame, names), max_workers, repeats)
+    report(f"\n[单模板分带并行] find_image {largest} (分带数: {processor.tile_bands})", processor,
+           lambda: processor.find_image(frame, largest), max_workers, repeats)
+
+    processor.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -40,6 +40,12 @@ fi
 # 获取构建类型
 BUILD_TYPE=${1:-debug}
 
+# 预编译模板包（设备启动时内存映射加载，无需解码PNG）
+if [ "$BUILD_TYPE" != "clean" ]; then
+    echo -e "${GREEN}生成模板包...${NC}"
+    python3 build_template_pack.py || echo -e "${YELLOW}警告：模板包生成失败，将在设备上解码PNG${NC}"
+fi
+
 case $BUILD_TYPE in
     debug)
         echo -e "${GREEN}开始构建Debug版本...${NC}"
@@ -0,0 +1,44 @@
+"""
+模板包构建脚本 - 打包APK前运行
+把templates目录下的PNG解码一次，写入 templates/templates.pack，
+设备启动时直接内存映射该文件，不再逐个解码PNG
+
+用法: python build_template_pack.py [模板目录]
+"""
+
+import os
+import sys
+import glob
+
+import numpy as np
+from PIL import Image
+
+from template_pack import write_pack, source_digest, TEMPLATE_PACK_NAME
+
+
+def main():
+    template_dir = sys.argv[1] if len(sys.argv) > 1 else 'templates'
+
+    if not os.path.isdir(template_dir):
+        print(f"模板目录不存在: {template_dir}")
+        return 1
+
+    templates = {}
+    sources = {}
+    for filepath in sorted(glob.glob(os.path.join(template_dir, '*.png'))):
+        filename = os.path.basename(filepath)
+        name = filename[:-len('.png')]
+        with Image.open(filepath) as image:
+            rgb = np.asarray(image.convert('RGB'))
+        # RGB -> BGR，与OpenCV加载结果一致
+        templates[name] = np.ascontiguousarray(rgb[:, :, ::-1])
+        sources[name] = (filename, os.path.getsize(filepath), source_digest(filepath))
+
+    pack_path = os.path.join(template_dir, TEMPLATE_PACK_NAME)
+    count = write_pack(pack_path, templates, sources)
+    print(f"已写入模板包: {pack_path} ({count} 个模板, {os.path.getsize(pack_path)} 字节)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,7 +16,7 @@ package.domain = com.hsr.automation
 source.dir = .
 
 # (list) Source files to include (let empty to include all the files)
-source.include_exts = py,png,jpg,kv,atlas,txt,yaml,json,ttc
+source.include_exts = py,png,jpg,kv,atlas,txt,yaml,json,ttc,pack
 
 # (list) List of inclusions using pattern matching
 source.include_patterns = fonts/*.ttc,service/*.java,service/*.xml
@@ -26,7 +26,7 @@ version = 1.0
 
 # (list) Application requirements
 # comma separated e.g. requirements = sqlite3,kivy
-requirements = python3,kivy,numpy,opencv
+requirements = python3,kivy,numpy,opencv,pyyaml
 
 # (str) Custom source folders for requirements
 # Sets custom source for any requirements with recipes
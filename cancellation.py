@@ -0,0 +1,47 @@
+"""
+取消令牌模块 - 让等待、截图和匹配及时响应停止请求
+"""
+
+import threading
+
+
+class OperationCancelled(Exception):
+    """操作已被取消（AutomationEngine.stop）"""
+
+
+class CancellationToken:
+    """
+    基于threading.Event的取消令牌
+
+    sleep()/wait()在取消时立即返回；check()在已取消时抛出OperationCancelled，
+    由流程最外层（AutomationEngine.run）统一捕获
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.cancelled_at = None
+
+    @property
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, timestamp=None):
+        """请求取消（可从任意线程调用）"""
+        if not self._event.is_set():
+            self.cancelled_at = timestamp
+            self._event.set()
+
+    def wait(self, timeout=None):
+        """等待取消，返回是否已取消"""
+        return self._event.wait(timeout)
+
+    def check(self):
+        """已取消时抛出OperationCancelled"""
+        if self._event.is_set():
+            raise OperationCancelled()
+
+    def sleep(self, seconds):
+        """可中断的sleep，取消时抛出OperationCancelled"""
+        if seconds > 0 and self._event.wait(seconds):
+            raise OperationCancelled()
+        self.check()
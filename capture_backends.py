@@ -0,0 +1,526 @@
+"""
+截图后端模块 - 统一的截图接口
+每种截图方式实现为一个CaptureBackend：shell screencap、MediaProjection、桌面截图，
+以及从图片目录/视频文件回放的Replay后端（无设备时在Linux上端到端调试和测速）
+
+每个后端声明自身能力并统计实测延迟，运行时可探测并选出最快的可用后端
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from kivy.logger import Logger
+from kivy.utils import platform
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+REPLAY_IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+class CircuitBreaker:
+    """
+    后端熔断器：连续失败达到阈值后进入冷却期，冷却期内不再尝试该后端
+
+    每次熔断的冷却时间按指数增长（base * 2^(熔断次数-1)，不超过上限），
+    成功一次后熔断次数清零
+    """
+
+    def __init__(self, failure_threshold=1, base_cooldown=5.0, max_cooldown=300.0):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+
+    def is_open(self, now=None):
+        """是否处于冷却期"""
+        return (now or time.time()) < self.open_until
+
+    def remaining(self, now=None):
+        return max(0.0, self.open_until - (now or time.time()))
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+
+    def record_failure(self, now=None):
+        """记录一次失败，触发熔断时返回冷却秒数，否则返回0"""
+        self.consecutive_failures += 1
+        if self.consecutive_failures < self.failure_threshold:
+            return 0.0
+
+        self.trips += 1
+        self.consecutive_failures = 0
+        cooldown = min(self.max_cooldown, self.base_cooldown * 2 ** (self.trips - 1))
+        self.open_until = (now or time.time()) + cooldown
+        return cooldown
+
+
+class CaptureBackend:
+    """
+    截图后端基类
+
+    子类实现is_available()和_capture()；capture()负责计时和统计
+    """
+
+    name = 'base'
+
+    # 能力声明：
+    #   device: 需要Android设备
+    #   permission: 需要用户授予屏幕录制权限
+    #   realtime: 返回的是实时屏幕画面（回放后端为False）
+    #   scaled_at_source: 截图在源头已缩小到分析比例
+    capabilities = {'device': False, 'permission': False, 'realtime': True, 'scaled_at_source': False}
+
+    # 延迟统计的滑动窗口大小
+    LATENCY_WINDOW = 50
+
+    def __init__(self):
+        # 输出画面相对设备分辨率的比例
+        self.source_scale = 1.0
+        # 截图数组取自的帧缓冲池（不使用缓冲池的后端为None）
+        self.frame_pool = None
+        self.breaker = CircuitBreaker()
+        self._latencies = deque(maxlen=self.LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.captures = 0
+        self.failures = 0
+
+    def is_available(self):
+        """当前环境下能否使用该后端"""
+        return False
+
+    def _capture(self):
+        """截取一帧，返回BGR数组，失败时返回None"""
+        raise NotImplementedError
+
+    def capture(self):
+        """截取一帧并记录延迟"""
+        started = time.perf_counter()
+        try:
+            frame = self._capture()
+        except Exception as e:
+            Logger.error(f"{self.name}截图失败: {e}")
+            frame = None
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            if frame is None:
+                self.failures += 1
+            else:
+                self.captures += 1
+                self._latencies.append(elapsed)
+        return frame
+
+    def release_frame(self, frame):
+        """归还不再使用的截图（探测截图只用于计时），不是缓冲池借出的数组直接忽略"""
+        if self.frame_pool is not None and frame is not None:
+            self.frame_pool.release(frame)
+
+    @property
+    def mean_latency(self):
+        """最近若干次成功截图的平均延迟（秒），还没有成功截图时为None"""
+        with self._lock:
+            if not self._latencies:
+                return None
+            return sum(self._latencies) / len(self._latencies)
+
+    def stats(self):
+        """截图次数、失败次数和延迟（毫秒）"""
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = {'name': self.name, 'captures': self.captures, 'failures': self.failures}
+        if self.breaker.is_open():
+            stats['cooldown_s'] = self.breaker.remaining()
+        if latencies:
+            stats['mean_ms'] = sum(latencies) / len(latencies) * 1000
+            stats['min_ms'] = min(latencies) * 1000
+            stats['last_ms'] = latencies[-1] * 1000
+        return stats
+
+    def close(self):
+        """释放后端资源"""
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.name}>"
+
+
+def _pil_to_bgr(image, frame_pool=None):
+    """
+    PIL Image转换为BGR数组
+
+    指定frame_pool时直接从RGB/RGBA像素转换到池中取出的数组，不再生成中间的RGB图像和数组
+    """
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    pixels = np.asarray(image)
+
+    if frame_pool is None:
+        return np.ascontiguousarray(pixels[:, :, 2::-1])
+
+    bgr = frame_pool.acquire(pixels.shape[:2] + (3,))
+    if CV2_AVAILABLE:
+        code = cv2.COLOR_RGBA2BGR if pixels.shape[2] == 4 else cv2.COLOR_RGB2BGR
+        cv2.cvtColor(pixels, code, dst=bgr)
+    else:
+        np.copyto(bgr, pixels[:, :, 2::-1])
+    return bgr
+
+
+class ShellCaptureBackend(CaptureBackend):
+    """
+    screencap截图（无需权限）
+
+    mode为'raw'时读取原始像素（常驻shell），为'png'时使用旧的PNG文件方式
+    """
+
+    capabilities = {'device': True, 'permission': False, 'realtime': True, 'scaled_at_source': True}
+
+    def __init__(self, screen_capture, mode='raw'):
+        super().__init__()
+        self.screen_capture = screen_capture
+        self.mode = mode
+        self.name = f"shell-{mode}"
+        self.frame_pool = screen_capture.frame_pool
+        # 原始截图无OpenCV时按整数步长抽取，实际比例可能与analysis_scale不同
+        self.source_scale = screen_capture.raw_scale if mode == 'raw' else screen_capture.analysis_scale
+
+    def is_available(self):
+        return self.screen_capture.is_android and NUMPY_AVAILABLE
+
+    def _capture(self):
+        if self.mode == 'raw':
+            return self.screen_capture.capture_screen_raw()
+
+        image = self.screen_capture.capture_screen_shell()
+        if PIL_AVAILABLE and isinstance(image, Image.Image):
+            return _pil_to_bgr(image, self.screen_capture.frame_pool)
+        # PIL不可用时返回的是文件路径，无法作为数组帧使用
+        return None
+
+    def close(self):
+        if self.mode == 'raw' and self.screen_capture.shell_worker:
+            self.screen_capture.shell_worker.stop()
+
+
+class MediaProjectionCaptureBackend(CaptureBackend):
+    """MediaProjection截图（需要屏幕录制权限）"""
+
+    name = 'media-projection'
+    capabilities = {'device': True, 'permission': True, 'realtime': True, 'scaled_at_source': True}
+
+    def __init__(self, screen_capture):
+        super().__init__()
+        self.screen_capture = screen_capture
+        self.frame_pool = screen_capture.frame_pool
+        self.source_scale = screen_capture.analysis_scale
+
+    def is_available(self):
+        return self.screen_capture.is_android and NUMPY_AVAILABLE and self.screen_capture.is_ready()
+
+    def _capture(self):
+        return self.screen_capture.capture_screen_projection()
+
+
+class DesktopCaptureBackend(CaptureBackend):
+    """桌面截图（PIL ImageGrab）"""
+
+    name = 'desktop'
+
+    def __init__(self, frame_pool=None):
+        super().__init__()
+        self.frame_pool = frame_pool
+
+    def is_available(self):
+        if platform == 'android' or not (PIL_AVAILABLE and NUMPY_AVAILABLE):
+            return False
+        try:
+            from PIL import ImageGrab
+            return ImageGrab is not None
+        except ImportError:
+            return False
+
+    def _capture(self):
+        from PIL import ImageGrab
+        return _pil_to_bgr(ImageGrab.grab(), self.frame_pool)
+
+
+class ReplayCaptureBackend(CaptureBackend):
+    """
+    回放截图：按顺序返回图片目录中的图片或视频文件中的帧
+
+    用于在没有设备的Linux上驱动完整流程和测速。
+    hold为秒数时，每一帧在被首次取出后保持hold秒再切换到下一帧，模拟停留在某个界面的屏幕；
+    为None时每次截图都前进一帧
+    """
+
+    name = 'replay'
+    capabilities = {'device': False, 'permission': False, 'realtime': False, 'scaled_at_source': False}
+
+    def __init__(self, source, loop=True, hold=None, preload=False):
+        """
+        参数:
+            source: 图片目录或视频文件路径
+            loop: 播放完后是否从头开始
+            hold: 每帧保持的秒数
+            preload: 图片目录是否预先全部解码到内存（测速时排除解码开销）
+        """
+        super().__init__()
+        self.source = source
+        self.loop = loop
+        self.hold = hold
+        self.name = f"replay:{os.path.basename(os.path.normpath(source))}"
+
+        self._files = []
+        self._frames = None
+        self._video = None
+        self._position = 0
+        self._current = None
+        self._current_since = None
+
+        if os.path.isdir(source):
+            self._files = sorted(
+                os.path.join(source, filename) for filename in os.listdir(source)
+                if filename.lower().endswith(REPLAY_IMAGE_EXTS)
+            )
+            if preload:
+                self._frames = [self._load_image(path) for path in self._files]
+        elif os.path.isfile(source) and CV2_AVAILABLE:
+            self._video = cv2.VideoCapture(source)
+
+    def is_available(self):
+        if not NUMPY_AVAILABLE:
+            return False
+        if self._video is not None:
+            return self._video.isOpened()
+        return bool(self._files)
+
+    def _load_image(self, path):
+        if CV2_AVAILABLE:
+            return cv2.imread(path, cv2.IMREAD_COLOR)
+        if PIL_AVAILABLE:
+            with Image.open(path) as image:
+                return _pil_to_bgr(image)
+        return None
+
+    def _next_frame(self):
+        """读取下一帧，播放结束且不循环时返回None"""
+        if self._video is not None:
+            ok, frame = self._video.read()
+            if not ok and self.loop:
+                self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = self._video.read()
+            return frame if ok else None
+
+        if self._position >= len(self._files):
+            if not self.loop:
+                return None
+            self._position = 0
+        index = self._position
+        self._position += 1
+        if self._frames is not None:
+            return self._frames[index]
+        return self._load_image(self._files[index])
+
+    def _capture(self):
+        now = time.time()
+        if self._current is not None and self.hold is not None and now - self._current_since < self.hold:
+            return self._current
+
+        frame = self._next_frame()
+        if frame is not None:
+            self._current = frame
+            self._current_since = now
+        return frame
+
+    def close(self):
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+
+
+def create_backends(screen_capture=None, replay_source=None, replay_hold=None, frame_pool=None):
+    """
+    按当前环境创建候选后端列表（顺序即优先级）
+
+    指定replay_source时只使用回放后端
+    """
+    if replay_source:
+        return [ReplayCaptureBackend(replay_source, hold=replay_hold)]
+
+    backends = android_backends(screen_capture) if screen_capture is not None else []
+    backends.append(DesktopCaptureBackend(frame_pool))
+    return backends
+
+
+def android_backends(screen_capture):
+    """AndroidScreenCapture提供的后端：原始screencap（shell_mode为'png'时跳过）、MediaProjection、PNG screencap"""
+    backends = []
+    if screen_capture.shell_mode == 'raw':
+        backends.append(ShellCaptureBackend(screen_capture, 'raw'))
+    backends.append(MediaProjectionCaptureBackend(screen_capture))
+    backends.append(ShellCaptureBackend(screen_capture, 'png'))
+    return backends
+
+
+def select_fastest_backend(backends, probes=3):
+    """
+    探测所有可用后端，返回平均延迟最低的一个
+
+    每个后端连续截图probes次；全部失败的后端不参与选择，并记入其熔断器。
+    只有一个可用后端时不探测直接返回（探测会消耗回放后端的帧）。
+    没有后端可用时返回None
+    """
+    available = []
+    for backend in backends:
+        if backend.is_available():
+            available.append(backend)
+        else:
+            Logger.info(f"截图后端不可用: {backend.name}")
+
+    if len(available) == 1:
+        Logger.info(f"选用截图后端: {available[0].name}")
+        return available[0]
+
+    best = None
+    for backend in available:
+        for _ in range(probes):
+            backend.release_frame(backend.capture())
+
+        latency = backend.mean_latency
+        if latency is None:
+            cooldown = backend.breaker.record_failure()
+            Logger.warning(f"截图后端探测失败: {backend.name}"
+                           + (f"，冷却 {cooldown:.0f} 秒" if cooldown else ""))
+            continue
+
+        Logger.info(f"截图后端 {backend.name} 平均延迟: {latency * 1000:.1f}ms")
+        if best is None or latency < best.mean_latency:
+            best = backend
+
+    if best:
+        Logger.info(f"选用截图后端: {best.name}")
+    else:
+        Logger.error("没有可用的截图后端")
+    return best
+
+
+class BackendSelector:
+    """
+    粘性后端选择：一直使用上次成功的后端，失败时按优先级切换到其他未熔断的后端
+
+    失败的后端由各自的熔断器冷却（指数退避），冷却期内直接跳过，不再每帧付出失败的代价；
+    每隔reprobe_interval秒试探一个备选后端，明显更快时切换过去
+    """
+
+    # 备选后端平均延迟低于当前后端的该比例时才切换，避免来回抖动
+    SWITCH_RATIO = 0.8
+
+    def __init__(self, backends, reprobe_interval=60.0):
+        self.backends = list(backends)
+        self.reprobe_interval = reprobe_interval
+        self.current = None
+        self._last_probe = time.time()
+        self._probe_cursor = 0
+        self._lock = threading.Lock()
+
+    def capture(self):
+        """用当前后端截取一帧，失败时依次尝试其他后端；全部失败时返回None"""
+        with self._lock:
+            if self.current is None:
+                # 探测失败的后端已由熔断器冷却，全部冷却时不再每帧重新探测
+                candidates = [backend for backend in self.backends if not backend.breaker.is_open()]
+                if candidates:
+                    self.current = select_fastest_backend(candidates)
+                    self._last_probe = time.time()
+
+            if self.current is not None and time.time() - self._last_probe >= self.reprobe_interval:
+                self._reprobe()
+
+            tried = set()
+            backend = self.current
+            if backend is not None and backend.breaker.is_open():
+                # 当前后端处于冷却期，直接从备选后端开始
+                backend = self._next_candidate({backend})
+            while backend is not None:
+                tried.add(backend)
+                frame = backend.capture()
+                if frame is not None:
+                    backend.breaker.record_success()
+                    if backend is not self.current:
+                        Logger.info(f"截图后端切换为: {backend.name}")
+                        self.current = backend
+                    return frame
+
+                cooldown = backend.breaker.record_failure()
+                if cooldown:
+                    Logger.warning(f"截图后端 {backend.name} 连续失败，冷却 {cooldown:.0f} 秒")
+                backend = self._next_candidate(tried)
+            return None
+
+    def _next_candidate(self, tried):
+        """按优先级返回下一个可用、未熔断且本轮未尝试过的后端"""
+        for backend in self.backends:
+            if backend in tried or backend.breaker.is_open():
+                continue
+            if backend.is_available():
+                return backend
+        return None
+
+    def _reprobe(self):
+        """轮流试探一个备选后端，平均延迟明显更低时切换"""
+        self._last_probe = time.time()
+        alternatives = [backend for backend in self.backends
+                        if backend is not self.current and not backend.breaker.is_open()]
+        if not alternatives:
+            return
+
+        backend = alternatives[self._probe_cursor % len(alternatives)]
+        self._probe_cursor += 1
+        if not backend.is_available():
+            return
+
+        frame = backend.capture()
+        if frame is None:
+            backend.breaker.record_failure()
+            return
+        backend.release_frame(frame)
+        backend.breaker.record_success()
+
+        current_latency = self.current.mean_latency
+        latency = backend.mean_latency
+        if current_latency is None or (latency is not None and latency < current_latency * self.SWITCH_RATIO):
+            Logger.info(f"截图后端 {backend.name} 更快（{latency * 1000:.1f}ms），切换使用")
+            self.current = backend
+
+    def stats(self):
+        """每个后端的截图次数、失败次数、延迟和冷却状态，当前后端标记active"""
+        stats = []
+        for backend in self.backends:
+            backend_stats = backend.stats()
+            backend_stats['active'] = backend is self.current
+            stats.append(backend_stats)
+        return stats
+
+    def close(self):
+        for backend in self.backends:
+            backend.close()
@@ -0,0 +1,299 @@
+"""
+后台截图服务 - 独立线程按设定帧率持续截图
+截图写入预先分配的环形缓冲区，消费者随时取最新一帧，不必等待正在进行的截图；
+消费者来不及处理的旧帧直接丢弃
+
+每个消费线程持有（固定）自己最近取到的一帧，生产者不会覆盖被持有的槽位，
+线程取下一帧时自动释放上一帧；消费线程退出前调用release()，服务启动和停止时清除所有持有
+"""
+
+import time
+import threading
+from kivy.logger import Logger
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+
+class CapturedFrame:
+    """环形缓冲区中的一帧"""
+
+    def __init__(self, image, timestamp, index, slot=None):
+        # BGR数组（截图源返回非数组时为原始对象）
+        self.image = image
+        # 开始截图的时间（time.time()），画面不早于该时刻
+        self.timestamp = timestamp
+        # 帧序号，从1开始递增
+        self.index = index
+        self.slot = slot
+
+    @property
+    def age(self):
+        return time.time() - self.timestamp
+
+
+class CaptureService:
+    """持续截图的生产者线程和最新帧环形缓冲区"""
+
+    DEFAULT_FPS = 5.0
+    # 槽位数：生产者写入1个 + 每个消费线程持有1个 + 1个最新帧
+    DEFAULT_RING_SIZE = 4
+    # 截图耗时的指数平滑系数
+    LATENCY_SMOOTHING = 0.3
+
+    def __init__(self, capture_func, fps=DEFAULT_FPS, ring_size=DEFAULT_RING_SIZE, frame_pool=None):
+        """
+        参数:
+            capture_func: 截图函数，返回BGR数组（也接受PIL Image），失败时返回None
+            fps: 截图帧率上限
+            ring_size: 环形缓冲区槽位数
+            frame_pool: 截图函数使用的帧缓冲池，截图复制进环形缓冲区后立即归还
+        """
+        self.capture_func = capture_func
+        self.frame_pool = frame_pool
+        self.fps = fps
+        self.ring_size = max(2, ring_size)
+
+        self._slots = [None] * self.ring_size
+        # 每个槽位被多少个消费线程持有
+        self._pins = [0] * self.ring_size
+        # {线程ID: 该线程持有的帧}
+        self._held = {}
+        self._latest = None
+        self._next_index = 1
+
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self._stats = {'captured': 0, 'consumed': 0, 'dropped': 0, 'failures': 0}
+        self._last_consumed_index = 0
+        self._started_at = None
+        # 实测截图耗时（秒，指数平滑），还没有截图时为None
+        self.latency = None
+
+    # ---------- 生产者 ----------
+
+    def start(self):
+        """启动截图线程"""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._release_all()
+        self._started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name='capture-service', daemon=True)
+        self._thread.start()
+        Logger.info(f"后台截图服务已启动，帧率: {self.fps}")
+
+    def stop(self, timeout=2.0):
+        """停止截图线程"""
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self._release_all()
+        Logger.info(f"后台截图服务已停止: {self.stats()}")
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def set_fps(self, fps):
+        """调整截图帧率"""
+        self.fps = fps
+
+    def max_frame_age(self):
+        """
+        调用时正在截取的那一帧，其开始时间距今的上限：截图周期加上实测截图耗时
+
+        用作“足够新”的默认窗口，截图耗时超过截图周期时也能接受正在进行的截图，不必多等一帧
+        """
+        interval = 1.0 / self.fps if self.fps and self.fps > 0 else 0.0
+        return interval + (self.latency or 0.0)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = time.time()
+            try:
+                image = self.capture_func()
+            except Exception as e:
+                Logger.error(f"后台截图失败: {e}")
+                image = None
+
+            if image is None:
+                with self._condition:
+                    self._stats['failures'] += 1
+            else:
+                self._record_latency(time.time() - started)
+                self._publish(image, started)
+
+            interval = 1.0 / self.fps if self.fps and self.fps > 0 else 0
+            self._stop_event.wait(max(0.0, interval - (time.time() - started)))
+
+    def _record_latency(self, elapsed):
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += self.LATENCY_SMOOTHING * (elapsed - self.latency)
+
+    def _publish(self, image, timestamp):
+        """把截图写入空闲槽位并设为最新帧"""
+        image = self._to_bgr(image)
+
+        slot = None
+        if NUMPY_AVAILABLE and isinstance(image, np.ndarray):
+            with self._condition:
+                slot = self._free_slot()
+                if slot is None:
+                    # 所有槽位都被持有，丢弃这一帧
+                    self._stats['dropped'] += 1
+                    if self.frame_pool:
+                        self.frame_pool.release(image)
+                    return
+                # 写入期间占住槽位
+                self._pins[slot] += 1
+
+            buffer = self._slots[slot]
+            if buffer is None or buffer.shape != image.shape or buffer.dtype != image.dtype:
+                buffer = self._slots[slot] = np.empty_like(image)
+            np.copyto(buffer, image)
+            if self.frame_pool:
+                self.frame_pool.release(image)
+            image = buffer
+
+        with self._condition:
+            if slot is not None:
+                self._pins[slot] -= 1
+
+            if self._latest is not None and self._latest.index > self._last_consumed_index:
+                # 上一帧还没被任何消费者取走就被新帧取代
+                self._stats['dropped'] += 1
+
+            self._latest = CapturedFrame(image, timestamp, self._next_index, slot)
+            self._next_index += 1
+            self._stats['captured'] += 1
+            self._condition.notify_all()
+
+    def _free_slot(self):
+        """选择一个既不是最新帧、也没有被持有的槽位"""
+        latest_slot = self._latest.slot if self._latest else None
+        for offset in range(1, self.ring_size + 1):
+            slot = ((latest_slot if latest_slot is not None else -1) + offset) % self.ring_size
+            if slot != latest_slot and self._pins[slot] == 0:
+                return slot
+        return None
+
+    def _to_bgr(self, image):
+        """PIL Image转换为BGR数组，其他类型原样返回"""
+        if PIL_AVAILABLE and NUMPY_AVAILABLE and isinstance(image, Image.Image):
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            return np.asarray(image)[:, :, ::-1]
+        return image
+
+    # ---------- 消费者 ----------
+
+    def latest_frame(self, min_timestamp=None):
+        """
+        立即返回最新一帧，不等待截图
+
+        参数:
+            min_timestamp: 只接受在该时刻之后开始截取的帧
+
+        返回:
+            CapturedFrame；还没有满足条件的帧时返回None
+        """
+        with self._condition:
+            frame = self._latest
+            if frame is None or (min_timestamp is not None and frame.timestamp < min_timestamp):
+                return None
+            self._hold(frame)
+            return frame
+
+    def wait_for_new_frame(self, timeout=None, min_timestamp=None, cancel_token=None):
+        """
+        等待一帧当前线程还没取过的新帧
+
+        参数:
+            timeout: 最长等待秒数，None为一直等待（服务停止时返回）
+            min_timestamp: 只接受在该时刻之后开始截取的帧
+            cancel_token: 取消令牌，取消后（配合wake()唤醒）立即返回
+
+        返回:
+            CapturedFrame；超时、已取消或服务已停止时返回None
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            held = self._held.get(threading.get_ident())
+            last_index = held.index if held else 0
+
+            while True:
+                frame = self._latest
+                if (frame is not None and frame.index > last_index
+                        and (min_timestamp is None or frame.timestamp >= min_timestamp)):
+                    self._hold(frame)
+                    return frame
+
+                if self._stop_event.is_set():
+                    return None
+                if cancel_token is not None and cancel_token.is_cancelled:
+                    return None
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def wake(self):
+        """唤醒所有等待新帧的消费者（取消令牌被取消后调用）"""
+        with self._condition:
+            self._condition.notify_all()
+
+    def owns(self, image):
+        """image是否为环形缓冲区的槽位（槽位会被后续截图覆盖，长期使用前需要复制）"""
+        return any(image is slot for slot in self._slots)
+
+    def release(self):
+        """释放当前线程持有的帧"""
+        with self._condition:
+            self._hold(None)
+
+    def _release_all(self):
+        """清除所有线程的持有（已退出的消费线程不会再释放自己的帧）"""
+        with self._condition:
+            self._held.clear()
+            self._pins = [0] * self.ring_size
+
+    def _hold(self, frame):
+        """当前线程改为持有frame，释放之前持有的帧（需在锁内调用）"""
+        thread_id = threading.get_ident()
+        previous = self._held.pop(thread_id, None)
+        if previous is not None and previous.slot is not None:
+            self._pins[previous.slot] -= 1
+
+        if frame is None:
+            return
+        if frame.slot is not None:
+            self._pins[frame.slot] += 1
+        self._held[thread_id] = frame
+
+        if frame.index > self._last_consumed_index:
+            self._last_consumed_index = frame.index
+            self._stats['consumed'] += 1
+
+    def stats(self):
+        """截图统计：已截取、已消费、已丢弃、失败次数和实际帧率"""
+        with self._condition:
+            stats = dict(self._stats)
+        elapsed = time.time() - self._started_at if self._started_at else 0
+        stats['fps'] = stats['captured'] / elapsed if elapsed > 0 else 0.0
+        return stats
@@ -0,0 +1,637 @@
+"""
+流程状态机模块 - 从YAML流程定义（flows/*.yaml）编译状态机并驱动AutomationEngine执行
+（AsyncAutomationEngine使用协程版本AsyncFlowMachine）
+每个状态声明：识别该状态的模板、进入后的点击动作、之后预期出现的状态和等待超时；
+运行时每次匹配只检查当前状态（需要重试时）和预期下一状态的模板，不再检查不可能出现的模板
+"""
+
+import os
+import time
+from kivy.logger import Logger
+
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+from poll_policy import EVERY_FRAME, RELAXED
+
+FLOW_DIR = 'flows'
+
+# 特殊的跳转目标：流程成功结束 / 流程失败
+DONE = 'done'
+FAIL = 'fail'
+
+POLL_POLICIES = {'every_frame': EVERY_FRAME, 'relaxed': RELAXED}
+
+DEFAULT_STATE = {
+    'detect': [],
+    'confidence': {},
+    'settle': None,
+    'settle_roi': None,
+    'click': None,
+    'after': None,
+    'after_roi': None,
+    'next': [],
+    'retry': 0,
+    'timeout': 3.0,
+    'poll': 'every_frame',
+    'on_timeout': FAIL,
+    'priority': 0,
+}
+
+
+class FlowError(Exception):
+    """流程定义格式错误"""
+
+
+class Click:
+    """状态的点击动作"""
+
+    def __init__(self, target=None, times=1, interval=0.0, all=False):
+        # 点击的模板，None为识别到状态的模板；其他模板在同一帧中查找
+        self.target = target
+        self.times = times
+        # 多次点击之间等待画面静止的上限（秒）
+        self.interval = interval
+        # 点击画面中该模板的所有匹配位置
+        self.all = all
+
+    def __repr__(self):
+        return f"Click(target={self.target!r}, times={self.times}, interval={self.interval}, all={self.all})"
+
+
+class FlowState:
+    """流程中的一个画面状态"""
+
+    def __init__(self, name, detect, confidence=None, settle=None, settle_roi=None, click=None,
+                 after=None, after_roi=None, next=None, retry=0, timeout=None, poll=EVERY_FRAME,
+                 on_timeout=FAIL, priority=0):
+        self.name = name
+        # 识别该状态的模板，任一命中即视为到达；为空时是过渡状态，只能通过on_timeout进入
+        self.detect = detect
+        self.confidence = confidence or {}
+        # 动作前等待整屏 / 按钮区域静止的上限（秒）
+        self.settle = settle
+        self.settle_roi = settle_roi
+        self.click = click
+        # 动作后等待整屏 / 按钮区域静止的上限（秒）
+        self.after = after
+        self.after_roi = after_roi
+        # 预期的下一状态，或DONE
+        self.next = next or []
+        # 动作后画面仍停留在本状态时重复动作的次数
+        self.retry = retry
+        # 等待下一状态的超时（秒），None为一直等待
+        self.timeout = timeout
+        self.poll = poll
+        # 超时后进入的状态，或DONE / FAIL
+        self.on_timeout = on_timeout
+        # 同一帧命中多个状态时优先级高的状态优先，优先级相同时比较置信度
+        self.priority = priority
+
+    @property
+    def terminal(self):
+        return self.next == DONE
+
+    def __repr__(self):
+        return f"FlowState({self.name!r}, detect={self.detect}, next={self.next})"
+
+
+class Flow:
+    """编译后的流程：状态表和初始预期状态"""
+
+    def __init__(self, name, states, initial, timeout=None, poll=EVERY_FRAME, recover=None):
+        self.name = name
+        self.states = states
+        self.initial = initial
+        # 等待初始状态的超时（秒）和轮询策略
+        self.timeout = timeout
+        self.poll = poll
+        # {界面: [状态]}：等待失败时由屏幕分类器判断当前界面，从对应的状态继续
+        self.recover = recover or {}
+
+    def templates(self):
+        """流程用到的所有模板"""
+        names = set()
+        for state in self.states.values():
+            names.update(state.detect)
+            if state.click and state.click.target:
+                names.add(state.click.target)
+        return names
+
+
+def _number(flow, name, key, value, allow_none=True):
+    if value is None and allow_none:
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise FlowError(f"{flow}.{name}: {key}必须是数字")
+    if value < 0:
+        raise FlowError(f"{flow}.{name}: {key}不能为负数")
+    return value
+
+
+def _names(flow, name, key, value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(v, (str, int)) for v in value):
+        raise FlowError(f"{flow}.{name}: {key}必须是名称或名称列表")
+    return [str(v) for v in value]
+
+
+def _poll(flow, name, value):
+    if value not in POLL_POLICIES:
+        raise FlowError(f"{flow}.{name}: poll必须是 {tuple(POLL_POLICIES)} 之一")
+    return POLL_POLICIES[value]
+
+
+def _compile_click(flow, name, value):
+    if value is None:
+        return None
+    if value is True:
+        return Click()
+    if isinstance(value, (str, int)):
+        return Click(str(value))
+    if not isinstance(value, dict):
+        raise FlowError(f"{flow}.{name}: click必须是true、模板名或映射")
+
+    unknown = set(value) - {'target', 'times', 'interval', 'all'}
+    if unknown:
+        raise FlowError(f"{flow}.{name}: click未知字段 {sorted(unknown)}")
+    times = value.get('times', 1)
+    if not isinstance(times, int) or times < 1:
+        raise FlowError(f"{flow}.{name}: click.times必须是正整数")
+    target = value.get('target')
+    return Click(str(target) if target is not None else None, times=times,
+                 interval=_number(flow, name, 'click.interval', value.get('interval', 0.0), False),
+                 all=bool(value.get('all', False)))
+
+
+def compile_flow(data, name=None, templates=None):
+    """
+    校验流程数据并编译为Flow
+
+    参数:
+        data: YAML解析后的流程数据
+        name: 流程名，默认使用数据中的name
+        templates: 已注册的模板名集合，提供时检查流程引用的模板都存在
+
+    返回:
+        Flow
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('states'), dict):
+        raise FlowError("流程必须包含states映射")
+    flow = str(data.get('name') or name or 'flow')
+
+    defaults = dict(DEFAULT_STATE)
+    defaults.update(data.get('defaults') or {})
+
+    states = {}
+    for state_name, entry in data['states'].items():
+        state_name = str(state_name)
+        if state_name in (DONE, FAIL):
+            raise FlowError(f"{flow}: 状态名不能是保留字 {state_name}")
+        entry = entry or {}
+        if not isinstance(entry, dict):
+            raise FlowError(f"{flow}.{state_name}: 状态定义必须是映射")
+
+        unknown = set(entry) - set(DEFAULT_STATE)
+        if unknown:
+            raise FlowError(f"{flow}.{state_name}: 未知字段 {sorted(unknown)}")
+
+        spec = dict(defaults)
+        spec.update(entry)
+
+        confidence = spec['confidence'] or {}
+        if not isinstance(confidence, dict):
+            raise FlowError(f"{flow}.{state_name}: confidence必须是 {{模板名: 阈值}}")
+
+        next_states = DONE if spec['next'] == DONE else _names(flow, state_name, 'next', spec['next'])
+        retry = spec['retry']
+        if not isinstance(retry, int) or retry < 0:
+            raise FlowError(f"{flow}.{state_name}: retry必须是非负整数")
+        priority = spec['priority']
+        if not isinstance(priority, int):
+            raise FlowError(f"{flow}.{state_name}: priority必须是整数")
+
+        states[state_name] = FlowState(
+            state_name,
+            detect=_names(flow, state_name, 'detect', spec['detect']),
+            confidence={str(k): _number(flow, state_name, 'confidence', v, False)
+                        for k, v in confidence.items()},
+            settle=_number(flow, state_name, 'settle', spec['settle']),
+            settle_roi=_number(flow, state_name, 'settle_roi', spec['settle_roi']),
+            click=_compile_click(flow, state_name, spec['click']),
+            after=_number(flow, state_name, 'after', spec['after']),
+            after_roi=_number(flow, state_name, 'after_roi', spec['after_roi']),
+            next=next_states,
+            retry=retry,
+            timeout=_number(flow, state_name, 'timeout', spec['timeout']),
+            poll=_poll(flow, state_name, spec['poll']),
+            on_timeout=str(spec['on_timeout']),
+            priority=priority
+        )
+
+    initial = _names(flow, 'initial', 'initial', data.get('initial'))
+    if not initial:
+        raise FlowError(f"{flow}: 缺少initial（初始预期状态）")
+
+    # 检查状态引用
+    for state in states.values():
+        for target in ([] if state.terminal else state.next):
+            if target not in states:
+                raise FlowError(f"{flow}.{state.name}: next引用了不存在的状态 {target}")
+            if not states[target].detect:
+                raise FlowError(f"{flow}.{state.name}: next中的状态 {target} 没有detect模板")
+        if state.on_timeout not in (DONE, FAIL) and state.on_timeout not in states:
+            raise FlowError(f"{flow}.{state.name}: on_timeout引用了不存在的状态 {state.on_timeout}")
+        if not state.detect and state.click and not state.click.target:
+            raise FlowError(f"{flow}.{state.name}: 过渡状态的click必须指定target")
+    for target in initial:
+        if target not in states or not states[target].detect:
+            raise FlowError(f"{flow}: initial引用了不存在或没有detect模板的状态 {target}")
+
+    recover = data.get('recover') or {}
+    if not isinstance(recover, dict):
+        raise FlowError(f"{flow}: recover必须是 {{界面: [状态]}}")
+    recover = {str(screen): _names(flow, 'recover', str(screen), targets)
+               for screen, targets in recover.items()}
+    for screen, targets in recover.items():
+        for target in targets:
+            if target not in states or not states[target].detect:
+                raise FlowError(f"{flow}: recover.{screen}引用了不存在或没有detect模板的状态 {target}")
+
+    compiled = Flow(flow, states, initial,
+                    timeout=_number(flow, 'initial', 'timeout', data.get('timeout')),
+                    poll=_poll(flow, 'initial', data.get('poll', 'every_frame')),
+                    recover=recover)
+
+    if templates is not None:
+        missing = compiled.templates() - set(templates)
+        if missing:
+            raise FlowError(f"{flow}: 引用了未注册的模板 {sorted(missing)}")
+    return compiled
+
+
+def load_flow(path, templates=None):
+    """读取并编译一个YAML流程文件"""
+    if not YAML_AVAILABLE:
+        raise FlowError("PyYAML不可用")
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        raise FlowError(f"读取流程失败: {e}")
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return compile_flow(data, name, templates)
+
+
+def load_flows(flow_dir=FLOW_DIR, templates=None):
+    """读取目录下的所有流程，返回 {流程名: Flow}"""
+    flows = {}
+    if not os.path.isdir(flow_dir):
+        return flows
+    for filename in sorted(os.listdir(flow_dir)):
+        if filename.endswith(('.yaml', '.yml')):
+            flow = load_flow(os.path.join(flow_dir, filename), templates)
+            flows[flow.name] = flow
+    return flows
+
+
+class FlowMachine:
+    """
+    在AutomationEngine上执行一个流程
+
+    每一步调用一次engine.wait_for，只匹配预期状态的模板；同一帧命中多个状态时
+    取priority最高的状态（如派遣中优先于可领取），priority相同时取置信度最高的状态
+    （如beisukai/beisuguan、400/500的比较）。
+    等待失败时用屏幕分类器判断当前界面，按流程的recover从对应的状态继续
+    """
+
+    # 每次执行最多恢复的次数
+    MAX_RECOVERIES = 2
+
+    def __init__(self, engine, flow):
+        self.engine = engine
+        self.flow = flow
+        self.current = None
+        # 每步匹配的模板数，用于统计
+        self._matched = []
+        self._recoveries = 0
+
+    def run(self):
+        """
+        执行流程
+
+        返回:
+            bool: 是否到达终止状态；引擎停止时抛出OperationCancelled
+        """
+        flow = self.flow
+        Logger.info(f"🧭 开始执行流程: {flow.name}")
+        started = time.time()
+
+        expected, poll, on_timeout = flow.initial, flow.poll, FAIL
+        deadline = None if flow.timeout is None else time.time() + flow.timeout
+        retries = 0
+
+        while self.engine.is_running:
+            candidates = self._candidates(expected, retries)
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            hit = self._wait(candidates, timeout, poll)
+            if hit is None:
+                if not self.engine.is_running:
+                    return False
+                Logger.info(f"⏱️ 流程{flow.name}: 等待{candidates}超时 → {on_timeout}")
+                targets = self._recover() if on_timeout == FAIL else None
+                if targets:
+                    expected, retries = targets, 0
+                    deadline = time.time() + self.engine.STEP_TIMEOUT
+                    continue
+                if on_timeout in (DONE, FAIL):
+                    return self._finish(on_timeout == DONE, started)
+                state, hit = flow.states[on_timeout], None
+            else:
+                state, hit = hit
+
+            retries = self._retries(state, expected, retries)
+            entered = self._enter(state, hit)
+            if entered is None:
+                # 动作目标不在画面中，在剩余时间内继续等待同一组状态
+                continue
+            if not entered:
+                return self._finish(False, started)
+
+            self.current = state
+            if state.terminal:
+                return self._finish(True, started)
+            expected, poll, on_timeout, deadline = self._advance(state)
+
+        return False
+
+    def _candidates(self, expected, retries):
+        """本步等待的状态：预期状态，需要重试时加上当前状态"""
+        candidates = list(expected)
+        if self.current is not None and retries > 0 and self.current.name not in candidates:
+            candidates.append(self.current.name)
+        return candidates
+
+    def _retries(self, state, expected, retries):
+        """进入state后剩余的重试次数"""
+        if state is self.current and self.current.name not in expected:
+            retries -= 1
+            Logger.info(f"🔁 仍停留在{state.name}，重复动作（剩余{retries}次）")
+            return retries
+        Logger.info(f"➡️ 流程{self.flow.name}: 进入状态 {state.name}")
+        return state.retry
+
+    def _advance(self, state):
+        """state的动作完成后等待的(预期状态, 轮询策略, 超时去向, 截止时间)"""
+        # 没有预期状态时直接按超时处理
+        timeout = state.timeout if state.next else 0
+        deadline = None if timeout is None else time.time() + timeout
+        return state.next, state.poll, state.on_timeout, deadline
+
+    def _wait(self, candidates, timeout, poll):
+        """等待任一候选状态出现，返回(状态, wait_for结果)，超时返回None"""
+        request = self._request(candidates)
+        if request is None:
+            return None
+        states, names, confidence = request
+        hit = self.engine.wait_for(names, timeout=timeout, poll_policy=poll, confidence=confidence)
+        return self._select(states, hit) if hit is not None else None
+
+    def _request(self, candidates):
+        """候选状态对应的(状态列表, 模板列表, 阈值)；没有候选时返回None"""
+        states = [self.flow.states[name] for name in candidates]
+        if not states:
+            return None
+
+        names, confidence = [], {}
+        for state in states:
+            for name in state.detect:
+                if name not in names:
+                    names.append(name)
+            confidence.update(state.confidence)
+        self._matched.append(len(names))
+        return states, names, confidence or None
+
+    def _select(self, states, hit):
+        """命中的状态中优先级最高、其次置信度最高的一个；都相同时按候选顺序"""
+        best, best_score = None, None
+        for state in states:
+            for name in state.detect:
+                result = hit['results'][name]
+                score = (state.priority, result['confidence']) if result else None
+                if score and (best_score is None or score > best_score):
+                    best, best_score = (state, name), score
+        state, name = best
+        return state, dict(hit, name=name, result=hit['results'][name])
+
+    def _enter(self, state, hit):
+        """
+        执行状态的动作
+
+        返回:
+            True: 完成；False: 点击失败；None: 点击目标不在画面中
+        """
+        engine = self.engine
+        if state.settle:
+            engine.wait_settled(state.settle)
+        if state.settle_roi and hit is not None:
+            engine.wait_settled(state.settle_roi, roi=hit['result'])
+
+        positions = self._click_positions(state, hit)
+        if positions is None:
+            # 超时进入的状态没有可以继续等待的预期状态，视为失败
+            return None if hit is not None else False
+
+        last = hit['result'] if hit is not None else None
+        for index, (target, result) in enumerate(positions):
+            if not engine.click(result['center']):
+                Logger.error(f"❌ {target}按钮点击失败")
+                return False
+            Logger.info(f"✅ 成功点击{target}")
+            last = result
+            if state.click.interval and index < len(positions) - 1:
+                engine.wait_settled(state.click.interval)
+
+        if state.after:
+            engine.wait_settled(state.after)
+        if state.after_roi and last is not None:
+            engine.wait_settled(state.after_roi, roi=last)
+        return True
+
+    def _click_positions(self, state, hit):
+        """[(模板名, 匹配结果)]，依次点击；目标不在画面中时返回None"""
+        click = state.click
+        if click is None:
+            return []
+
+        target = click.target or hit['name']
+        processor = self.engine.image_processor
+        if click.all:
+            results = processor.find_all(hit['frame'], target, state.confidence.get(target)) if hit else None
+        elif hit is not None and target == hit['name']:
+            results = [hit['result']]
+        elif hit is not None:
+            result = processor.find_image(hit['frame'], target, state.confidence.get(target))
+            results = [result] if result else None
+        else:
+            # 超时进入的过渡状态没有现成的画面，等待目标出现
+            found = self.engine.wait_for([target], timeout=self.engine.STEP_TIMEOUT)
+            results = [found['result']] if found else None
+        return self._positions(state, target, results)
+
+    def _positions(self, state, target, results):
+        if not results:
+            Logger.warning(f"⚠️ {state.name}: 画面中未找到{target}")
+            return None
+        return [(target, result) for result in results for _ in range(state.click.times)]
+
+    def _recover(self):
+        """判断当前界面，返回可以从该界面继续的预期状态；无法恢复时返回None"""
+        if not self.flow.recover or self._recoveries >= self.MAX_RECOVERIES:
+            return None
+        frame = self.engine.capture_screen()
+        if frame is None:
+            return None
+        self._recoveries += 1
+        return self._recover_targets(
+            self.engine.screen_classifier.classify(frame, expected=list(self.flow.recover))
+        )
+
+    def _recover_targets(self, result):
+        targets = self.flow.recover.get(result['screen'])
+        Logger.info(f"🧭 当前界面: {result['screen']}（置信度{result['confidence']:.2f}，"
+                    f"{result['elapsed'] * 1000:.0f}ms），"
+                    f"{f'从{targets}继续' if targets else '无法恢复'}")
+        return targets
+
+    def _finish(self, success, started):
+        elapsed = time.time() - started
+        total = len(self.flow.templates())
+        mean = sum(self._matched) / len(self._matched) if self._matched else 0
+        Logger.info(f"🧭 流程{self.flow.name}{'完成' if success else '失败'}，耗时{elapsed:.1f}s，"
+                    f"每步平均匹配{mean:.1f}个模板（流程共{total}个）")
+        return success
+
+
+class AsyncFlowMachine(FlowMachine):
+    """
+    在AsyncAutomationEngine上执行一个流程（协程版本）
+
+    状态选择、重试和恢复的规则与FlowMachine相同，等待、匹配和点击都是awaitable
+    """
+
+    async def run(self):
+        """执行流程，返回是否到达终止状态；引擎停止时抛出CancelledError"""
+        flow = self.flow
+        Logger.info(f"🧭 开始执行流程: {flow.name}")
+        started = time.time()
+
+        expected, poll, on_timeout = flow.initial, flow.poll, FAIL
+        deadline = None if flow.timeout is None else time.time() + flow.timeout
+        retries = 0
+
+        while self.engine.is_running:
+            candidates = self._candidates(expected, retries)
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            hit = await self._wait(candidates, timeout, poll)
+            if hit is None:
+                if not self.engine.is_running:
+                    return False
+                Logger.info(f"⏱️ 流程{flow.name}: 等待{candidates}超时 → {on_timeout}")
+                targets = await self._recover() if on_timeout == FAIL else None
+                if targets:
+                    expected, retries = targets, 0
+                    deadline = time.time() + self.engine.STEP_TIMEOUT
+                    continue
+                if on_timeout in (DONE, FAIL):
+                    return self._finish(on_timeout == DONE, started)
+                state, hit = flow.states[on_timeout], None
+            else:
+                state, hit = hit
+
+            retries = self._retries(state, expected, retries)
+            entered = await self._enter(state, hit)
+            if entered is None:
+                continue
+            if not entered:
+                return self._finish(False, started)
+
+            self.current = state
+            if state.terminal:
+                return self._finish(True, started)
+            expected, poll, on_timeout, deadline = self._advance(state)
+
+        return False
+
+    async def _wait(self, candidates, timeout, poll):
+        request = self._request(candidates)
+        if request is None:
+            return None
+        states, names, confidence = request
+        hit = await self.engine.wait_for(names, timeout=timeout, poll_policy=poll, confidence=confidence)
+        return self._select(states, hit) if hit is not None else None
+
+    async def _enter(self, state, hit):
+        engine = self.engine
+        if state.settle:
+            await engine.wait_settled(state.settle)
+        if state.settle_roi and hit is not None:
+            await engine.wait_settled(state.settle_roi, roi=hit['result'])
+
+        positions = await self._click_positions(state, hit)
+        if positions is None:
+            return None if hit is not None else False
+
+        last = hit['result'] if hit is not None else None
+        for index, (target, result) in enumerate(positions):
+            if not await engine.click(result['center']):
+                Logger.error(f"❌ {target}按钮点击失败")
+                return False
+            Logger.info(f"✅ 成功点击{target}")
+            last = result
+            if state.click.interval and index < len(positions) - 1:
+                await engine.wait_settled(state.click.interval)
+
+        if state.after:
+            await engine.wait_settled(state.after)
+        if state.after_roi and last is not None:
+            await engine.wait_settled(state.after_roi, roi=last)
+        return True
+
+    async def _click_positions(self, state, hit):
+        click = state.click
+        if click is None:
+            return []
+
+        target = click.target or hit['name']
+        engine = self.engine
+        if click.all:
+            results = await engine.find_all(hit['frame'], target, state.confidence.get(target)) if hit else None
+        elif hit is not None and target == hit['name']:
+            results = [hit['result']]
+        elif hit is not None:
+            result = await engine.find_image(hit['frame'], target, state.confidence.get(target))
+            results = [result] if result else None
+        else:
+            found = await engine.wait_for([target], timeout=engine.STEP_TIMEOUT)
+            results = [found['result']] if found else None
+        return self._positions(state, target, results)
+
+    async def _recover(self):
+        if not self.flow.recover or self._recoveries >= self.MAX_RECOVERIES:
+            return None
+        frame = await self.engine.capture()
+        if frame is None:
+            return None
+        self._recoveries += 1
+        return self._recover_targets(await self.engine.classify_screen(frame, list(self.flow.recover)))
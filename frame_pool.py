@@ -0,0 +1,103 @@
+"""
+帧缓冲池模块 - 复用整屏大小的图像数组
+截图解码/颜色转换直接写入池中取出的数组，用完后归还，
+避免长时间循环中每帧分配、丢弃约10MB的数组造成的内存抖动和GC停顿
+"""
+
+import threading
+import weakref
+from kivy.logger import Logger
+
+import numpy as np
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存（MB），无法获取时返回None"""
+    if not RESOURCE_AVAILABLE:
+        return None
+    # Linux/Android上ru_maxrss单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class FramePool:
+    """
+    按形状分组的数组池
+
+    acquire()取出一个数组（没有空闲数组时新分配），release()归还；
+    只接受本池分配的数组，未归还的数组照常由GC回收，不会泄漏
+    """
+
+    def __init__(self, max_free=4):
+        """
+        参数:
+            max_free: 每种形状最多保留的空闲数组数
+        """
+        self.max_free = max_free
+        # {(形状, dtype): [空闲数组]}
+        self._free = {}
+        # 已借出的数组，按id索引（弱引用，未归还的数组可被回收）
+        self._outstanding = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._stats = {'allocated': 0, 'reused': 0, 'released': 0, 'discarded': 0}
+
+    def acquire(self, shape, dtype=np.uint8):
+        """取出一个指定形状的数组（内容未初始化）"""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                array = free.pop()
+                self._stats['reused'] += 1
+            else:
+                array = None
+                self._stats['allocated'] += 1
+
+        if array is None:
+            array = np.empty(shape, dtype=dtype)
+        with self._lock:
+            self._outstanding[id(array)] = array
+        return array
+
+    def release(self, array):
+        """归还数组；不是本池借出的数组直接忽略"""
+        if not isinstance(array, np.ndarray):
+            return False
+        with self._lock:
+            if self._outstanding.get(id(array)) is not array:
+                return False
+            del self._outstanding[id(array)]
+
+            key = (array.shape, array.dtype.str)
+            free = self._free.setdefault(key, [])
+            if len(free) >= self.max_free:
+                self._stats['discarded'] += 1
+            else:
+                free.append(array)
+                self._stats['released'] += 1
+        return True
+
+    def clear(self):
+        """丢弃所有空闲数组"""
+        with self._lock:
+            self._free.clear()
+
+    def stats(self):
+        """分配/复用/归还次数、空闲数组数和峰值内存"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['free'] = sum(len(free) for free in self._free.values())
+            stats['outstanding'] = len(self._outstanding)
+        stats['peak_rss_mb'] = peak_rss_mb()
+        return stats
+
+    def log_stats(self, label=''):
+        stats = self.stats()
+        rss = f"{stats['peak_rss_mb']:.1f}MB" if stats['peak_rss_mb'] is not None else "未知"
+        Logger.info(f"帧缓冲池{label}: 新分配{stats['allocated']} 复用{stats['reused']} "
+                    f"空闲{stats['free']} 峰值内存{rss}")
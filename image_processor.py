@@ -4,9 +4,15 @@
 """
 
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from kivy.logger import Logger
 from kivy.utils import platform
 
+from search_region_index import SearchRegionIndex
+from template_manifest import TemplateSpec, ManifestError, load_manifest, default_registry, DEFAULT_SPEC
+from cancellation import OperationCancelled
+
 # 尝试导入numpy，如果失败则使用替代方案
 try:
     import numpy as np
@@ -32,13 +38,232 @@ except ImportError:
     PIL_AVAILABLE = False
     Logger.warning("PIL不可用")
 
+if NUMPY_AVAILABLE:
+    import numpy_matcher
+    import template_pack
+    from match_cache import MatchCache, frame_fingerprint
+
+if CV2_AVAILABLE:
+    CV2_METHODS = {
+        'ccoeff_normed': cv2.TM_CCOEFF_NORMED,
+        'ccorr_normed': cv2.TM_CCORR_NORMED,
+        'sqdiff_normed': cv2.TM_SQDIFF_NORMED,
+    }
+
+
+def downscale_image(image, factor):
+    """按整数倍缩小图像（区域平均），用于构建金字塔"""
+    if factor == 1:
+        return image
+    
+    if CV2_AVAILABLE:
+        h, w = image.shape[:2]
+        new_w, new_h = max(1, w // factor), max(1, h // factor)
+        # 先裁到factor的整数倍，使INTER_AREA等价于分块均值，坐标可按factor精确换算
+        cropped = image[:new_h * factor, :new_w * factor]
+        return cv2.resize(cropped, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    
+    return numpy_matcher.block_downscale(image, factor)
+
+
+def scale_image(image, scale, nearest=False):
+    """
+    按比例缩放图像（缩小使用区域平均，nearest为True时使用最近邻，用于掩码）
+    
+    无OpenCV时：缩小倍数为整数则分块均值，否则按最近邻采样
+    """
+    if scale == 1:
+        return image
+    
+    h, w = image.shape[:2]
+    new_w, new_h = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+    
+    if CV2_AVAILABLE:
+        interpolation = cv2.INTER_NEAREST if nearest else cv2.INTER_AREA
+        return cv2.resize(image, (new_w, new_h), interpolation=interpolation)
+    
+    factor = 1.0 / scale
+    if not nearest and factor == int(factor):
+        return numpy_matcher.block_downscale(image, int(factor))
+    
+    rows = np.minimum((np.arange(new_h) / scale).astype(np.intp), h - 1)
+    cols = np.minimum((np.arange(new_w) / scale).astype(np.intp), w - 1)
+    return np.ascontiguousarray(image[rows][:, cols])
+
+
+def to_grayscale(image):
+    """BGR图像转灰度"""
+    if image.ndim == 2:
+        return image
+    
+    if CV2_AVAILABLE:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    
+    return numpy_matcher.bgr_to_gray(image)
+
+
+def top_candidates(result, k, suppress_w, suppress_h, min_score):
+    """
+    从相关系数图中取出得分最高的k个候选位置
+    
+    每取出一个峰值就把其邻域（±suppress_w, ±suppress_h）置为无效，避免同一峰值被重复选中
+    
+    返回:
+        [(x, y, score), ...] 按得分降序
+    """
+    result = np.array(result, dtype=np.float32, copy=True)
+    candidates = []
+    
+    for _ in range(k):
+        index = int(np.argmax(result))
+        y, x = divmod(index, result.shape[1])
+        score = float(result[y, x])
+        if score < min_score:
+            break
+        
+        candidates.append((x, y, score))
+        result[max(0, y - suppress_h):y + suppress_h + 1,
+               max(0, x - suppress_w):x + suppress_w + 1] = -np.inf
+    
+    return candidates
+
+
+class PreparedFrame:
+    """
+    单帧截图的预处理结果
+    
+    同一张截图在多个模板间共享：BGR数组只转换一次，
+    灰度图、金字塔层级和NumPy引擎的积分图/频谱都在首次使用时生成并缓存。
+    并行匹配时多个线程共享同一帧，派生形式的生成由锁保护，保证只计算一次
+    
+    scale为分析分辨率相对设备分辨率的比例，匹配坐标除以scale即为设备坐标
+    """
+    
+    def __init__(self, bgr, scale=1.0):
+        self.bgr = bgr
+        self.shape = bgr.shape
+        self.scale = scale
+        # {(缩小倍数, 是否灰度): 图像}
+        self._levels = {(1, False): bgr}
+        self._numpy_images = {}
+        self._fingerprint = None
+        self._lock = threading.RLock()
+    
+    def fingerprint(self):
+        """帧指纹，用于识别与之前完全相同的画面"""
+        if self._fingerprint is None:
+            with self._lock:
+                if self._fingerprint is None:
+                    self._fingerprint = frame_fingerprint(self.bgr)
+        return self._fingerprint
+    
+    def image(self, factor=1, gray=False):
+        """缩小factor倍的BGR图像或灰度图"""
+        key = (factor, gray)
+        level = self._levels.get(key)
+        if level is None:
+            with self._lock:
+                level = self._levels.get(key)
+                if level is None:
+                    if factor == 1:
+                        level = to_grayscale(self.bgr)
+                    else:
+                        level = downscale_image(self.image(1, gray), factor)
+                    self._levels[key] = level
+        return level
+    
+    def gray(self):
+        """灰度图"""
+        return self.image(1, gray=True)
+    
+    def pyramid_level(self, factor):
+        """缩小factor倍的BGR图像"""
+        return self.image(factor)
+    
+    def numpy_image(self, factor=1, gray=False):
+        """NumPy匹配引擎使用的预处理截图（积分图和频谱跨模板复用）"""
+        key = (factor, gray)
+        image = self._numpy_images.get(key)
+        if image is None:
+            with self._lock:
+                image = self._numpy_images.get(key)
+                if image is None:
+                    image = numpy_matcher.PreparedImage(self.image(factor, gray))
+                    self._numpy_images[key] = image
+        return image
+
+
 class ImageProcessor:
     """图像处理器"""
     
-    def __init__(self):
+    # 金字塔模式下缩小后模板的最短边下限，过小的模板直接使用全分辨率匹配
+    MIN_PYRAMID_TEMPLATE_SIDE = 10
+    # 粗匹配候选得分可低于最终阈值的幅度（缩小会降低相关系数）
+    PYRAMID_COARSE_MARGIN = 0.25
+    # coarse_score只判断模板是否出现，不需要精修位置，缩小后的模板可以更小
+    COARSE_MIN_TEMPLATE_SIDE = 6
+    
+    # 每个线程最多保留的相似度图缓冲区个数（不同搜索区域尺寸各占一个）
+    MAX_SCRATCH_BUFFERS = 16
+    # 单模板分带搜索：默认带数，以及每条带至少包含的匹配位置行数
+    DEFAULT_TILE_BANDS = 4
+    TILE_MIN_BAND_ROWS = 64
+    # 设置了取消令牌时，调用线程等待匹配结果期间检查取消的间隔（秒）
+    CANCEL_POLL_INTERVAL = 0.02
+    
+    def __init__(self, use_search_index=True, matching_mode='full', pyramid_factors=(8, 4), pyramid_top_k=5,
+                 match_cache_size=256, max_workers=None, tile_bands=None, analysis_scale=1.0):
         self.templates = {}
         self.platform = platform
         
+        # 分析分辨率比例：截图和模板都缩小到该比例后再匹配，结果坐标映射回设备坐标
+        # 内存和匹配开销约按比例的平方下降
+        self.analysis_scale = analysis_scale
+        
+        # 匹配模式：'full' 全分辨率匹配；'pyramid' 先在缩小的画面上粗匹配，再在全分辨率下精修候选位置
+        self.matching_mode = matching_mode
+        self.pyramid_factors = sorted(pyramid_factors, reverse=True)
+        self.pyramid_top_k = pyramid_top_k
+        # {模板名: (缩小倍数, 缩小后的模板)}，在load_templates中预先计算
+        self.pyramid_templates = {}
+        # {(模板名, 最大缩小倍数): (缩小倍数, 缩小后的灰度模板)}，coarse_score使用
+        self._coarse_templates = {}
+        
+        # 模板注册表（由templates/manifest.yaml编译）和掩码
+        self.template_specs = {}
+        self.template_masks = {}
+        
+        # 模板包提供的派生形式：灰度图、金字塔层级
+        self.template_gray = {}
+        self.packed_levels = {}
+        
+        # NumPy匹配引擎的模板预处理缓存（零均值数据和范数），按模板名缓存
+        self._prepared_templates = {}
+        self._prepared_lock = threading.Lock()
+        
+        # 并行匹配：find_images把各模板的搜索分发到线程池（matchTemplate执行时释放GIL）
+        # max_workers为None时按CPU核数决定，为1时串行匹配
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # 每个工作线程独立的相似度图缓冲区，避免每次匹配重新分配
+        self._scratch = threading.local()
+        
+        # 单模板分带搜索：把一次大范围搜索按行切成相互重叠（模板高度）的横带，各带并行匹配后合并
+        # tile_bands为None时使用固定的DEFAULT_TILE_BANDS（与线程数无关，各设备结果一致）；为1时禁用
+        if tile_bands is None:
+            tile_bands = self.DEFAULT_TILE_BANDS
+        self.tile_bands = max(1, int(tile_bands))
+        
+        # 模板历史位置索引：先在上次匹配位置附近搜索，未命中再全屏搜索
+        self.search_index = SearchRegionIndex() if use_search_index else None
+        
+        # 同一画面重复匹配时直接返回缓存结果（match_cache_size为0时禁用）
+        self.match_cache = MatchCache(match_cache_size) if NUMPY_AVAILABLE and match_cache_size else None
+        
+        # 取消令牌（由AutomationEngine设置）：每次计算相似度图前检查，已取消时抛出OperationCancelled
+        self.cancel_token = None
+        
         # 加载模板图像
         self.load_templates()
         
@@ -51,57 +276,241 @@ class ImageProcessor:
         if not os.path.exists(template_dir):
             Logger.warning(f"模板目录不存在: {template_dir}")
             self.create_default_templates()
+            self.scale_templates()
+            self.build_template_pyramids()
             return
         
-        # 加载所有模板图像
-        template_files = [
-            'login_button_first.png',
-            'game_start_screen.png', 
-            'login_button.png',
-            'main_menu.png',
-            'task.png',
-            'weituo.png',
-            'qianwang.png',
-            'yijianlingqu.png',
-            'paiqianzhong.png',
-            'close.png',
-            'zaicipaiqian.png',
-            '120kaituoli.png',
-            'jinru.png',
-            'jiahao.png',
-            'tiaozhan.png',
-            'kaishitiaozhan.png',
-            'beisukai.png',
-            'beisuguan.png',
-            'zidongkai.png',
-            'zidongguan.png',
-            'zailaiyici.png',
-            'tuichuguanqia.png',
-            'lingqu.png',
-            '400.png',
-            '500.png',
-            'gift.png'
-        ]
-        
-        for filename in template_files:
-            filepath = os.path.join(template_dir, filename)
+        # 从模板清单编译注册表，清单缺失或无效时为目录中的每个PNG使用默认配置
+        self.template_specs = self.load_template_registry(template_dir)
+        
+        # 优先从预编译的模板包内存映射加载，包中缺失或已过期的模板再解码PNG
+        self.load_template_pack(template_dir)
+        
+        for name, spec in self.template_specs.items():
+            if name in self.templates:
+                continue
+            
+            filepath = os.path.join(template_dir, spec.file)
             if os.path.exists(filepath):
                 try:
                     if CV2_AVAILABLE:
                         template = cv2.imread(filepath, cv2.IMREAD_COLOR)
                         if template is not None:
-                            name = filename.replace('.png', '')
                             self.templates[name] = template
                             Logger.info(f"加载模板: {name}")
                     elif PIL_AVAILABLE:
                         template = Image.open(filepath)
-                        name = filename.replace('.png', '')
+                        if NUMPY_AVAILABLE:
+                            # 转为BGR数组，与OpenCV加载结果一致，供NumPy匹配引擎使用
+                            template = self._to_bgr_array(template)
                         self.templates[name] = template
                         Logger.info(f"加载模板: {name}")
                 except Exception as e:
-                    Logger.error(f"加载模板失败 {filename}: {e}")
+                    Logger.error(f"加载模板失败 {spec.file}: {e}")
+        
+        self.load_template_masks(template_dir)
         
         Logger.info(f"共加载 {len(self.templates)} 个模板")
+        
+        self.scale_templates()
+        self.build_template_pyramids()
+    
+    def load_template_registry(self, template_dir):
+        """读取templates/manifest.yaml并编译为 {模板名: TemplateSpec}"""
+        try:
+            registry = load_manifest(template_dir)
+            Logger.info(f"模板清单加载成功: {len(registry)} 个模板")
+        except ManifestError as e:
+            Logger.warning(f"模板清单不可用，使用默认配置: {e}")
+            registry = default_registry(template_dir)
+        
+        if not CV2_AVAILABLE:
+            for name, spec in registry.items():
+                if spec.method != 'ccoeff_normed' or spec.mask:
+                    Logger.warning(f"{name}: NumPy引擎仅支持ccoeff_normed且不支持掩码，将忽略这两项配置")
+        
+        return registry
+    
+    def load_template_masks(self, template_dir):
+        """加载清单中声明的掩码（单通道，与模板同尺寸）"""
+        self.template_masks = {}
+        
+        for name, spec in self.template_specs.items():
+            if not spec.mask or name not in self.templates or not CV2_AVAILABLE:
+                continue
+            
+            mask = cv2.imread(os.path.join(template_dir, spec.mask), cv2.IMREAD_GRAYSCALE)
+            if mask is None or mask.shape[:2] != self.templates[name].shape[:2]:
+                Logger.warning(f"{name}: 掩码无法读取或与模板尺寸不一致，忽略掩码")
+                continue
+            
+            self.template_masks[name] = mask
+    
+    def get_template_spec(self, template_name):
+        """获取模板的匹配配置，未在清单中声明的模板使用默认配置"""
+        spec = self.template_specs.get(template_name)
+        if spec is None:
+            spec = TemplateSpec(template_name, f"{template_name}.png", **DEFAULT_SPEC)
+            self.template_specs[template_name] = spec
+        return spec
+    
+    def _template_image(self, template_name, spec):
+        """按模板颜色模式返回BGR模板或灰度模板"""
+        if spec.gray:
+            return self.get_template_gray(template_name)
+        return self.templates[template_name]
+    
+    def load_template_pack(self, template_dir):
+        """
+        从模板包加载模板（由build_template_pack.py生成）
+        
+        模板包以内存映射方式打开，模板数组是文件的只读视图；
+        源PNG仍存在且内容与打包时不同（大小或SHA-1不一致）的条目视为过期，改为解码PNG
+        """
+        if not NUMPY_AVAILABLE:
+            return 0
+        
+        pack_path = os.path.join(template_dir, template_pack.TEMPLATE_PACK_NAME)
+        if not os.path.exists(pack_path):
+            return 0
+        
+        try:
+            entries = template_pack.load_pack(pack_path)
+        except Exception as e:
+            Logger.warning(f"模板包加载失败，改为解码PNG: {e}")
+            return 0
+        
+        loaded = 0
+        for name, spec in self.template_specs.items():
+            # 模板包按源文件名（不含扩展名）索引
+            entry = entries.get(os.path.splitext(spec.file)[0])
+            if entry is None:
+                continue
+            
+            filepath = os.path.join(template_dir, spec.file)
+            if os.path.exists(filepath) and self._pack_entry_stale(entry, filepath):
+                Logger.warning(f"模板包中的{name}已过期，重新解码PNG")
+                continue
+            
+            arrays = entry['arrays']
+            self.templates[name] = arrays['bgr']
+            self.template_gray[name] = arrays['gray']
+            self.packed_levels[name] = {
+                int(key.split('@')[1]): array for key, array in arrays.items() if key.startswith('bgr@')
+            }
+            loaded += 1
+        
+        Logger.info(f"从模板包加载 {loaded} 个模板: {pack_path}")
+        return loaded
+    
+    @staticmethod
+    def _pack_entry_stale(entry, filepath):
+        """源PNG是否在打包后被修改：先比较大小，大小相同时比较内容哈希（旧模板包没有哈希，只比较大小）"""
+        if os.path.getsize(filepath) != entry.get('source_size'):
+            return True
+        digest = entry.get('source_sha1')
+        return digest is not None and template_pack.source_digest(filepath) != digest
+    
+    def get_template_gray(self, template_name):
+        """获取模板灰度图（模板包中已预先计算，否则首次使用时转换并缓存）"""
+        gray = self.template_gray.get(template_name)
+        if gray is None:
+            gray = to_grayscale(self.templates[template_name])
+            self.template_gray[template_name] = gray
+        return gray
+    
+    def scale_templates(self):
+        """按分析分辨率比例缩放所有模板和掩码（加载时执行一次）"""
+        if self.analysis_scale == 1 or not NUMPY_AVAILABLE:
+            return
+        
+        for name, template in list(self.templates.items()):
+            if hasattr(template, 'shape'):
+                self.templates[name] = scale_image(template, self.analysis_scale)
+        for name, mask in list(self.template_masks.items()):
+            self.template_masks[name] = scale_image(mask, self.analysis_scale, nearest=True)
+        
+        # 模板包中的灰度图和金字塔层级是原始分辨率的，缩放后重新计算
+        self.template_gray = {}
+        self.packed_levels = {}
+        self._prepared_templates = {}
+        
+        Logger.info(f"模板已按分析比例 {self.analysis_scale} 缩放")
+    
+    def build_template_pyramids(self):
+        """为每个模板预先计算金字塔粗匹配使用的缩小版本"""
+        self.pyramid_templates = {}
+        
+        if not NUMPY_AVAILABLE:
+            return
+        
+        for name, template in self.templates.items():
+            if not hasattr(template, 'shape'):
+                continue
+            
+            # 掩码模板缩小后掩码失真，保持全分辨率匹配
+            spec = self.get_template_spec(name)
+            if name in self.template_masks:
+                continue
+            
+            h, w = template.shape[:2]
+            for factor in self.pyramid_factors:
+                if min(h, w) // factor >= self.MIN_PYRAMID_TEMPLATE_SIDE:
+                    level = None if spec.gray else self.packed_levels.get(name, {}).get(factor)
+                    if level is None:
+                        level = downscale_image(self._template_image(name, spec), factor)
+                    self.pyramid_templates[name] = (factor, level)
+                    break
+        
+        Logger.info(f"金字塔模板: {len(self.pyramid_templates)}/{len(self.templates)} 个模板可粗匹配")
+    
+    def coarse_template(self, template_name, max_factor=8):
+        """
+        coarse_score使用的缩小灰度模板：不超过max_factor、缩小后最短边不小于
+        COARSE_MIN_TEMPLATE_SIDE的最大倍数，模板太小时使用全分辨率
+        
+        返回:
+            (缩小倍数, 灰度模板)；模板不存在时返回None
+        """
+        key = (template_name, max_factor)
+        if key in self._coarse_templates:
+            return self._coarse_templates[key]
+        
+        coarse = None
+        template = self.templates.get(template_name)
+        if NUMPY_AVAILABLE and hasattr(template, 'shape'):
+            gray = self.get_template_gray(template_name)
+            factor = max_factor
+            while factor > 1 and min(gray.shape[:2]) // factor < self.COARSE_MIN_TEMPLATE_SIDE:
+                factor //= 2
+            coarse = (max(1, factor), downscale_image(gray, max(1, factor)))
+        self._coarse_templates[key] = coarse
+        return coarse
+    
+    def coarse_score(self, frame, template_name, max_factor=8):
+        """
+        在缩小的灰度画面上匹配模板，返回清单搜索区域内的最高相似度（0~1）
+        
+        只判断模板是否出现、不需要精确位置时使用（屏幕分类），开销约为全分辨率匹配的1/factor²；
+        缩小会降低相似度，阈值应比模板阈值低约PYRAMID_COARSE_MARGIN
+        """
+        coarse = self.coarse_template(template_name, max_factor)
+        if coarse is None:
+            return 0.0
+        factor, template = coarse
+        
+        frame = self.prepare_frame(frame)
+        spec = self.get_template_spec(template_name)
+        region = spec.pixel_region(frame.shape)
+        if region:
+            region = tuple(value // factor for value in region)
+        
+        scores, _ = self._score_map(frame, template, cache_key=f"{template_name}@{factor}g",
+                                    factor=factor, gray=True, region=region, method=spec.method,
+                                    scratch=True)
+        if scores is None:
+            return 0.0
+        return float(scores.max())
     
     def create_default_templates(self):
         """创建默认模板图像"""
@@ -203,8 +612,27 @@ class ImageProcessor:
             Logger.error(f"桌面屏幕截图失败: {e}")
             return None
     
-    def find_image(self, screenshot, template_name, confidence=0.7):
-        """在截图中查找模板图像"""
+    def prepare_frame(self, screenshot, source_scale=1.0):
+        """
+        预处理截图，返回可在多个模板间共享的PreparedFrame（文件路径原样返回）
+        
+        source_scale为截图相对设备分辨率的比例（截图源已缩小时传入），
+        与分析比例不同时在这里缩放到分析分辨率
+        """
+        if screenshot is None or isinstance(screenshot, (PreparedFrame, str)):
+            return screenshot
+        
+        bgr = self._to_bgr_array(screenshot)
+        if source_scale != self.analysis_scale:
+            bgr = scale_image(bgr, self.analysis_scale / source_scale)
+        return PreparedFrame(bgr, scale=self.analysis_scale)
+    
+    def find_image(self, screenshot, template_name, confidence=None):
+        """
+        在截图中查找模板图像（screenshot可以是已预处理的PreparedFrame）
+        
+        confidence为None时使用模板清单中声明的阈值
+        """
         if screenshot is None:
             Logger.error("截图为空")
             return None
@@ -214,47 +642,519 @@ class ImageProcessor:
             return None
         
         template = self.templates[template_name]
+        if confidence is None:
+            confidence = self.get_template_spec(template_name).threshold
         
         try:
             # 如果screenshot是字符串（文件路径），使用Kivy加载
             if isinstance(screenshot, str):
                 return self.find_image_kivy(screenshot, template, template_name, confidence)
-            elif CV2_AVAILABLE:
-                return self.find_image_cv2(screenshot, template, confidence)
-            elif PIL_AVAILABLE:
-                return self.find_image_pil(screenshot, template, confidence)
+            elif CV2_AVAILABLE or NUMPY_AVAILABLE:
+                frame = self.prepare_frame(screenshot)
+                return self.to_device_coordinates(self._locate(frame, template_name, confidence), frame.scale)
             else:
                 Logger.error("无可用的图像匹配方法")
                 return None
-                
+        
+        except OperationCancelled:
+            raise
         except Exception as e:
             Logger.error(f"图像匹配失败: {e}")
             import traceback
             Logger.error(f"详细错误: {traceback.format_exc()}")
             return None
     
-    def find_image_cv2(self, screenshot, template, confidence):
-        """使用OpenCV进行模板匹配"""
-        # 模板匹配
-        result = cv2.matchTemplate(screenshot, template, cv2.TM_CCOEFF_NORMED)
-        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+    def find_all(self, screenshot, template_name, threshold=None, max_results=20):
+        """
+        一次匹配找出截图中模板的所有实例（重复按钮、列表行等）
         
-        if max_val >= confidence:
-            # 计算中心点
-            h, w = template.shape[:2]
-            center_x = max_loc[0] + w // 2
-            center_y = max_loc[1] + h // 2
+        只计算一张相似度图，依次取峰值并对其邻域（模板宽高的一半）做非极大值抑制，
+        因此相互重叠的位置只保留得分最高的一个
+        
+        参数:
+            threshold: 最低置信度，None时使用模板清单中声明的阈值
+            max_results: 最多返回的实例数
+        
+        返回:
+            list: 匹配结果列表（格式同find_image），按置信度降序；未找到时为空列表
+        """
+        if screenshot is None:
+            Logger.error("截图为空")
+            return []
+        
+        if template_name not in self.templates:
+            Logger.error(f"模板不存在: {template_name}")
+            return []
+        
+        spec = self.get_template_spec(template_name)
+        if threshold is None:
+            threshold = spec.threshold
+        
+        try:
+            if isinstance(screenshot, str) or not (CV2_AVAILABLE or NUMPY_AVAILABLE):
+                # 文件路径/无匹配引擎时只能给出单个结果
+                result = self.find_image(screenshot, template_name, threshold)
+                return [result] if result else []
             
-            return {
-                'found': True,
-                'confidence': max_val,
-                'center': (center_x, center_y),
-                'top_left': max_loc,
-                'bottom_right': (max_loc[0] + w, max_loc[1] + h)
+            frame = self.prepare_frame(screenshot)
+            template = self._template_image(template_name, spec)
+            result, (offset_x, offset_y) = self._score_map(
+                frame, template, cache_key=template_name, gray=spec.gray,
+                region=spec.pixel_region(frame.shape), method=spec.method,
+                mask=self.template_masks.get(template_name)
+            )
+            if result is None:
+                return []
+            
+            h, w = template.shape[:2]
+            candidates = top_candidates(result, max_results, max(1, w // 2), max(1, h // 2), threshold)
+            return [
+                self.to_device_coordinates(
+                    self._build_match_result(score, (x + offset_x, y + offset_y), template), frame.scale
+                )
+                for x, y, score in candidates
+            ]
+        
+        except OperationCancelled:
+            raise
+        except Exception as e:
+            Logger.error(f"多实例匹配失败: {e}")
+            import traceback
+            Logger.error(f"详细错误: {traceback.format_exc()}")
+            return []
+    
+    def _locate(self, screenshot, template_name, confidence):
+        """先在索引记录的位置附近局部搜索，未命中时回退到清单声明的搜索区域（默认全屏）并更新索引"""
+        frame = self.prepare_frame(screenshot)
+        
+        # 画面未变化时直接返回上次的结果，不做任何匹配
+        cache_key = None
+        if self.match_cache:
+            cache_key = (frame.fingerprint(), template_name, confidence)
+            hit, cached = self.match_cache.get(cache_key)
+            if hit:
+                return cached
+        
+        result = None
+        region = None
+        if self.search_index:
+            region = self.search_index.get_region(template_name, frame.shape)
+        
+        if region:
+            result = self._find_in_region(frame, template_name, confidence, region)
+            if result:
+                self.search_index.count_local_hit()
+            else:
+                self.search_index.count_fallback()
+        
+        if not result:
+            result = self._find_full_frame(frame, template_name, confidence)
+        
+        if result and self.search_index:
+            h, w = self.templates[template_name].shape[:2]
+            self.search_index.record(template_name, frame.shape, result['top_left'], (w, h))
+        
+        # 匹配期间被取消时结果不完整，不能作为“未找到”缓存
+        if cache_key and not (self.cancel_token is not None and self.cancel_token.is_cancelled):
+            self.match_cache.put(cache_key, result)
+        
+        return result
+    
+    def _find_full_frame(self, frame, template_name, confidence):
+        """在清单声明的搜索区域（默认全屏）内搜索：金字塔模式下先粗后精，否则直接全分辨率匹配"""
+        region = self.get_template_spec(template_name).pixel_region(frame.shape)
+        
+        if self.matching_mode == 'pyramid' and template_name in self.pyramid_templates:
+            result = self._find_pyramid(frame, template_name, confidence, region)
+            if result is not False:
+                return result
+        return self._find_in_region(frame, template_name, confidence, region)
+    
+    def _find_pyramid(self, frame, template_name, confidence, region=None):
+        """
+        金字塔匹配：在缩小factor倍的画面上取top-k候选，再在全分辨率下对每个候选的邻域精确匹配
+        
+        精修窗口覆盖粗匹配位置±2*factor像素，因此结果与全分辨率搜索一致
+        
+        返回:
+            匹配结果或None；画面小于缩小后的模板时返回False，由调用方回退到全分辨率
+        """
+        spec = self.get_template_spec(template_name)
+        factor, small_template = self.pyramid_templates[template_name]
+        frame_h, frame_w = frame.shape[:2]
+        x0, y0, x1, y1 = region or (0, 0, frame_w, frame_h)
+        
+        coarse, (offset_x, offset_y) = self._score_map(
+            frame, small_template, cache_key=f"{template_name}@{factor}",
+            factor=factor, gray=spec.gray, method=spec.method,
+            region=(x0 // factor, y0 // factor, x1 // factor, y1 // factor)
+        )
+        if coarse is None:
+            return False
+        
+        small_h, small_w = small_template.shape[:2]
+        candidates = top_candidates(
+            coarse, self.pyramid_top_k,
+            max(1, small_w // 2), max(1, small_h // 2),
+            confidence - self.PYRAMID_COARSE_MARGIN
+        )
+        
+        h, w = self.templates[template_name].shape[:2]
+        pad = 2 * factor
+        best = None
+        
+        for x, y, score in candidates:
+            x = (x + offset_x) * factor
+            y = (y + offset_y) * factor
+            window = (
+                max(x0, x - pad),
+                max(y0, y - pad),
+                min(x1, x + w + pad),
+                min(y1, y + h + pad)
+            )
+            result = self._find_in_region(frame, template_name, confidence, window)
+            if result and (best is None or result['confidence'] > best['confidence']):
+                best = result
+        
+        return best
+    
+    def _find_in_region(self, frame, template_name, confidence, region=None):
+        """按可用引擎和模板配置在指定区域（None为全屏）内匹配"""
+        spec = self.get_template_spec(template_name)
+        template = self._template_image(template_name, spec)
+        
+        if CV2_AVAILABLE:
+            return self.find_image_cv2(
+                frame, template, confidence, region,
+                method=spec.method, mask=self.template_masks.get(template_name), gray=spec.gray
+            )
+        return self.find_image_pil(frame, template, confidence, template_name, region, gray=spec.gray)
+    
+    def _score_map(self, frame, template, cache_key=None, factor=1, gray=False, region=None,
+                   method='ccoeff_normed', mask=None, scratch=False):
+        """
+        计算相似度图（数值越大越相似，sqdiff_normed已换算为1-差异）
+        
+        参数:
+            frame: PreparedFrame
+            template: 与factor/gray对应的模板数组
+            cache_key: NumPy引擎缓存模板频谱使用的键
+            region: (x0, y0, x1, y1)，坐标为factor缩小后的画面坐标
+            scratch: 为True时结果写入当前线程的复用缓冲区（调用方须在下次匹配前用完结果）
+        
+        返回:
+            (相似度图, (offset_x, offset_y))；区域小于模板时相似度图为None
+        """
+        self._check_cancelled()
+        
+        offset_x, offset_y = 0, 0
+        image = frame.image(factor, gray)
+        if region:
+            offset_x, offset_y, x1, y1 = region
+            image = image[offset_y:y1, offset_x:x1]
+        
+        if image.shape[0] < template.shape[0] or image.shape[1] < template.shape[1]:
+            return None, (offset_x, offset_y)
+        
+        if CV2_AVAILABLE:
+            out = None
+            if scratch:
+                out = self._scratch_buffer((image.shape[0] - template.shape[0] + 1,
+                                            image.shape[1] - template.shape[1] + 1))
+            if mask is not None:
+                result = cv2.matchTemplate(image, template, CV2_METHODS[method], result=out, mask=mask)
+            else:
+                result = cv2.matchTemplate(image, template, CV2_METHODS[method], result=out)
+            if method == 'sqdiff_normed':
+                result = np.subtract(1.0, result, out=result)
+            if mask is not None:
+                # 掩码下全黑窗口会产生NaN/Inf
+                result = np.nan_to_num(result, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+            return result, (offset_x, offset_y)
+        
+        if not region:
+            # 全屏搜索复用PreparedFrame中缓存的积分图和频谱
+            image = frame.numpy_image(factor, gray)
+        prepared = self._get_prepared_template(cache_key, template)
+        return numpy_matcher.match_template(image, prepared), (offset_x, offset_y)
+    
+    def _check_cancelled(self):
+        if self.cancel_token is not None:
+            self.cancel_token.check()
+    
+    def get_cache_stats(self):
+        """获取帧匹配缓存统计（命中数、未命中数、命中率、条目数）"""
+        if not self.match_cache:
+            return {'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'size': 0}
+        return self.match_cache.stats()
+    
+    def get_search_index_stats(self):
+        """获取局部搜索命中统计"""
+        if not self.search_index:
+            return {'local_hits': 0, 'fallbacks': 0}
+        return dict(self.search_index.stats)
+    
+    def find_images(self, screenshot, template_names, confidence=None):
+        """
+        在同一张截图中批量查找多个模板
+        
+        截图只预处理一次（BGR转换、灰度、金字塔、积分图和频谱），
+        所有模板共享同一个PreparedFrame；confidence可以是{模板名: 阈值}，
+        未列出的模板使用默认阈值
+        
+        返回:
+            dict: {
+                'results': {模板名: 匹配结果或None},
+                'best_name': 置信度最高的已匹配模板名（均未匹配时为None）,
+                'best': 对应的匹配结果
             }
+        """
+        results = {name: None for name in template_names}
+        batch = {'results': results, 'best_name': None, 'best': None}
+        
+        if screenshot is None:
+            Logger.error("截图为空")
+            return batch
+        
+        try:
+            screenshot = self.prepare_frame(screenshot)
+            if self.match_cache and isinstance(screenshot, PreparedFrame):
+                # 指纹在分发前计算一次，各线程直接复用
+                screenshot.fingerprint()
+        except Exception as e:
+            Logger.error(f"截图预处理失败: {e}")
+            return batch
+        
+        if isinstance(confidence, dict):
+            confidences = [confidence.get(name) for name in template_names]
+        else:
+            confidences = [confidence] * len(template_names)
+        
+        # 设置了取消令牌时匹配总在线程池中执行，调用线程一边等待一边检查取消，
+        # 停止时立即返回，不必等正在进行的matchTemplate结束
+        self._check_cancelled()
+        cancellable = self.cancel_token is not None and not self._in_pool_thread()
+        executor = self._get_executor(single=cancellable) if len(template_names) > 1 or cancellable else None
+        if executor:
+            futures = [executor.submit(self.find_image, screenshot, name, threshold)
+                       for name, threshold in zip(template_names, confidences)]
+            if cancellable:
+                self._wait_cancellable(futures)
+            found = [future.result() for future in futures]
+        else:
+            found = [self.find_image(screenshot, name, threshold)
+                     for name, threshold in zip(template_names, confidences)]
+        
+        # 按模板顺序汇总，置信度相同时保留靠前的模板，与串行结果一致
+        for name, result in zip(template_names, found):
+            results[name] = result
+            
+            if result and (batch['best'] is None or result['confidence'] > batch['best']['confidence']):
+                batch['best_name'] = name
+                batch['best'] = result
+        
+        return batch
+    
+    def _get_executor(self, single=False):
+        """
+        获取匹配线程池（首次使用时创建）；max_workers为1时返回None，表示串行匹配
+        
+        single为True时即使max_workers为1也返回（单线程的）线程池，用于可取消的匹配
+        """
+        if self.max_workers <= 1 and not single:
+            return None
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix='match',
+                        initializer=self._mark_pool_thread
+                    )
+                    Logger.info(f"并行匹配线程池已启动，线程数: {self.max_workers}")
+        return self._executor
+    
+    def _wait_cancellable(self, futures):
+        """等待所有匹配完成，期间取消令牌被取消时放弃等待并抛出OperationCancelled"""
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=self.CANCEL_POLL_INTERVAL, return_when=FIRST_EXCEPTION)
+            if self.cancel_token.is_cancelled:
+                for future in pending:
+                    future.cancel()
+                raise OperationCancelled()
+    
+    def _mark_pool_thread(self):
+        """线程池工作线程初始化：标记当前线程，避免在池内再次向线程池提交任务造成死锁"""
+        self._scratch.pool_thread = True
+    
+    def _in_pool_thread(self):
+        return getattr(self._scratch, 'pool_thread', False)
+    
+    def set_max_workers(self, max_workers):
+        """调整并行匹配线程数，旧线程池在当前任务完成后关闭"""
+        with self._executor_lock:
+            old_executor = self._executor
+            self._executor = None
+            self.max_workers = max(1, int(max_workers))
+        if old_executor:
+            old_executor.shutdown(wait=False)
+    
+    def flush_search_index(self):
+        """把搜索区域索引中未保存的修改写盘"""
+        if self.search_index:
+            self.search_index.flush()
+    
+    def shutdown(self):
+        """关闭匹配线程池"""
+        with self._executor_lock:
+            executor = self._executor
+            self._executor = None
+        if executor:
+            executor.shutdown(wait=True)
+    
+    def _scratch_buffer(self, shape):
+        """当前线程复用的float32相似度图缓冲区"""
+        buffers = getattr(self._scratch, 'buffers', None)
+        if buffers is None:
+            buffers = self._scratch.buffers = {}
+        buffer = buffers.get(shape)
+        if buffer is None:
+            if len(buffers) >= self.MAX_SCRATCH_BUFFERS:
+                buffers.clear()
+            buffer = buffers[shape] = np.empty(shape, dtype=np.float32)
+        return buffer
+    
+    def _to_bgr_array(self, image):
+        """将PIL Image或numpy数组统一转换为BGR格式的numpy数组"""
+        if PIL_AVAILABLE and isinstance(image, Image.Image):
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            # RGB -> BGR
+            return np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+        return image
+    
+    def to_device_coordinates(self, result, scale):
+        """把分析分辨率下的匹配结果坐标映射回设备坐标（供点击使用）"""
+        if not result or scale == 1:
+            return result
+        
+        def to_device(point):
+            return (int(round(point[0] / scale)), int(round(point[1] / scale)))
+        
+        mapped = dict(result)
+        for key in ('center', 'top_left', 'bottom_right'):
+            mapped[key] = to_device(result[key])
+        return mapped
+    
+    def _build_match_result(self, max_val, max_loc, template):
+        """根据匹配位置构造结果字典"""
+        h, w = template.shape[:2]
+        center_x = max_loc[0] + w // 2
+        center_y = max_loc[1] + h // 2
+        
+        return {
+            'found': True,
+            'confidence': max_val,
+            'center': (center_x, center_y),
+            'top_left': max_loc,
+            'bottom_right': (max_loc[0] + w, max_loc[1] + h)
+        }
+    
+    def find_image_cv2(self, screenshot, template, confidence, region=None,
+                       method='ccoeff_normed', mask=None, gray=False):
+        """
+        使用OpenCV进行模板匹配
+        
+        region为(x0, y0, x1, y1)时只在该区域内搜索；gray为True时在灰度图上匹配灰度模板
+        """
+        # Android shell截图返回PIL Image，需先转为BGR数组
+        frame = self.prepare_frame(screenshot)
+        
+        bands = self._band_regions(frame.shape, template.shape, region)
+        if bands:
+            best = self._find_tiled(frame, template, bands, method, mask, gray)
+        else:
+            best = self._best_in_region(frame, template, region, method, mask, gray)
+        if best is None:
+            return None
+        
+        max_val, max_loc = best
+        if max_val >= confidence:
+            return self._build_match_result(max_val, max_loc, template)
         
         return None
     
+    def _best_in_region(self, frame, template, region, method, mask, gray):
+        """
+        OpenCV匹配区域内的最佳位置
+        
+        相似度图的数值随区域尺寸有微小差异（约1e-4），最佳位置的得分在模板大小的窗口上重新计算，
+        因此同一位置无论是否分带、分几条带，得分都完全相同
+        
+        返回:
+            (最高得分, (x, y))；区域小于模板时返回None
+        """
+        result, (offset_x, offset_y) = self._score_map(
+            frame, template, gray=gray, region=region, method=method, mask=mask, scratch=True
+        )
+        if result is None:
+            return None
+        
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        location = (max_loc[0] + offset_x, max_loc[1] + offset_y)
+        return self._rescore(frame, template, location, method, mask, gray), location
+    
+    def _rescore(self, frame, template, location, method, mask, gray):
+        """在模板大小的窗口上计算location处的得分"""
+        x, y = location
+        h, w = template.shape[:2]
+        result, _ = self._score_map(frame, template, gray=gray, region=(x, y, x + w, y + h),
+                                    method=method, mask=mask)
+        return float(result[0, 0])
+    
+    def _band_regions(self, frame_shape, template_shape, region):
+        """
+        把搜索区域按匹配位置的行切分为tile_bands条横带
+        
+        相邻横带在画面上重叠模板高度减1行，每个匹配位置恰好属于一条横带。
+        切分只取决于区域和模板尺寸，与线程数无关，因此并行和串行执行的结果完全一致
+        
+        返回:
+            [(x0, y0, x1, y1), ...]；区域太小不值得分带时返回None
+        """
+        if self.tile_bands <= 1:
+            return None
+        
+        frame_h, frame_w = frame_shape[:2]
+        x0, y0, x1, y1 = region or (0, 0, frame_w, frame_h)
+        h = template_shape[0]
+        rows = (y1 - y0) - h + 1
+        if rows < self.tile_bands * self.TILE_MIN_BAND_ROWS or (x1 - x0) < template_shape[1]:
+            return None
+        
+        edges = [y0 + rows * i // self.tile_bands for i in range(self.tile_bands + 1)]
+        return [(x0, top, x1, bottom + h - 1) for top, bottom in zip(edges, edges[1:])]
+    
+    def _find_tiled(self, frame, template, bands, method, mask, gray):
+        """
+        分带搜索：各横带在线程池中并行匹配（已在池内或未启用线程池时依次执行），
+        按带的先后顺序合并，得分相同时保留靠上的位置，与逐带串行扫描的结果一致
+        """
+        executor = None if self._in_pool_thread() else self._get_executor()
+        if executor:
+            futures = [executor.submit(self._best_in_region, frame, template, band, method, mask, gray)
+                       for band in bands]
+            band_results = [future.result() for future in futures]
+        else:
+            band_results = [self._best_in_region(frame, template, band, method, mask, gray)
+                            for band in bands]
+        
+        best = None
+        for band_best in band_results:
+            if band_best and (best is None or band_best[0] > best[0]):
+                best = band_best
+        return best
+    
     def find_image_kivy(self, screenshot_path, template, template_name, confidence):
         """使用Kivy Image进行基础图像匹配（Android fallback）"""
         try:
@@ -290,109 +1190,57 @@ class ImageProcessor:
             Logger.error(f"Kivy图像加载失败: {e}")
             return None
     
-    def find_image_pil(self, screenshot, template, confidence):
-        """使用PIL进行简单的模板匹配"""
+    def find_image_pil(self, screenshot, template, confidence, template_name=None, region=None, gray=False):
+        """
+        无OpenCV时的模板匹配（Android构建默认路径）
+        
+        使用NumPy引擎对整幅截图（或region区域）计算归一化互相关（TM_CCOEFF_NORMED），
+        检查每一个位置，返回结果与find_image_cv2一致
+        """
         try:
-            from PIL import Image
-            import math
+            frame = self.prepare_frame(screenshot)
+            template = self._to_bgr_array(template)
             
-            # 确保screenshot和template都是PIL Image对象
-            if not isinstance(screenshot, Image.Image):
-                Logger.error("screenshot不是PIL Image对象")
+            if not hasattr(frame.bgr, 'shape') or not hasattr(template, 'shape'):
+                Logger.error("截图或模板格式不支持")
                 return None
             
-            if not isinstance(template, Image.Image):
-                # 如果template是numpy数组，尝试转换
-                if hasattr(template, 'shape'):
-                    # BGR to RGB, then to PIL
-                    import numpy as np
-                    template_rgb = template[:, :, ::-1]  # BGR to RGB
-                    template = Image.fromarray(template_rgb)
-                else:
-                    Logger.error("template格式不支持")
-                    return None
-            
-            # 获取尺寸
-            img_width, img_height = screenshot.size
-            tpl_width, tpl_height = template.size
-            
-            Logger.info(f"🔍 PIL模板匹配: 截图{img_width}x{img_height}, 模板{tpl_width}x{tpl_height}")
-            
-            # 简化匹配：滑动窗口比较
-            # 这是一个基础实现，性能较低但可用
-            best_match = None
-            best_score = 0
-            
-            # 为了性能，我们只采样部分位置
-            step = max(10, min(tpl_width, tpl_height) // 4)
-            
-            for y in range(0, img_height - tpl_height, step):
-                for x in range(0, img_width - tpl_width, step):
-                    # 裁剪区域
-                    region = screenshot.crop((x, y, x + tpl_width, y + tpl_height))
-                    
-                    # 计算相似度（简单的像素差异）
-                    score = self._compare_pil_images(region, template)
-                    
-                    if score > best_score:
-                        best_score = score
-                        best_match = (x, y)
+            result, (offset_x, offset_y) = self._score_map(
+                frame, template, cache_key=template_name, gray=gray, region=region
+            )
+            if result is None:
+                Logger.warning(f"模板尺寸{template.shape[:2]}大于搜索区域")
+                return None
             
-            Logger.info(f"📊 最佳匹配分数: {best_score:.3f}, 位置: {best_match}")
+            max_val, (x, y) = numpy_matcher.max_loc(result)
+            max_loc = (x + offset_x, y + offset_y)
             
-            if best_score >= confidence and best_match:
-                center_x = best_match[0] + tpl_width // 2
-                center_y = best_match[1] + tpl_height // 2
-                
-                return {
-                    'found': True,
-                    'confidence': best_score,
-                    'center': (center_x, center_y),
-                    'top_left': best_match,
-                    'bottom_right': (best_match[0] + tpl_width, best_match[1] + tpl_height)
-                }
+            if max_val >= confidence:
+                return self._build_match_result(max_val, max_loc, template)
             
             return None
             
+        except OperationCancelled:
+            raise
         except Exception as e:
-            Logger.error(f"PIL模板匹配失败: {e}")
+            Logger.error(f"NumPy模板匹配失败: {e}")
             import traceback
             Logger.error(f"详细错误: {traceback.format_exc()}")
             return None
     
-    def _compare_pil_images(self, img1, img2):
-        """比较两个PIL图像的相似度"""
-        try:
-            # 转换为相同大小（如果需要）
-            if img1.size != img2.size:
-                img2 = img2.resize(img1.size)
-            
-            # 转换为RGB
-            img1 = img1.convert('RGB')
-            img2 = img2.convert('RGB')
-            
-            # 简单的像素差异计算
-            pixels1 = list(img1.getdata())
-            pixels2 = list(img2.getdata())
-            
-            # 计算归一化的相似度
-            total_diff = 0
-            max_diff = 0
-            
-            for p1, p2 in zip(pixels1, pixels2):
-                # RGB差异
-                diff = sum(abs(c1 - c2) for c1, c2 in zip(p1, p2))
-                total_diff += diff
-                max_diff += 255 * 3  # 最大差异
-            
-            # 归一化为0-1之间的相似度
-            similarity = 1.0 - (total_diff / max_diff) if max_diff > 0 else 0
-            
-            return similarity
-            
-        except Exception as e:
-            Logger.error(f"图像比较失败: {e}")
-            return 0
+    def _get_prepared_template(self, template_name, template):
+        """获取NumPy引擎使用的预处理模板（零均值数据和范数，不含整屏大小的频谱）"""
+        if template_name is None:
+            return numpy_matcher.PreparedTemplate(template)
+        
+        prepared = self._prepared_templates.get(template_name)
+        if prepared is None:
+            with self._prepared_lock:
+                prepared = self._prepared_templates.get(template_name)
+                if prepared is None:
+                    prepared = numpy_matcher.PreparedTemplate(template)
+                    self._prepared_templates[template_name] = prepared
+        return prepared
     
     def save_screenshot(self, screenshot, filename):
         """保存截图"""
@@ -41,6 +41,7 @@ except Exception as e:
 
 # Import core modules
 from automation_engine import AutomationEngine
+from async_automation_engine import AsyncAutomationEngine
 from android_utils import AndroidUtils
 from permission_manager import PermissionManager
 from game_launcher import GameLauncher, GamePackageNames
@@ -59,6 +60,8 @@ class HSRAutomationApp(App):
         self.is_running = False
         self.status_text = "Ready"
         self.daily_commission_enabled = True  # Default enabled
+        # 使用asyncio引擎（AsyncAutomationEngine）执行流程
+        self.use_async_engine = False
         
         Logger.info(f"📱 HSRAutomationApp 启动 [版本: {self.APP_VERSION}]")
         
@@ -114,14 +117,14 @@ class HSRAutomationApp(App):
         # Options section with card-like appearance
         options_card = BoxLayout(
             orientation='vertical',
-            size_hint=(1, 0.15),
+            size_hint=(1, 0.2),
             spacing=10
         )
         
         # Options title
         options_title = Label(
             text='[size=14][color=34495E]Options[/color][/size]',
-            size_hint=(1, 0.4),
+            size_hint=(1, 0.3),
             markup=True,
             halign='left',
             valign='middle'
@@ -131,7 +134,7 @@ class HSRAutomationApp(App):
         # Daily Commission checkbox area
         commission_layout = BoxLayout(
             orientation='horizontal',
-            size_hint=(1, 0.6),
+            size_hint=(1, 0.35),
             spacing=15,
             padding=[10, 0]
         )
@@ -155,8 +158,36 @@ class HSRAutomationApp(App):
         commission_layout.add_widget(self.daily_commission_checkbox)
         commission_layout.add_widget(commission_label)
         
+        # Async engine checkbox area
+        async_layout = BoxLayout(
+            orientation='horizontal',
+            size_hint=(1, 0.35),
+            spacing=15,
+            padding=[10, 0]
+        )
+        
+        self.async_engine_checkbox = CheckBox(
+            active=self.use_async_engine,
+            size_hint=(0.15, 1),
+            color=[0.29, 0.56, 0.89, 1]
+        )
+        self.async_engine_checkbox.bind(active=self.on_async_engine_toggle)
+        
+        async_label = Label(
+            text='[size=15][color=2C3E50]asyncio引擎[/color][/size]',
+            size_hint=(0.85, 1),
+            markup=True,
+            halign='left',
+            valign='middle'
+        )
+        async_label.bind(size=async_label.setter('text_size'))
+        
+        async_layout.add_widget(self.async_engine_checkbox)
+        async_layout.add_widget(async_label)
+        
         options_card.add_widget(options_title)
         options_card.add_widget(commission_layout)
+        options_card.add_widget(async_layout)
         
         # Button section with improved styling
         button_layout = BoxLayout(
@@ -280,7 +311,7 @@ class HSRAutomationApp(App):
             Logger.info("Initializing automation engine...")
             self.update_status("Initializing...")
             
-            self.automation = AutomationEngine()
+            self.automation = AsyncAutomationEngine() if self.use_async_engine else AutomationEngine()
             
             # 设置初始选项
             self.automation.set_daily_commission_enabled(self.daily_commission_enabled)
@@ -487,6 +518,21 @@ class HSRAutomationApp(App):
         if self.automation:
             self.automation.set_daily_commission_enabled(value)
     
+    def on_async_engine_toggle(self, checkbox, value):
+        """切换同步/asyncio引擎（运行中不切换，下次开始时生效）"""
+        if self.is_running:
+            checkbox.active = self.use_async_engine
+            return
+        self.use_async_engine = value
+        Logger.info(f"Automation engine: {'asyncio' if value else 'threaded'}")
+        
+        # 重新创建引擎，释放旧引擎的线程池
+        if self.automation:
+            if hasattr(self.automation, 'shutdown'):
+                self.automation.shutdown()
+            self.automation.image_processor.shutdown()
+        self.init_automation()
+    
     def show_permissions(self, instance):
         """Show permissions settings interface"""
         content = BoxLayout(orientation='vertical', padding=20, spacing=15)
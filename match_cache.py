@@ -0,0 +1,73 @@
+"""
+匹配结果缓存模块 - 画面未变化时跳过模板匹配
+以帧指纹和模板参数为键缓存匹配结果（LRU淘汰），
+相同画面只需计算一次哈希，不再调用matchTemplate
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def frame_fingerprint(image):
+    """
+    计算帧指纹：对像素缓冲区做BLAKE2b摘要
+
+    对整帧哈希而不是采样，任何像素变化都会改变指纹，
+    1080x2400的BGR帧约20ms，远低于一次全屏匹配
+    """
+    image = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(image.data, digest_size=16)
+    digest.update(str(image.shape).encode('ascii'))
+    return digest.digest()
+
+
+class MatchCache:
+    """(帧指纹, 模板, 参数) -> 匹配结果 的LRU缓存"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        查询缓存
+
+        返回:
+            (是否命中, 结果)；未匹配到模板的结果None同样会被缓存
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                result = self._entries[key]
+                return True, dict(result) if result else result
+            self.misses += 1
+            return False, None
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = dict(result) if result else result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """命中率等统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._entries),
+            }
@@ -0,0 +1,172 @@
+"""
+NumPy模板匹配模块 - 无OpenCV环境下的归一化互相关匹配
+使用FFT计算互相关分子，积分图计算窗口统计量，
+结果与 cv2.matchTemplate(..., cv2.TM_CCOEFF_NORMED) 一致，并检查每一个位置
+"""
+
+import numpy as np
+
+# 分母小于该值的窗口视为纯色区域，得分记为0
+FLAT_EPSILON = 1e-6
+
+
+def next_fast_len(n):
+    """返回不小于n的最小5-smooth整数（2^a * 3^b * 5^c），FFT在该尺寸下最快"""
+    if n <= 1:
+        return 1
+    best = None
+    p5 = 1
+    while p5 < 2 * n:
+        p35 = p5
+        while p35 < 2 * n:
+            candidate = p35
+            while candidate < n:
+                candidate *= 2
+            if best is None or candidate < best:
+                best = candidate
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def block_downscale(image, factor):
+    """按整数倍缩小图像：裁掉不能整除的边缘后按 factor×factor 分块求均值"""
+    if factor == 1:
+        return image
+    h, w = image.shape[:2]
+    new_h, new_w = max(1, h // factor), max(1, w // factor)
+    cropped = image[:new_h * factor, :new_w * factor].astype(np.float32)
+    blocks = cropped.reshape((new_h, factor, new_w, factor) + image.shape[2:])
+    return (blocks.mean(axis=(1, 3)) + 0.5).astype(image.dtype)
+
+
+def bgr_to_gray(image):
+    """BGR图像转灰度（与OpenCV的COLOR_BGR2GRAY权重一致）"""
+    if image.ndim == 2:
+        return image
+    gray = image[:, :, 0] * 0.114 + image[:, :, 1] * 0.587 + image[:, :, 2] * 0.299
+    return (gray + 0.5).astype(np.uint8)
+
+
+def _as_channels(image):
+    """统一为通道优先的 (通道, 高, 宽) float64数组，便于逐通道做FFT和积分图"""
+    image = np.asarray(image)
+    if image.ndim == 2:
+        image = image[:, :, np.newaxis]
+    return np.ascontiguousarray(np.moveaxis(image, 2, 0), dtype=np.float64)
+
+
+class PreparedImage:
+    """预处理后的截图：缓存浮点通道、积分图和频谱，可被多个模板复用"""
+
+    def __init__(self, image):
+        self.data = _as_channels(image)
+        self.channels, self.height, self.width = self.data.shape
+        self.fft_shape = (next_fast_len(self.height), next_fast_len(self.width))
+
+        self._channel_sums = None
+        self._square_sum = None
+        self._spectrum = None
+
+    def integrals(self):
+        """返回 (各通道积分图, 全通道平方和积分图)，形状为 ([c,] h+1, w+1)"""
+        if self._channel_sums is None:
+            channel_sums = np.zeros((self.channels, self.height + 1, self.width + 1), dtype=np.float64)
+            square_sum = np.zeros((self.height + 1, self.width + 1), dtype=np.float64)
+            for c in range(self.channels):
+                plane = self.data[c]
+                np.cumsum(plane, axis=0, out=channel_sums[c, 1:, 1:])
+                np.cumsum(channel_sums[c, 1:, 1:], axis=1, out=channel_sums[c, 1:, 1:])
+                square_sum[1:, 1:] += plane * plane
+            np.cumsum(square_sum[1:, 1:], axis=0, out=square_sum[1:, 1:])
+            np.cumsum(square_sum[1:, 1:], axis=1, out=square_sum[1:, 1:])
+
+            self._channel_sums = channel_sums
+            self._square_sum = square_sum
+        return self._channel_sums, self._square_sum
+
+    def spectrum(self):
+        """返回各通道的二维实数FFT频谱"""
+        if self._spectrum is None:
+            self._spectrum = np.fft.rfft2(self.data, s=self.fft_shape)
+        return self._spectrum
+
+
+class PreparedTemplate:
+    """
+    预处理后的模板：缓存零均值数据和范数
+
+    频谱与截图同尺寸（整屏约数十MB），不缓存，每次匹配时计算（complex64）
+    """
+
+    def __init__(self, template):
+        data = _as_channels(template)
+        self.channels, self.height, self.width = data.shape
+        self.size = self.height * self.width
+        zero_mean = data - data.mean(axis=(1, 2), keepdims=True)
+        self.norm = float((zero_mean * zero_mean).sum())
+        self.zero_mean = zero_mean.astype(np.float32)
+
+    def spectrum(self, fft_shape):
+        """返回指定FFT尺寸下的共轭频谱"""
+        spectrum = np.fft.rfft2(self.zero_mean, s=fft_shape).astype(np.complex64, copy=False)
+        return np.conj(spectrum, out=spectrum)
+
+
+def _window_sum(integral, h, w):
+    """由积分图求所有 h×w 窗口之和"""
+    return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+
+def match_template(image, template):
+    """
+    计算归一化相关系数图（等价于 TM_CCOEFF_NORMED）
+
+    参数:
+        image: 截图数组或PreparedImage
+        template: 模板数组或PreparedTemplate
+
+    返回:
+        float32数组，形状为 (H-h+1, W-w+1)；模板大于截图时返回None
+    """
+    if not isinstance(image, PreparedImage):
+        image = PreparedImage(image)
+    if not isinstance(template, PreparedTemplate):
+        template = PreparedTemplate(template)
+
+    if template.channels != image.channels:
+        raise ValueError(f"通道数不一致: 截图{image.channels}, 模板{template.channels}")
+
+    h, w = template.height, template.width
+    result_h = image.height - h + 1
+    result_w = image.width - w + 1
+    if result_h <= 0 or result_w <= 0:
+        return None
+
+    # 分子：各通道互相关之和（频域内先求和，只做一次逆变换）
+    product = (image.spectrum() * template.spectrum(image.fft_shape)).sum(axis=0)
+    numerator = np.fft.irfft2(product, s=image.fft_shape)[:result_h, :result_w]
+
+    # 分母：窗口内去均值平方和，由积分图求得
+    channel_sums, square_sum = image.integrals()
+    window_var = _window_sum(square_sum, h, w)
+    for c in range(image.channels):
+        window_sum = _window_sum(channel_sums[c], h, w)
+        window_var -= window_sum * window_sum / template.size
+    np.maximum(window_var, 0, out=window_var)
+
+    denominator = np.sqrt(window_var * template.norm)
+    flat = denominator <= FLAT_EPSILON
+    denominator[flat] = 1.0
+
+    result = numerator / denominator
+    result[flat] = 0.0
+    np.clip(result, -1.0, 1.0, out=result)
+    return result.astype(np.float32)
+
+
+def max_loc(result):
+    """返回 (最大值, (x, y))，多个最大值时取行优先的第一个，与cv2.minMaxLoc一致"""
+    index = int(np.argmax(result))
+    y, x = divmod(index, result.shape[1])
+    return float(result[y, x]), (x, y)
@@ -0,0 +1,221 @@
+"""
+流水线执行模块 - 截图和匹配分别在独立的线程中进行
+截图由CaptureService持续进行；MatchPipeline的多个匹配线程各自领取最新的新帧，
+第N帧还在匹配时第N+1帧已经开始匹配。匹配结果放入有界队列，处理不过来的旧结果直接丢弃
+
+只在wait_for期间有关注的模板，点击由流程线程同步执行，点击期间匹配线程空闲
+"""
+
+import time
+import queue
+import threading
+from kivy.logger import Logger
+
+from cancellation import OperationCancelled
+from image_processor import PreparedFrame
+
+
+class MatchPipeline:
+    """
+    匹配阶段：对截图服务的每一帧新画面匹配当前关注的模板
+
+    watch()设定要匹配的模板（同一时刻只有一组），next_result()按完成顺序取出匹配结果；
+    没有关注的模板时匹配线程空闲等待，不消耗CPU
+    """
+
+    DEFAULT_WORKERS = 2
+    DEFAULT_QUEUE_SIZE = 4
+    # 等待结果时检查取消的间隔（秒）
+    POLL_INTERVAL = 0.02
+
+    def __init__(self, capture_service, image_processor, prepare, workers=DEFAULT_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        参数:
+            capture_service: 截图服务（CaptureService）
+            image_processor: 图像处理器（ImageProcessor）
+            prepare: 把截图服务的帧（BGR数组）转换为PreparedFrame的函数
+            workers: 匹配线程数
+            queue_size: 结果队列长度，满时丢弃最旧的结果
+        """
+        self.capture_service = capture_service
+        self.image_processor = image_processor
+        self.prepare = prepare
+        self.workers = max(1, workers)
+
+        self._results = queue.Queue(maxsize=max(1, queue_size))
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stop_event = threading.Event()
+        self._cancel_token = None
+
+        # 当前关注的模板；每次watch()递增generation，旧一组的结果不再入队
+        self._generation = 0
+        self._names = None
+        self._confidence = None
+        self._since = None
+        self._interval = 0.0
+        self._last_started = 0.0
+        # 已被某个匹配线程领取的最新帧 (generation, 帧序号)，避免多个线程重复匹配同一帧
+        self._claimed = (0, 0)
+
+        self._stats = {'evaluated': 0, 'hits': 0, 'dropped': 0}
+
+    def start(self, cancel_token=None):
+        """启动匹配线程"""
+        if self.is_running():
+            return
+        self._cancel_token = cancel_token
+        self._stop_event.clear()
+        self._threads = [
+            threading.Thread(target=self._run, name=f'match-pipeline-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        Logger.info(f"匹配流水线已启动，匹配线程数: {self.workers}")
+
+    def stop(self, timeout=2.0):
+        """停止匹配线程"""
+        self._stop_event.set()
+        self.wake()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        Logger.info(f"匹配流水线已停止: {self.stats()}")
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def wake(self):
+        """唤醒空闲的匹配线程（停止或取消时调用）"""
+        with self._condition:
+            self._condition.notify_all()
+
+    def watch(self, names, confidence=None, since=None):
+        """开始关注一组模板，清空之前的结果"""
+        with self._condition:
+            self._generation += 1
+            self._names = list(names)
+            self._confidence = confidence
+            self._since = since
+            self._interval = 0.0
+            self._drain()
+            self._condition.notify_all()
+
+    def unwatch(self):
+        """停止关注，匹配线程回到空闲状态"""
+        with self._condition:
+            self._generation += 1
+            self._names = None
+            self._drain()
+
+    def set_interval(self, interval):
+        """两次开始匹配之间的最短间隔（秒），用于放慢长时间等待的匹配频率"""
+        with self._condition:
+            self._interval = interval
+
+    def next_result(self, timeout=None):
+        """
+        取出下一个匹配结果
+
+        返回:
+            dict: {'frame': PreparedFrame, 'batch': find_images结果, 'timestamp': 截图时间}；
+            超时返回None，已取消时抛出OperationCancelled
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self._cancel_token is not None:
+                self._cancel_token.check()
+            wait = self.POLL_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    return None
+            try:
+                return self._results.get(timeout=wait)
+            except queue.Empty:
+                continue
+
+    def _drain(self):
+        while True:
+            try:
+                self._results.get_nowait()
+            except queue.Empty:
+                return
+
+    def _cancelled(self):
+        return self._stop_event.is_set() or (self._cancel_token is not None and self._cancel_token.is_cancelled)
+
+    def _next_job(self):
+        """等待有关注的模板并到达匹配间隔，返回(generation, 模板, 阈值, since)"""
+        with self._condition:
+            while not self._cancelled():
+                if self._names is not None:
+                    wait = self._last_started + self._interval - time.time()
+                    if wait <= 0:
+                        self._last_started = time.time()
+                        return self._generation, self._names, self._confidence, self._since
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+        return None
+
+    def _run(self):
+        try:
+            self._match_frames()
+        finally:
+            # 线程退出时释放持有的帧，槽位重新可供截图服务写入
+            self.capture_service.release()
+
+    def _match_frames(self):
+        service = self.capture_service
+        while not self._cancelled():
+            job = self._next_job()
+            if job is None:
+                break
+            generation, names, confidence, since = job
+
+            frame = service.wait_for_new_frame(1.0, since, self._cancel_token)
+            if frame is None:
+                continue
+            with self._condition:
+                if generation != self._generation or (generation, frame.index) <= self._claimed:
+                    # 关注的模板已变化，或其他线程已经在匹配这一帧
+                    continue
+                self._claimed = (generation, frame.index)
+
+            try:
+                prepared = self.prepare(frame.image)
+                batch = self.image_processor.find_images(prepared, names, confidence)
+            except OperationCancelled:
+                break
+            except Exception as e:
+                Logger.error(f"流水线匹配失败: {e}")
+                continue
+
+            hit = any(batch['results'].values())
+            if hit and prepared.bgr is frame.image:
+                # 命中的帧会交给流程继续查找其他模板，复制一份，避免槽位被截图服务覆盖
+                prepared = PreparedFrame(prepared.bgr.copy(), scale=prepared.scale)
+            self._publish(generation, {'frame': prepared, 'batch': batch, 'timestamp': frame.timestamp}, hit)
+
+    def _publish(self, generation, result, hit):
+        with self._condition:
+            if generation != self._generation:
+                return
+            self._stats['evaluated'] += 1
+            self._stats['hits'] += 1 if hit else 0
+            if self._results.full():
+                # 流程来不及处理，丢弃最旧的结果
+                try:
+                    self._results.get_nowait()
+                    self._stats['dropped'] += 1
+                except queue.Empty:
+                    pass
+            self._results.put_nowait(result)
+
+    def stats(self):
+        """已匹配帧数、命中次数和因队列已满丢弃的结果数"""
+        with self._condition:
+            return dict(self._stats)
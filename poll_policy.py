@@ -0,0 +1,40 @@
+"""
+轮询策略 - 控制AutomationEngine.wait_for检查画面的频率
+"""
+
+
+class PollPolicy:
+    """
+    wait_for的检查频率
+
+    interval为0时每来一帧新画面就匹配一次；未命中时间隔按backoff倍数增长，
+    不超过max_interval。适合长时间等待（战斗、加载）时降低匹配开销
+    """
+
+    def __init__(self, interval=0.0, backoff=1.0, max_interval=1.0, log_every=10.0):
+        """
+        参数:
+            interval: 两次检查之间的最短间隔（秒）
+            backoff: 每次未命中后间隔乘以的倍数
+            max_interval: 间隔上限（秒）
+            log_every: 每隔多少秒输出一次等待进度，0为不输出
+        """
+        self.interval = interval
+        self.backoff = backoff
+        self.max_interval = max_interval
+        self.log_every = log_every
+
+    def next_interval(self, interval):
+        """未命中后的下一个检查间隔"""
+        return min(self.max_interval, max(self.interval, interval * self.backoff))
+
+    def __repr__(self):
+        return (f"PollPolicy(interval={self.interval}, backoff={self.backoff}, "
+                f"max_interval={self.max_interval})")
+
+
+# 每来一帧就检查：等待按钮出现后尽快点击
+EVERY_FRAME = PollPolicy()
+
+# 从0.2秒开始逐步放慢到每秒一次：等待时间较长且不急于响应的场景（游戏加载、战斗结束）
+RELAXED = PollPolicy(interval=0.2, backoff=1.5, max_interval=1.0)
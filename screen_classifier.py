@@ -0,0 +1,181 @@
+"""
+屏幕分类模块 - 一次判断当前处于哪个游戏界面
+每个界面由几个锚点模板标识，在缩小的灰度画面上粗匹配（开销约为全分辨率的1/16~1/64）；
+确认过的界面记录缩略图特征，同一界面再次出现时由缩略图给出候选，只需匹配该界面的锚点确认。
+流程在意外的界面上超时时用它判断从哪个状态恢复，不必逐个查找所有模板
+"""
+
+import time
+from kivy.logger import Logger
+
+import numpy as np
+
+from image_processor import PreparedFrame, scale_image
+
+UNKNOWN = 'unknown'
+
+# {界面: 锚点模板}，排在前面的锚点先匹配
+DEFAULT_SCREENS = {
+    'login': ['login_button_first', 'game_start_screen', 'login_button'],
+    'main_menu': ['task'],
+    'commissions': ['weituo', 'paiqianzhong', 'yijianlingqu', 'zaicipaiqian'],
+    'battle': ['beisukai', 'beisuguan', 'zidongkai', 'zidongguan'],
+    'battle_result': ['zailaiyici', 'tuichuguanqia'],
+    'reward_popup': ['yueka', 'gift', 'lingqu'],
+}
+
+
+class ScreenClassifier:
+    """
+    锚点模板 + 缩略图特征的屏幕分类器
+
+    classify()按顺序粗匹配各界面的锚点：缩略图特征相近的界面、调用方预期的界面、
+    最近一次识别出的界面优先，得分足够高或超出耗时预算时提前结束。
+    缩略图只决定检查顺序，不单独作为结果（锚点很小时缩略图区分不了界面）
+    """
+
+    # 粗匹配的最大缩小倍数
+    FACTOR = 8
+    # 粗匹配得分达到该值认为锚点出现；达到EARLY_EXIT时不再匹配其余锚点
+    THRESHOLD = 0.65
+    EARLY_EXIT = 0.85
+    # 默认耗时预算（秒）
+    DEFAULT_BUDGET = 0.05
+
+    # 缩略图特征尺寸（宽, 高）、判定为同一界面的最大平均灰度差、每个界面保留的特征数
+    SIGNATURE_SIZE = (32, 18)
+    SIGNATURE_THRESHOLD = 6.0
+    MAX_SIGNATURES = 4
+    # 锚点得分达到该值时记录该帧的缩略图特征
+    LEARN_CONFIDENCE = EARLY_EXIT
+
+    def __init__(self, image_processor, screens=None, budget=DEFAULT_BUDGET):
+        """
+        参数:
+            image_processor: 图像处理器（ImageProcessor）
+            screens: {界面: 锚点模板列表}，默认DEFAULT_SCREENS
+            budget: 每次分类的耗时预算（秒）
+        """
+        self.image_processor = image_processor
+        self.budget = budget
+        self.last_screen = None
+        # {界面: [缩略图特征]}
+        self.signatures = {}
+        self._stats = {'classified': 0, 'signature_hits': 0, 'over_budget': 0, 'total_ms': 0.0}
+
+        # 锚点索引：预先生成缩小模板，丢弃不存在的模板
+        self.screens = {}
+        for screen, anchors in (screens or DEFAULT_SCREENS).items():
+            usable = [name for name in anchors if image_processor.coarse_template(name, self.FACTOR)]
+            if usable:
+                self.screens[screen] = usable
+        Logger.info(f"屏幕分类器: {len(self.screens)}个界面，"
+                    f"{sum(len(anchors) for anchors in self.screens.values())}个锚点")
+
+    def classify(self, frame, expected=None, budget=None):
+        """
+        判断frame（PreparedFrame或BGR数组）是哪个界面
+
+        参数:
+            expected: 优先检查的界面列表
+            budget: 本次耗时预算（秒），默认使用构造时的预算
+
+        返回:
+            dict: 'screen'（界面名，无法判断时为UNKNOWN）、'confidence'、
+                  'scores'（已检查界面的得分）、'source'（'signature'为缩略图给出的候选得到确认）、
+                  'complete'（是否在预算内完成）、'elapsed'（秒）
+        """
+        started = time.time()
+        budget = self.budget if budget is None else budget
+        if not isinstance(frame, PreparedFrame):
+            frame = self.image_processor.prepare_frame(frame)
+
+        signature = self._signature(frame)
+        proposed = self._match_signature(signature)
+        result = self._match_anchors(frame, self._order(proposed, expected), started + budget)
+        if proposed is not None and result['screen'] == proposed:
+            result['source'] = 'signature'
+        elif result['confidence'] >= self.LEARN_CONFIDENCE:
+            self._learn(result['screen'], signature)
+
+        result['elapsed'] = time.time() - started
+        self._record(result)
+        if result['screen'] != UNKNOWN:
+            self.last_screen = result['screen']
+        return result
+
+    def learn(self, frame, screen):
+        """记录某一帧属于screen（流程已通过其他方式确认界面时调用）"""
+        if not isinstance(frame, PreparedFrame):
+            frame = self.image_processor.prepare_frame(frame)
+        self._learn(screen, self._signature(frame))
+
+    def _order(self, proposed, expected):
+        """缩略图候选、预期的界面、最近一次的界面优先，其余按定义顺序"""
+        order = []
+        for screen in [proposed] + list(expected or []) + [self.last_screen] + list(self.screens):
+            if screen in self.screens and screen not in order:
+                order.append(screen)
+        return order
+
+    def _match_anchors(self, frame, order, deadline):
+        processor = self.image_processor
+        scores = {}
+        complete = True
+        for screen in order:
+            if time.time() > deadline:
+                complete = False
+                break
+            best = 0.0
+            for name in self.screens[screen]:
+                best = max(best, processor.coarse_score(frame, name, self.FACTOR))
+                if best >= self.EARLY_EXIT:
+                    break
+            scores[screen] = best
+            if best >= self.EARLY_EXIT:
+                break
+
+        screen = max(scores, key=scores.get) if scores else UNKNOWN
+        confidence = scores.get(screen, 0.0)
+        if confidence < self.THRESHOLD:
+            screen = UNKNOWN
+        return {'screen': screen, 'confidence': confidence, 'scores': scores,
+                'source': 'anchors', 'complete': complete}
+
+    def _signature(self, frame):
+        """缩略图特征：缩小的灰度图再缩放到固定尺寸"""
+        small = frame.image(self.FACTOR, gray=True)
+        width, height = self.SIGNATURE_SIZE
+        return scale_image(small, min(width / small.shape[1], height / small.shape[0])).astype(np.int16)
+
+    def _match_signature(self, signature):
+        """缩略图特征最相近的界面，没有足够相近的返回None"""
+        best, best_diff = None, self.SIGNATURE_THRESHOLD
+        for screen, entries in self.signatures.items():
+            for stored in entries:
+                if stored.shape != signature.shape:
+                    continue
+                diff = float(np.abs(stored - signature).mean())
+                if diff <= best_diff:
+                    best, best_diff = screen, diff
+        return best
+
+    def _learn(self, screen, signature):
+        entries = self.signatures.setdefault(screen, [])
+        entries.append(signature)
+        if len(entries) > self.MAX_SIGNATURES:
+            entries.pop(0)
+
+    def _record(self, result):
+        self._stats['classified'] += 1
+        self._stats['total_ms'] += result['elapsed'] * 1000
+        if result['source'] == 'signature':
+            self._stats['signature_hits'] += 1
+        if not result['complete']:
+            self._stats['over_budget'] += 1
+
+    def stats(self):
+        """分类次数、缩略图命中次数、超出预算次数和平均耗时"""
+        stats = dict(self._stats)
+        stats['mean_ms'] = stats['total_ms'] / stats['classified'] if stats['classified'] else 0.0
+        return stats
@@ -0,0 +1,162 @@
+"""
+搜索区域索引模块 - 记录每个模板上一次匹配到的位置
+按设备持久化保存，下次先在该位置附近的小区域内搜索，未命中再回退到全屏搜索
+"""
+
+import os
+import json
+import time
+import socket
+import tempfile
+import threading
+from kivy.logger import Logger
+from kivy.utils import platform
+
+
+class SearchRegionIndex:
+    """按设备、分辨率记录模板最后匹配位置的持久化索引"""
+
+    # 局部搜索区域在上次匹配框四周额外扩展的像素
+    DEFAULT_PADDING = 48
+    # 匹配过程中两次写盘的最短间隔（秒），其余修改在flush()时写入
+    SAVE_INTERVAL = 10.0
+
+    def __init__(self, storage_dir=None, device_id=None, padding=DEFAULT_PADDING):
+        self.padding = padding
+        self.device_id = device_id or self._default_device_id()
+        self.storage_dir = storage_dir or self._default_storage_dir()
+        self.path = os.path.join(self.storage_dir, f"search_index_{self._safe_name(self.device_id)}.json")
+
+        # {分辨率键: {模板名: [x, y, w, h]}}
+        self.entries = {}
+        self.stats = {'local_hits': 0, 'fallbacks': 0}
+        self._lock = threading.Lock()
+        # 写盘串行进行，保证后写入的快照不会被先写入的覆盖
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.time()
+
+        self.load()
+
+    def _default_device_id(self):
+        """设备标识：Android使用机型，桌面使用主机名"""
+        if platform == 'android':
+            try:
+                from jnius import autoclass
+                Build = autoclass('android.os.Build')
+                return f"{Build.MANUFACTURER}_{Build.MODEL}"
+            except Exception as e:
+                Logger.warning(f"获取设备型号失败: {e}")
+        return socket.gethostname() or 'default'
+
+    def _default_storage_dir(self):
+        """存储目录：Android使用应用私有目录，桌面使用当前目录下的cache"""
+        if platform == 'android':
+            try:
+                from jnius import autoclass
+                PythonActivity = autoclass('org.kivy.android.PythonActivity')
+                return PythonActivity.mActivity.getFilesDir().getAbsolutePath()
+            except Exception as e:
+                Logger.warning(f"获取应用存储目录失败: {e}")
+        return os.path.join(os.getcwd(), 'cache')
+
+    def _safe_name(self, name):
+        return ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(name))
+
+    def _resolution_key(self, frame_shape):
+        return f"{frame_shape[1]}x{frame_shape[0]}"
+
+    def load(self):
+        """从磁盘加载索引"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+            Logger.info(f"加载搜索区域索引: {self.path}")
+        except Exception as e:
+            Logger.warning(f"搜索区域索引加载失败，将重新学习: {e}")
+            self.entries = {}
+
+    def save(self):
+        """保存索引到磁盘（在锁内取快照，写入唯一的临时文件后替换）"""
+        with self._save_lock:
+            with self._lock:
+                snapshot = {key: dict(boxes) for key, boxes in self.entries.items()}
+                self._dirty = False
+                self._last_save = time.time()
+
+            tmp_path = None
+            try:
+                os.makedirs(self.storage_dir, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(prefix='search_index_', suffix='.tmp', dir=self.storage_dir)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, ensure_ascii=False, indent=1)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                Logger.warning(f"搜索区域索引保存失败: {e}")
+                with self._lock:
+                    self._dirty = True
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def flush(self):
+        """有未保存的修改时写盘（流程结束时调用）"""
+        if self._dirty:
+            self.save()
+
+    def _changed(self):
+        """标记有修改；距上次写盘超过SAVE_INTERVAL时顺带写盘（需在锁外调用）"""
+        with self._lock:
+            self._dirty = True
+            due = time.time() - self._last_save >= self.SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def get_region(self, template_name, frame_shape):
+        """
+        获取模板的局部搜索区域
+
+        返回:
+            (x0, y0, x1, y1) 已裁剪到画面内的区域；没有记录时返回None
+        """
+        with self._lock:
+            box = self.entries.get(self._resolution_key(frame_shape), {}).get(template_name)
+        if not box:
+            return None
+
+        x, y, w, h = box
+        frame_h, frame_w = frame_shape[:2]
+        x0 = max(0, x - self.padding)
+        y0 = max(0, y - self.padding)
+        x1 = min(frame_w, x + w + self.padding)
+        y1 = min(frame_h, y + h + self.padding)
+
+        if x1 - x0 < w or y1 - y0 < h:
+            return None
+        return (x0, y0, x1, y1)
+
+    def record(self, template_name, frame_shape, top_left, size):
+        """记录一次匹配位置（位置变化时标记待保存）"""
+        box = [int(top_left[0]), int(top_left[1]), int(size[0]), int(size[1])]
+        with self._lock:
+            entries = self.entries.setdefault(self._resolution_key(frame_shape), {})
+            if entries.get(template_name) == box:
+                return
+            entries[template_name] = box
+        self._changed()
+
+    def forget(self, template_name, frame_shape):
+        """删除模板的位置记录"""
+        with self._lock:
+            removed = self.entries.get(self._resolution_key(frame_shape), {}).pop(template_name, None)
+        if removed is not None:
+            self._changed()
+
+    def count_local_hit(self):
+        with self._lock:
+            self.stats['local_hits'] += 1
+
+    def count_fallback(self):
+        with self._lock:
+            self.stats['fallbacks'] += 1
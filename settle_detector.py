@@ -0,0 +1,107 @@
+"""
+画面静止检测模块 - 判断界面动画是否已经结束
+比较相邻两帧缩小后的灰度图，差异连续若干帧低于阈值即认为画面已静止，
+用来代替点击前后的固定等待。差异按网格分块取平均后取最大值，
+小范围的动画（加载图标、按钮闪烁）不会被整屏平均掉
+"""
+
+import numpy as np
+
+from image_processor import PreparedFrame
+
+
+class SettleDetector:
+    """
+    连续帧差分的静止检测
+
+    全屏检测时比较缩小factor倍的灰度图（与金字塔层级共用缓存）；
+    指定roi时只比较该区域的全分辨率灰度图，区域外的动画（战斗画面、背景特效）不影响判断
+    """
+
+    DEFAULT_THRESHOLD = 2.0
+    DEFAULT_STABLE_FRAMES = 3
+    DEFAULT_FACTOR = 8
+    # 差异分块网格（行, 列），区域较小时自动减少
+    GRID = (16, 8)
+    # roi为匹配结果时向外扩展的像素（设备坐标），覆盖按钮的缩放/发光动画
+    ROI_PADDING = 16
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, stable_frames=DEFAULT_STABLE_FRAMES,
+                 factor=DEFAULT_FACTOR, roi=None):
+        """
+        参数:
+            threshold: 每个网格块的平均灰度差（0-255）都低于该值视为两帧相同
+            stable_frames: 连续多少次相同认为已静止
+            factor: 全屏检测时的缩小倍数
+            roi: 检测区域，设备坐标 (left, top, right, bottom) 或匹配结果字典，None为全屏
+        """
+        self.threshold = threshold
+        self.stable_frames = max(1, stable_frames)
+        self.factor = factor
+        self.roi = self._normalize_roi(roi)
+        self.reset()
+
+    def reset(self):
+        self._previous = None
+        self.stable_count = 0
+        self.last_diff = None
+        self.frames = 0
+
+    @property
+    def settled(self):
+        return self.stable_count >= self.stable_frames
+
+    def update(self, frame):
+        """
+        送入下一帧（PreparedFrame或BGR数组）
+
+        返回:
+            bool: 是否已静止
+        """
+        signature = self._signature(frame)
+        self.frames += 1
+
+        previous, self._previous = self._previous, signature
+        if previous is None or previous.shape != signature.shape:
+            self.stable_count = 0
+            return False
+
+        self.last_diff = self._max_cell_diff(np.abs(signature.astype(np.int16) - previous))
+        if self.last_diff <= self.threshold:
+            self.stable_count += 1
+        else:
+            self.stable_count = 0
+        return self.settled
+
+    def _signature(self, frame):
+        """用于比较的灰度图（全屏缩小图或roi区域）"""
+        if not isinstance(frame, PreparedFrame):
+            frame = PreparedFrame(frame)
+
+        if self.roi is None:
+            # 复制一份：帧缓存随截图服务的槽位复用
+            return np.array(frame.image(self.factor, gray=True), copy=True)
+
+        left, top, right, bottom = (int(round(value * frame.scale)) for value in self.roi)
+        gray = frame.gray()
+        height, width = gray.shape[:2]
+        left, right = max(0, left), min(width, max(right, left + 1))
+        top, bottom = max(0, top), min(height, max(bottom, top + 1))
+        return np.array(gray[top:bottom, left:right], copy=True)
+
+    def _max_cell_diff(self, diff):
+        """按网格分块的平均差异中的最大值"""
+        rows = min(self.GRID[0], diff.shape[0])
+        cols = min(self.GRID[1], diff.shape[1])
+        cell_h, cell_w = diff.shape[0] // rows, diff.shape[1] // cols
+        cells = diff[:rows * cell_h, :cols * cell_w].reshape(rows, cell_h, cols, cell_w)
+        return float(cells.mean(axis=(1, 3)).max())
+
+    def _normalize_roi(self, roi):
+        if roi is None:
+            return None
+        if isinstance(roi, dict):
+            (left, top), (right, bottom) = roi['top_left'], roi['bottom_right']
+            pad = self.ROI_PADDING
+            return (left - pad, top - pad, right + pad, bottom + pad)
+        return tuple(roi)
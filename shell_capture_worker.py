@@ -0,0 +1,209 @@
+"""
+常驻shell截图模块 - 用一个长期运行的sh进程反复执行screencap
+截图请求通过sh的标准输入发送，帧数据从标准输出按帧协议读回，
+避免每帧fork/exec新进程和JNI调用的开销；sh进程退出时自动重启
+
+帧协议（每个请求）:
+    请求: <截图命令> 2>/dev/null; s=$?; echo; echo <结束标记> $s
+    响应: 头部（宽、高、像素格式[、色彩空间]） | RGBA像素 | '\\n' | '<结束标记> <退出码>\\n'
+"""
+
+import struct
+import uuid
+import threading
+import subprocess
+
+import numpy as np
+from kivy.logger import Logger
+
+# screencap头部：宽、高、像素格式（Android 9+另有4字节色彩空间）
+SCREENCAP_HEADER_SIZE = 12
+SCREENCAP_MAX_HEADER_SIZE = 16
+# screencap像素格式：RGBA_8888 / RGBX_8888
+SCREENCAP_RGBA_FORMATS = (1, 2)
+# 单帧像素数上限，超过视为协议错位
+MAX_FRAME_PIXELS = 16384 * 16384
+
+
+class ShellProtocolError(Exception):
+    """sh进程输出与帧协议不符（进程已退出或输出错位）"""
+
+
+class ShellCaptureWorker:
+    """常驻sh进程截图器"""
+
+    def __init__(self, command='screencap', shell='sh', max_restarts=5):
+        """
+        参数:
+            command: 输出原始帧的截图命令（Linux下可替换为 tools/fake_screencap.py）
+            shell: 常驻shell程序
+            max_restarts: 连续重启次数上限，超过后不再重启，由调用方回退到其他截图方式
+        """
+        self.command = command
+        self.shell = shell
+        self.max_restarts = max_restarts
+        self.marker = f"__SCREENCAP_END_{uuid.uuid4().hex}__".encode('ascii')
+
+        self.process = None
+        self.header_size = None
+        self._buffer = None
+        self._lock = threading.Lock()
+
+        self.stats = {'frames': 0, 'restarts': 0, 'failures': 0}
+        self._consecutive_restarts = 0
+
+    def start(self):
+        """启动sh进程"""
+        self.process = subprocess.Popen(
+            [self.shell],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        Logger.info(f"常驻截图shell已启动，PID: {self.process.pid}")
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        """结束sh进程"""
+        process, self.process = self.process, None
+        if process is None:
+            return
+        try:
+            if process.poll() is None:
+                process.stdin.write(b"exit\n")
+                process.stdin.flush()
+                process.wait(timeout=1)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            process.kill()
+            process.wait()
+        finally:
+            for stream in (process.stdin, process.stdout):
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+
+    def capture(self):
+        """
+        截取一帧
+
+        返回:
+            numpy array: (高, 宽, 4) 的RGBA视图，指向内部缓冲区，下一次截图时会被覆盖；
+            截图命令失败或sh无法启动时返回None
+        """
+        with self._lock:
+            for attempt in range(2):
+                if not self.is_alive():
+                    if self._consecutive_restarts >= self.max_restarts:
+                        return None
+                    if self.process is not None or self.stats['frames']:
+                        self.stats['restarts'] += 1
+                        self._consecutive_restarts += 1
+                        Logger.warning("截图shell已退出，正在重启")
+                    self.stop()
+                    try:
+                        self.start()
+                    except OSError as e:
+                        Logger.error(f"截图shell启动失败: {e}")
+                        self._consecutive_restarts += 1
+                        return None
+
+                try:
+                    frame = self._request()
+                    self._consecutive_restarts = 0
+                    if frame is None:
+                        self.stats['failures'] += 1
+                    else:
+                        self.stats['frames'] += 1
+                    return frame
+                except (OSError, ValueError, ShellProtocolError) as e:
+                    Logger.warning(f"截图shell通信失败: {e}")
+                    self.stop()
+            return None
+
+    def _request(self):
+        """发送一次截图请求并读取响应帧"""
+        request = self.command.encode('utf-8') + b" 2>/dev/null; s=$?; echo; echo " + self.marker + b" $s\n"
+        self.process.stdin.write(request)
+        self.process.stdin.flush()
+
+        stream = self.process.stdout
+        header = self._read_exact(stream, SCREENCAP_HEADER_SIZE)
+        if header.startswith(b"\n"):
+            # 命令没有输出帧，只有结束标记
+            exit_code = self._read_trailer(stream, header)[1]
+            Logger.warning(f"截图命令执行失败，退出码: {exit_code}")
+            return None
+
+        width, height, pixel_format = struct.unpack('<III', header)
+        if pixel_format not in SCREENCAP_RGBA_FORMATS or not 0 < width * height <= MAX_FRAME_PIXELS:
+            raise ShellProtocolError(f"无效的帧头部: {width}x{height}, 格式{pixel_format}")
+
+        pixel_bytes = width * height * 4
+        if self._buffer is None or len(self._buffer) != pixel_bytes:
+            self._buffer = bytearray(pixel_bytes)
+            self.header_size = None
+
+        # 已知头部长度时先跳过多余的头部字节，像素直接读到缓冲区正确位置
+        extra_header = (self.header_size or SCREENCAP_HEADER_SIZE) - SCREENCAP_HEADER_SIZE
+        if extra_header:
+            self._read_exact(stream, extra_header)
+        self._read_into(stream, memoryview(self._buffer))
+
+        tail, exit_code = self._read_trailer(stream)
+        if tail:
+            # 头部比预期多出len(tail)字节：像素整体前移，补上末尾
+            if extra_header + len(tail) > SCREENCAP_MAX_HEADER_SIZE - SCREENCAP_HEADER_SIZE:
+                raise ShellProtocolError(f"帧长度与头部不符，多出 {len(tail)} 字节")
+            pixels = np.frombuffer(self._buffer, dtype=np.uint8)
+            pixels[:-len(tail)] = pixels[len(tail):].copy()
+            pixels[-len(tail):] = np.frombuffer(tail, dtype=np.uint8)
+            extra_header += len(tail)
+        self.header_size = SCREENCAP_HEADER_SIZE + extra_header
+
+        if exit_code != 0:
+            Logger.warning(f"截图命令退出码: {exit_code}")
+            return None
+
+        return np.frombuffer(self._buffer, dtype=np.uint8).reshape(height, width, 4)
+
+    def _read_trailer(self, stream, prefix=b""):
+        """
+        读取到结束标记行为止
+
+        返回:
+            (标记前多出的字节, 退出码)
+        """
+        data = bytearray(prefix)
+        while True:
+            end = data.find(self.marker)
+            if end >= 0 and data.endswith(b"\n"):
+                break
+            line = stream.readline()
+            if not line:
+                raise ShellProtocolError("读取结束标记时shell已退出")
+            data += line
+            if len(data) > SCREENCAP_MAX_HEADER_SIZE + len(self.marker) + 16:
+                raise ShellProtocolError("结束标记前出现多余输出")
+
+        # 标记前是echo输出的换行
+        if end == 0 or data[end - 1:end] != b"\n":
+            raise ShellProtocolError("结束标记格式错误")
+        exit_code = int(data[end + len(self.marker):].strip() or -1)
+        return bytes(data[:end - 1]), exit_code
+
+    def _read_exact(self, stream, size):
+        buffer = bytearray(size)
+        self._read_into(stream, memoryview(buffer))
+        return bytes(buffer)
+
+    def _read_into(self, stream, view):
+        """循环readinto直到填满view，流提前结束时抛出ShellProtocolError"""
+        total = 0
+        while total < len(view):
+            count = stream.readinto(view[total:])
+            if not count:
+                raise ShellProtocolError(f"shell输出中断: {total}/{len(view)} 字节")
+            total += count
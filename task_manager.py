@@ -18,6 +18,7 @@ class TaskManager:
                 'id': 'login',
                 'name': '游戏登录',
                 'type': 'login',
+                'flow': 'login',
                 'description': '自动检测登录界面并完成登录',
                 'priority': 1,
                 'required': True,
@@ -28,6 +29,7 @@ class TaskManager:
                 'id': 'weituo_task',
                 'name': '委托任务',
                 'type': 'weituo_task',
+                'flow': 'weituo',
                 'description': '点击task按钮，检索weituo界面，然后点击qianwang',
                 'priority': 2,
                 'required': False,
@@ -0,0 +1,160 @@
+"""
+模板清单模块 - 从YAML清单加载模板定义并编译为内存注册表
+每个模板声明：文件、搜索区域、匹配阈值、颜色模式、匹配方法和掩码
+"""
+
+import os
+
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+MANIFEST_NAME = 'manifest.yaml'
+
+COLOR_MODES = ('color', 'gray')
+MATCH_METHODS = ('ccoeff_normed', 'ccorr_normed', 'sqdiff_normed')
+
+DEFAULT_SPEC = {
+    'threshold': 0.7,
+    'color': 'color',
+    'method': 'ccoeff_normed',
+    'region': None,
+    'mask': None,
+}
+
+
+class ManifestError(Exception):
+    """模板清单格式错误"""
+
+
+class TemplateSpec:
+    """单个模板的匹配配置"""
+
+    def __init__(self, name, file, threshold=0.7, color='color', method='ccoeff_normed',
+                 region=None, mask=None):
+        self.name = name
+        self.file = file
+        self.threshold = threshold
+        self.color = color
+        self.method = method
+        # 搜索区域：(x0, y0, x1, y1)，取值为屏幕宽高的比例；None表示全屏
+        self.region = region
+        # 掩码文件路径（相对模板目录），None表示不使用掩码
+        self.mask = mask
+
+    @property
+    def gray(self):
+        return self.color == 'gray'
+
+    def pixel_region(self, frame_shape):
+        """把比例区域换算为截图中的像素区域 (x0, y0, x1, y1)"""
+        if self.region is None:
+            return None
+        frame_h, frame_w = frame_shape[:2]
+        x0, y0, x1, y1 = self.region
+        return (int(x0 * frame_w), int(y0 * frame_h),
+                int(round(x1 * frame_w)), int(round(y1 * frame_h)))
+
+    def __repr__(self):
+        return (f"TemplateSpec({self.name!r}, file={self.file!r}, threshold={self.threshold}, "
+                f"color={self.color!r}, method={self.method!r}, region={self.region}, mask={self.mask!r})")
+
+
+def _validate_region(name, region):
+    if region is None:
+        return None
+    if not isinstance(region, (list, tuple)) or len(region) != 4:
+        raise ManifestError(f"{name}: region必须是 [x0, y0, x1, y1]")
+    try:
+        x0, y0, x1, y1 = (float(v) for v in region)
+    except (TypeError, ValueError):
+        raise ManifestError(f"{name}: region必须是数字")
+    if not (0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1):
+        raise ManifestError(f"{name}: region取值必须在0~1之间且x0<x1、y0<y1")
+    return (x0, y0, x1, y1)
+
+
+def compile_manifest(data, template_dir):
+    """
+    校验清单数据并编译为注册表
+
+    返回:
+        {模板名: TemplateSpec}
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('templates'), dict):
+        raise ManifestError("清单必须包含templates映射")
+
+    defaults = dict(DEFAULT_SPEC)
+    defaults.update(data.get('defaults') or {})
+
+    registry = {}
+    for name, entry in data['templates'].items():
+        name = str(name)
+        entry = entry or {}
+        if not isinstance(entry, dict):
+            raise ManifestError(f"{name}: 模板定义必须是映射")
+
+        unknown = set(entry) - set(DEFAULT_SPEC) - {'file'}
+        if unknown:
+            raise ManifestError(f"{name}: 未知字段 {sorted(unknown)}")
+
+        spec = dict(defaults)
+        spec.update(entry)
+
+        file = spec.get('file') or f"{name}.png"
+        if not os.path.exists(os.path.join(template_dir, file)):
+            raise ManifestError(f"{name}: 模板文件不存在 {file}")
+
+        try:
+            threshold = float(spec['threshold'])
+        except (TypeError, ValueError):
+            raise ManifestError(f"{name}: threshold必须是数字")
+        if not 0 < threshold <= 1:
+            raise ManifestError(f"{name}: threshold必须在(0, 1]之间")
+
+        if spec['color'] not in COLOR_MODES:
+            raise ManifestError(f"{name}: color必须是 {COLOR_MODES} 之一")
+        if spec['method'] not in MATCH_METHODS:
+            raise ManifestError(f"{name}: method必须是 {MATCH_METHODS} 之一")
+
+        mask = spec['mask']
+        if mask is not None and not os.path.exists(os.path.join(template_dir, mask)):
+            raise ManifestError(f"{name}: 掩码文件不存在 {mask}")
+
+        registry[name] = TemplateSpec(
+            name, file,
+            threshold=threshold,
+            color=spec['color'],
+            method=spec['method'],
+            region=_validate_region(name, spec['region']),
+            mask=mask
+        )
+
+    return registry
+
+
+def load_manifest(template_dir, filename=MANIFEST_NAME):
+    """读取并编译模板目录下的YAML清单"""
+    if not YAML_AVAILABLE:
+        raise ManifestError("PyYAML不可用")
+
+    path = os.path.join(template_dir, filename)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        raise ManifestError(f"读取清单失败: {e}")
+
+    return compile_manifest(data, template_dir)
+
+
+def default_registry(template_dir):
+    """没有清单时，为目录下的每个PNG生成默认配置"""
+    registry = {}
+    for filename in sorted(os.listdir(template_dir)):
+        if filename.endswith('.png'):
+            name = filename[:-len('.png')]
+            registry[name] = TemplateSpec(name, filename, **DEFAULT_SPEC)
+    return registry
@@ -0,0 +1,131 @@
+"""
+模板包模块 - 把所有模板预编译为一个未压缩的二进制文件
+每个条目包含BGR像素、灰度图和金字塔层级，
+运行时通过内存映射加载，无需在设备上解码PNG
+
+文件格式:
+    8字节魔数 | 8字节小端头部长度 | JSON头部 | 按64字节对齐的原始数组数据
+"""
+
+import os
+import json
+import struct
+import hashlib
+
+import numpy as np
+
+from numpy_matcher import block_downscale, bgr_to_gray
+
+PACK_MAGIC = b'HSRPACK1'
+PACK_VERSION = 1
+PACK_ALIGN = 64
+TEMPLATE_PACK_NAME = 'templates.pack'
+
+# 预先计算的金字塔缩小倍数
+PACK_PYRAMID_FACTORS = (2, 4, 8)
+
+
+def source_digest(path):
+    """源文件内容的SHA-1（十六进制），用于判断模板包条目是否过期"""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def build_entry(bgr):
+    """为一个BGR模板计算所有派生形式"""
+    arrays = {
+        'bgr': np.ascontiguousarray(bgr, dtype=np.uint8),
+        'gray': np.ascontiguousarray(bgr_to_gray(bgr)),
+    }
+    h, w = bgr.shape[:2]
+    for factor in PACK_PYRAMID_FACTORS:
+        if min(h, w) // factor >= 1:
+            arrays[f'bgr@{factor}'] = np.ascontiguousarray(block_downscale(bgr, factor))
+    return arrays
+
+
+def write_pack(path, templates, sources=None):
+    """
+    写入模板包
+
+    参数:
+        path: 输出文件路径
+        templates: {模板名: BGR数组}
+        sources: {模板名: (源文件名, 源文件字节数, 源文件SHA-1)}，用于运行时判断模板包是否过期
+    """
+    sources = sources or {}
+    header = {'version': PACK_VERSION, 'entries': {}}
+    blobs = []
+    offset = 0
+
+    for name in sorted(templates):
+        arrays = build_entry(templates[name])
+        entry = {}
+        if name in sources:
+            entry['source'], entry['source_size'], entry['source_sha1'] = sources[name]
+        entry['arrays'] = {}
+
+        for key, array in arrays.items():
+            offset = (offset + PACK_ALIGN - 1) // PACK_ALIGN * PACK_ALIGN
+            entry['arrays'][key] = {
+                'offset': offset,
+                'shape': list(array.shape),
+                'dtype': array.dtype.str,
+            }
+            blobs.append((offset, array))
+            offset += array.nbytes
+
+        header['entries'][name] = entry
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = len(PACK_MAGIC) + 8 + len(header_bytes)
+    data_start = (data_start + PACK_ALIGN - 1) // PACK_ALIGN * PACK_ALIGN
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PACK_MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for blob_offset, array in blobs:
+            f.seek(data_start + blob_offset)
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+    return len(header['entries'])
+
+
+def load_pack(path):
+    """
+    内存映射方式加载模板包
+
+    返回:
+        {模板名: {'arrays': {键: 只读数组视图},
+                 'source': 源文件名, 'source_size': 源文件字节数, 'source_sha1': 源文件SHA-1}}
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(PACK_MAGIC))
+        if magic != PACK_MAGIC:
+            raise ValueError(f"不是有效的模板包: {path}")
+        header_len = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_len).decode('utf-8'))
+
+    if header.get('version') != PACK_VERSION:
+        raise ValueError(f"模板包版本不兼容: {header.get('version')}")
+
+    data_start = len(PACK_MAGIC) + 8 + header_len
+    data_start = (data_start + PACK_ALIGN - 1) // PACK_ALIGN * PACK_ALIGN
+    mapped = np.memmap(path, dtype=np.uint8, mode='r')
+
+    entries = {}
+    for name, entry in header['entries'].items():
+        arrays = {}
+        for key, info in entry['arrays'].items():
+            dtype = np.dtype(info['dtype'])
+            count = int(np.prod(info['shape']))
+            start = data_start + info['offset']
+            arrays[key] = mapped[start:start + count * dtype.itemsize].view(dtype).reshape(info['shape'])
+        loaded = dict(entry)
+        loaded['arrays'] = arrays
+        entries[name] = loaded
+
+    return entries
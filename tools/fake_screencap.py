@@ -0,0 +1,69 @@
+"""
+screencap模拟程序 - 在Linux上代替Android的screencap命令
+按screencap原始格式（头部 + RGBA像素）向标准输出写一帧合成画面，
+用于在桌面环境下调试常驻shell截图（ShellCaptureWorker）
+
+用法:
+    python tools/fake_screencap.py [--width W] [--height H] [--header 12|16] [--image 图片] [--fail]
+
+示例:
+    ShellCaptureWorker(command='python3 tools/fake_screencap.py --width 1080 --height 2400')
+"""
+
+import sys
+import time
+import struct
+import argparse
+
+import numpy as np
+
+RGBA_8888 = 1
+
+
+def synthetic_frame(width, height):
+    """生成随时间变化的渐变画面，相邻两次调用的画面不同"""
+    phase = int(time.time() * 1000) % 256
+    frame = np.empty((height, width, 4), dtype=np.uint8)
+    frame[:, :, 0] = (np.arange(width, dtype=np.uint32)[None, :] + phase) % 256
+    frame[:, :, 1] = (np.arange(height, dtype=np.uint32)[:, None] // 4) % 256
+    frame[:, :, 2] = phase
+    frame[:, :, 3] = 255
+    return frame
+
+
+def image_frame(path):
+    """把图片文件转换为RGBA帧"""
+    from PIL import Image
+    with Image.open(path) as image:
+        return np.asarray(image.convert('RGBA'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='输出screencap原始格式的合成画面')
+    parser.add_argument('--width', type=int, default=1080)
+    parser.add_argument('--height', type=int, default=2400)
+    parser.add_argument('--header', type=int, choices=(12, 16), default=16,
+                        help='头部长度：Android 9以下为12，以上为16（含色彩空间）')
+    parser.add_argument('--image', help='输出指定图片而不是合成画面')
+    parser.add_argument('--fail', action='store_true', help='不输出画面并以非0退出码结束')
+    args = parser.parse_args()
+
+    if args.fail:
+        return 1
+
+    frame = image_frame(args.image) if args.image else synthetic_frame(args.width, args.height)
+    height, width = frame.shape[:2]
+
+    header = struct.pack('<III', width, height, RGBA_8888)
+    if args.header == 16:
+        header += struct.pack('<I', 0)
+
+    out = sys.stdout.buffer
+    out.write(header)
+    out.write(np.ascontiguousarray(frame).tobytes())
+    out.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())